@@ -1,23 +1,28 @@
 """认证API路由"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from config import settings
-from database.db import get_db
+from database.db import get_db, AsyncSessionLocal
 from database.models import User
+from services.auth_cache import auth_cache
+from services.executor import ExecutorSaturated, auth_executor
 
 router = APIRouter(prefix="/auth", tags=["认证"])
 
 # 密码哈希
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# 各客户端IP进行中的登录数
+_logins_in_flight: Dict[str, int] = {}
+
 # OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/auth/login")
 
@@ -41,6 +46,24 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """在密码哈希线程池中校验密码, 不在事件循环中执行bcrypt; 线程池排满时抛出 ExecutorSaturated"""
+    return await auth_executor.run(verify_password, plain_password, hashed_password)
+
+def client_ip(request: Request) -> str:
+    """客户端IP; 经由受信任的反向代理(nginx)转发时取 X-Real-IP"""
+    host = request.client.host if request.client else ""
+    if host in settings.AUTH_TRUSTED_PROXIES:
+        return request.headers.get("x-real-ip", host)
+    return host
+
+def too_many_logins(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": "1"},
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -51,50 +74,91 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="无法验证凭据",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
+async def authenticate_token(token: str) -> Optional[User]:
+    """
+    验证token并返回用户, 无效时返回None
+    已验证过的token和活跃用户命中缓存时不校验签名、不查询数据库
+    """
+    username = auth_cache.get_token(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except JWTError:
+            return None
+        username = payload.get("sub")
         if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    
-    stmt = select(User).where(User.username == token_data.username)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
+            return None
+        if payload.get("exp"):
+            auth_cache.put_token(token, username, payload["exp"])
     
+    user = auth_cache.get_user(username)
     if user is None:
-        raise credentials_exception
+        async with AsyncSessionLocal() as session:
+            stmt = select(User).where(User.username == username)
+            result = await session.execute(stmt)
+            user = result.scalar_one_or_none()
+        if user is None:
+            return None
+        user = auth_cache.put_user(user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    user = await authenticate_token(token)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无法验证凭据",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="用户已被禁用")
+    return user
+
+async def get_websocket_user(websocket: WebSocket) -> Optional[User]:
+    """WebSocket无法携带Authorization头, 从查询参数token中验证用户"""
+    token = websocket.query_params.get("token")
+    if not token:
+        return None
+    user = await authenticate_token(token)
+    if user is None or not user.is_active:
+        return None
     return user
 
 # API路由
 @router.post("/login", response_model=Token)
 async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)
 ):
-    """用户登录"""
-    stmt = select(User).where(User.username == form_data.username)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
+    """用户登录 (同一IP同时进行的登录数和密码校验队列都有上限, 超出时返回429)"""
+    ip = client_ip(request)
+    if _logins_in_flight.get(ip, 0) >= settings.AUTH_LOGIN_PER_IP_CONCURRENCY:
+        raise too_many_logins("登录请求过于频繁, 请稍后重试")
+    _logins_in_flight[ip] = _logins_in_flight.get(ip, 0) + 1
+    try:
+        stmt = select(User).where(User.username == form_data.username)
+        result = await db.execute(stmt)
+        user = result.scalar_one_or_none()
+        
+        try:
+            valid = user is not None and await verify_password_async(form_data.password, user.hashed_password)
+        except ExecutorSaturated:
+            raise too_many_logins("登录服务繁忙, 请稍后重试")
+    finally:
+        _logins_in_flight[ip] -= 1
+        if not _logins_in_flight[ip]:
+            del _logins_in_flight[ip]
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码错误",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # 登录时以数据库中的最新数据刷新用户缓存
+    auth_cache.put_user(user)
     if not user.is_active:
         raise HTTPException(status_code=400, detail="用户已被禁用")
     
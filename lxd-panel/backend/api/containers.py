@@ -1,13 +1,22 @@
 """容器API路由"""
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from pydantic import BaseModel
-from typing import List, Optional
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Request, WebSocket
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from config import settings
 from database.db import get_db
 from database.models import User
-from services.lxd_service import lxd_service
-from api.auth import get_current_user
+from services.console import console_service
+from services.file_transfer import FileDownload, LXDFileError, file_transfers
+from services.image_cache import image_cache
+from services.lxd_service import async_lxd_service
+from services.port_allocator import PortConflict, port_allocator
+from services.template_service import is_template
+from api.auth import get_current_user, get_websocket_user
 
 router = APIRouter(prefix="/containers", tags=["容器管理"])
 
@@ -19,11 +28,37 @@ class ContainerCreate(BaseModel):
     disk: int
     os_type: str
     os_version: str
-    ssh_port: int
+    ssh_port: int = 0  # 0表示不转发SSH端口, 通过面板的Web终端访问
     nat_start: int = 0
     nat_end: int = 0
     bandwidth: int = 10
 
+class BulkContainerCreate(BaseModel):
+    name_pattern: str  # 如 web-{n:02d}
+    count: int = Field(..., ge=1)
+    start_index: int = Field(1, ge=0)
+    cpu: float
+    memory: int
+    disk: int
+    os_type: str
+    os_version: str
+    bandwidth: int = 10
+    ssh: bool = True  # 为每台容器分配SSH转发端口; 关闭时通过面板的Web终端访问
+    nat_size: int = Field(0, ge=0, le=1000)  # 每台容器的NAT端口数, 0表示不分配
+    ssh_port_min: int = Field(20001, ge=1, le=65535)
+    ssh_port_max: int = Field(29999, ge=1, le=65535)
+    nat_port_min: int = Field(30000, ge=1, le=65535)
+    parallelism: Optional[int] = Field(None, ge=1, le=32)
+
+class BulkAction(BaseModel):
+    action: Literal['start', 'stop', 'restart', 'delete']
+    # 选择器: 可任意组合, 同时满足; 至少指定一个
+    names: Optional[List[str]] = None
+    status: Optional[str] = None  # 如 Running / Stopped
+    pattern: Optional[str] = None  # 通配符, 如 web-*
+    force: bool = False  # 停止时不等待正常关机
+    concurrency: Optional[int] = Field(None, ge=1, le=100)
+
 class ContainerInfo(BaseModel):
     name: str
     status: str
@@ -36,59 +71,196 @@ class ContainerInfo(BaseModel):
 class MessageResponse(BaseModel):
     message: str
 
+class JobSubmitResponse(BaseModel):
+    message: str
+    job_id: str
+
 # API路由
 @router.get("", response_model=List[ContainerInfo])
 async def list_containers(current_user: User = Depends(get_current_user)):
-    """获取所有容器列表"""
-    return lxd_service.get_all_containers()
+    """获取所有容器列表 (不含模板容器)"""
+    containers = await async_lxd_service.get_all_containers()
+    return [c for c in containers if not is_template(c['name'])]
+
+@router.get("/ports/allocations")
+async def list_port_allocations(current_user: User = Depends(get_current_user)):
+    """各容器已分配的主机端口"""
+    return await port_allocator.allocations()
+
+@router.get("/ports/free")
+async def suggest_free_ports(
+    size: int = Query(1, ge=1, le=65535, description="需要的连续端口数"),
+    start: Optional[int] = Query(None, ge=1, le=65535, description="搜索起点, 默认 PORT_ALLOCATION_MIN"),
+    end: Optional[int] = Query(None, ge=1, le=65535, description="搜索终点, 默认 PORT_ALLOCATION_MAX"),
+    current_user: User = Depends(get_current_user)
+):
+    """推荐下一段长度为size的空闲端口"""
+    port = await port_allocator.suggest(size, start, end)
+    if port is None:
+        raise HTTPException(status_code=404, detail=f"没有长度为 {size} 的空闲端口段")
+    return {"start": port, "end": port + size - 1}
 
-@router.post("", response_model=MessageResponse)
+@router.get("/images/cache")
+async def get_image_cache(current_user: User = Depends(get_current_user)):
+    """本地镜像缓存状态"""
+    return image_cache.status()
+
+@router.post("/images/cache/refresh", response_model=MessageResponse)
+async def refresh_image_cache(current_user: User = Depends(get_current_user)):
+    """立即在后台刷新全部缓存镜像"""
+    if not image_cache.refresh_now():
+        return {"message": "镜像刷新正在进行"}
+    return {"message": "镜像刷新已开始"}
+
+@router.get("/files/transfers")
+async def list_file_transfers(current_user: User = Depends(get_current_user)):
+    """本进程中进行中和最近完成的文件传输, 含吞吐(MB/s)"""
+    return {
+        "stats": file_transfers.stats(),
+        "transfers": file_transfers.active(),
+        "recent": file_transfers.recent()
+    }
+
+@router.post("", response_model=JobSubmitResponse)
 async def create_container(
     config: ContainerCreate,
     current_user: User = Depends(get_current_user)
 ):
     """
-    创建容器 - 完全通过Web面板实现
+    创建容器 - 提交后台任务后立即返回任务ID
+    通过 /api/jobs/{job_id} 查询进度, 完成后结果中包含IP和root密码
     """
     try:
         from services.container_creator import container_creator
+        from services.job_service import job_service
+        
+        if is_template(config.name):
+            raise HTTPException(status_code=400, detail="容器名不能以模板前缀 tpl- 开头")
         
         # 验证容器名是否已存在
-        existing = lxd_service.get_container(config.name)
+        existing = await async_lxd_service.get_container(config.name)
         if existing:
             raise HTTPException(status_code=400, detail=f"容器 {config.name} 已存在")
         
-        # 调用创建服务（同步调用，因为需要返回密码等信息）
-        result = container_creator.create_container(
-            name=config.name,
-            cpu=config.cpu,
-            memory=config.memory,
-            disk=config.disk,
-            os_type=config.os_type,
-            os_version=config.os_version,
-            ssh_port=config.ssh_port,
-            nat_start=config.nat_start,
-            nat_end=config.nat_end,
-            bandwidth=config.bandwidth
-        )
+        # 分配端口, 与其他容器重叠时拒绝
+        try:
+            await port_allocator.reserve(config.name, config.ssh_port, config.nat_start, config.nat_end)
+        except PortConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
         
-        if result['success']:
-            # 返回包含密码等重要信息的详细消息
-            data = result.get('data', {})
-            message = f"容器创建成功！\n\n连接信息：\nIP: {data.get('ip', 'N/A')}\nSSH端口: {data.get('ssh_port', 22)}\nroot密码: {data.get('password', 'N/A')}\n\n请妥善保管密码！"
-            return {"message": message}
-        else:
-            raise HTTPException(status_code=500, detail=result['message'])
+        params = config.model_dump()
+        params['password'] = container_creator.generate_password()
+        try:
+            job = await job_service.submit('create_container', params, current_user.username)
+        except Exception:
+            await port_allocator.release(config.name)
+            raise
+        return {"message": f"容器 {config.name} 创建任务已提交", "job_id": job['id']}
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"创建容器失败: {str(e)}")
 
+@router.post("/bulk")
+async def bulk_create_containers(
+    spec: BulkContainerCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    批量创建容器 - 按名称模板生成count个容器名, 自动分配SSH端口和NAT端口段,
+    提交一个 bulk_create 后台任务后立即返回任务ID和每台容器的端口;
+    任务结果中包含每台容器的状态、IP和root密码
+    """
+    from services.bulk_service import expand_names
+    from services.container_creator import container_creator
+    from services.job_service import job_service
+    
+    if spec.count > settings.BULK_CREATE_MAX_COUNT:
+        raise HTTPException(status_code=400, detail=f"单次最多创建 {settings.BULK_CREATE_MAX_COUNT} 个容器")
+    try:
+        names = expand_names(spec.name_pattern, spec.count, spec.start_index)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if any(is_template(name) for name in names):
+        raise HTTPException(status_code=400, detail="容器名不能以模板前缀 tpl- 开头")
+    
+    try:
+        existing = {c['name'] for c in await async_lxd_service.get_all_containers()}
+        conflicts = [name for name in names if name in existing]
+        if conflicts:
+            raise HTTPException(status_code=400, detail=f"容器已存在: {', '.join(conflicts)}")
+        
+        # 整批分配端口, 空闲端口不足时整批拒绝
+        try:
+            ports = await port_allocator.allocate_many(
+                names, spec.nat_size,
+                spec.ssh_port_min, spec.ssh_port_max, spec.nat_port_min, ssh=spec.ssh
+            )
+        except PortConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        
+        params = spec.model_dump(exclude={'name_pattern', 'count', 'start_index', 'ssh', 'nat_size',
+                                          'ssh_port_min', 'ssh_port_max', 'nat_port_min'})
+        params['items'] = [
+            {
+                'name': name,
+                'ssh_port': ports[name]['ssh_port'] or 0,
+                'nat_start': ports[name]['nat_start'] or 0,
+                'nat_end': ports[name]['nat_end'] or 0,
+                'password': container_creator.generate_password()
+            }
+            for name in names
+        ]
+        try:
+            job = await job_service.submit('bulk_create', params, current_user.username)
+        except Exception:
+            for name in names:
+                await port_allocator.release(name)
+            raise
+        return {
+            "message": f"批量创建任务已提交, 共 {len(names)} 个容器",
+            "job_id": job['id'],
+            "items": [{k: v for k, v in item.items() if k != 'password'} for item in params['items']]
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"批量创建容器失败: {str(e)}")
+
+@router.post("/bulk/actions")
+async def bulk_container_action(
+    spec: BulkAction,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    批量启动/停止/重启/删除 - 按选择器筛选容器, 提交一个 bulk_operation 后台任务后立即返回;
+    任务结果中包含每台容器的结果 (succeeded / skipped / failed) 及汇总数量
+    """
+    from services.bulk_service import select_containers
+    from services.job_service import job_service
+    
+    if spec.names is None and not spec.status and not spec.pattern:
+        raise HTTPException(status_code=400, detail="请至少指定 names、status、pattern 中的一个")
+    
+    containers = await async_lxd_service.get_all_containers()
+    names = select_containers(containers, spec.names, spec.status, spec.pattern)
+    if not names:
+        raise HTTPException(status_code=404, detail="没有匹配的容器")
+    
+    params = {'action': spec.action, 'names': names, 'force': spec.force, 'concurrency': spec.concurrency}
+    job = await job_service.submit('bulk_operation', params, current_user.username)
+    return {
+        "message": f"批量{spec.action}任务已提交, 共 {len(names)} 个容器",
+        "job_id": job['id'],
+        "containers": names
+    }
+
 @router.post("/{name}/start", response_model=MessageResponse)
 async def start_container(name: str, current_user: User = Depends(get_current_user)):
     """启动容器"""
-    result = lxd_service.start_container(name)
+    result = await async_lxd_service.start_container(name)
     if result:
         return {"message": f"容器 {name} 启动成功"}
     raise HTTPException(status_code=500, detail="启动失败")
@@ -96,7 +268,7 @@ async def start_container(name: str, current_user: User = Depends(get_current_us
 @router.post("/{name}/stop", response_model=MessageResponse)
 async def stop_container(name: str, current_user: User = Depends(get_current_user)):
     """停止容器"""
-    result = lxd_service.stop_container(name)
+    result = await async_lxd_service.stop_container(name)
     if result:
         return {"message": f"容器 {name} 停止成功"}
     raise HTTPException(status_code=500, detail="停止失败")
@@ -104,7 +276,7 @@ async def stop_container(name: str, current_user: User = Depends(get_current_use
 @router.post("/{name}/restart", response_model=MessageResponse)
 async def restart_container(name: str, current_user: User = Depends(get_current_user)):
     """重启容器"""
-    result = lxd_service.restart_container(name)
+    result = await async_lxd_service.restart_container(name)
     if result:
         return {"message": f"容器 {name} 重启成功"}
     raise HTTPException(status_code=500, detail="重启失败")
@@ -112,15 +284,130 @@ async def restart_container(name: str, current_user: User = Depends(get_current_
 @router.delete("/{name}", response_model=MessageResponse)
 async def delete_container(name: str, current_user: User = Depends(get_current_user)):
     """删除容器"""
-    result = lxd_service.delete_container(name)
+    result = await async_lxd_service.delete_container(name)
     if result:
+        await port_allocator.release(name)
         return {"message": f"容器 {name} 删除成功"}
     raise HTTPException(status_code=500, detail="删除失败")
 
+@router.websocket("/{name}/console")
+async def container_console(websocket: WebSocket, name: str, cols: int = 80, rows: int = 24):
+    """
+    Web终端 (token通过查询参数传递) - 桥接到LXD的交互式exec, 不需要容器开放SSH端口
+    二进制帧为终端字节流; 文本帧为控制消息, 如 {"type": "resize", "cols": 120, "rows": 40}
+    """
+    user = await get_websocket_user(websocket)
+    if user is None:
+        await websocket.close(code=1008, reason="无法验证凭据")
+        return
+    
+    if not console_service.reserve():
+        await websocket.close(code=1013, reason="终端会话数已达上限")
+        return
+    try:
+        await _console(websocket, name, cols, rows, user.username)
+    finally:
+        console_service.release()
+
+async def _console(websocket: WebSocket, name: str, cols: int, rows: int, username: str):
+    container = await async_lxd_service.get_container(name)
+    if not container or container['status'] != 'Running':
+        await websocket.close(code=1011, reason="容器不存在或未运行")
+        return
+    
+    try:
+        session = await console_service.open(name, cols, rows)
+    except Exception as e:
+        print(f"打开容器 {name} 的终端失败: {str(e)}")
+        await websocket.close(code=1011, reason="无法启动终端")
+        return
+    
+    await websocket.accept()
+    reason = await console_service.run(websocket, session, username)
+    try:
+        await websocket.close(code=1000, reason="会话已结束" if reason == 'exited' else "")
+    except Exception:
+        pass
+
+class DownloadResponse(StreamingResponse):
+    """无论响应体是否发出(客户端可能在第一块之前断开), 结束时都释放传输名额并关闭LXD连接"""
+
+    def __init__(self, download: FileDownload):
+        super().__init__(download.body, status_code=download.status, headers=download.headers)
+        self.download = download
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.download.aclose()
+
+def _check_transfer(path: str):
+    if not path.startswith('/'):
+        raise HTTPException(status_code=400, detail="path必须是容器内的绝对路径")
+    if file_transfers.full:
+        file_transfers.reject()
+        raise HTTPException(status_code=503, detail="文件传输数已达上限, 请稍后重试")
+
+def _transfer_error(action: str, error: Exception) -> HTTPException:
+    if isinstance(error, LXDFileError):
+        status = error.status if 400 <= error.status < 500 else 502
+        return HTTPException(status_code=status, detail=f"{action}失败: {str(error)}")
+    if isinstance(error, ConnectionError):
+        return HTTPException(status_code=502, detail=f"{action}失败, LXD断开了连接: {str(error)}")
+    return HTTPException(status_code=502, detail=f"{action}失败, 无法连接LXD: {str(error) or type(error).__name__}")
+
+@router.get("/{name}/files")
+async def download_file(
+    name: str,
+    request: Request,
+    path: str = Query(..., description="容器内的绝对路径"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    从容器下载文件 (分块流式转发, 不在内存中缓冲整个文件)
+    支持 Range 请求头断点续传; path为目录时返回LXD的目录列表
+    """
+    _check_transfer(path)
+    try:
+        download = await file_transfers.download(name, path, request.headers.get('range'), current_user.username)
+    except (LXDFileError, OSError, asyncio.TimeoutError) as e:
+        raise _transfer_error("下载", e)
+    if download.body is None:
+        return Response(status_code=download.status, headers=download.headers)
+    return DownloadResponse(download)
+
+@router.post("/{name}/files")
+async def upload_file(
+    name: str,
+    request: Request,
+    path: str = Query(..., description="容器内的绝对路径"),
+    mode: str = Query("0644", pattern=r"^[0-7]{3,4}$", description="八进制权限"),
+    uid: int = Query(0, ge=0),
+    gid: int = Query(0, ge=0),
+    append: bool = Query(False, description="追加到已有文件末尾, 用于续传"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    上传文件到容器: 请求体即文件内容 (application/octet-stream), 分块流式转发给LXD
+    返回写入的字节数、耗时和吞吐(MB/s)
+    """
+    _check_transfer(path)
+    content_length = request.headers.get('content-length')
+    try:
+        return await file_transfers.upload(
+            name, path, request.stream(), int(content_length) if content_length else None,
+            uid, gid, mode, append, current_user.username
+        )
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="上传中断")
+    except (LXDFileError, OSError, asyncio.TimeoutError) as e:
+        raise _transfer_error("上传", e)
+
 @router.get("/{name}", response_model=ContainerInfo)
 async def get_container(name: str, current_user: User = Depends(get_current_user)):
     """获取容器详情"""
-    container = lxd_service.get_container(name)
+    container = await async_lxd_service.get_container(name)
     if container:
         return container
     raise HTTPException(status_code=404, detail="容器不存在")
@@ -0,0 +1,102 @@
+"""后台任务API路由"""
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+
+from database.models import User
+from services.job_service import job_service, TERMINAL_STATUSES
+from api.auth import get_current_user, get_websocket_user
+from config import settings
+
+router = APIRouter(prefix="/jobs", tags=["任务"])
+
+async def _next_update(job_id: str, queue: asyncio.Queue, current: dict):
+    """
+    等待任务的下一次进度变化, 超时返回None
+    任务可能由其他进程执行(本进程收不到推送), 超时后从数据库重新读取一次
+    """
+    timeout = 15 if job_service.is_runner else settings.JOB_POLL_INTERVAL * 2
+    try:
+        return await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        latest = await job_service.get(job_id)
+        if latest and latest['updated_at'] != current['updated_at']:
+            return latest
+        return None
+
+async def _final(job_id: str, update: dict, username: str) -> dict:
+    """任务结束时重新读取一次, 向提交者附带结果中的密码"""
+    if update['status'] not in TERMINAL_STATUSES:
+        return update
+    return await job_service.get(job_id, reveal_to=username) or update
+
+# API路由
+@router.get("")
+async def list_jobs(limit: int = 50, current_user: User = Depends(get_current_user)):
+    """获取最近的任务"""
+    return await job_service.list(min(max(limit, 1), 500))
+
+@router.get("/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """获取任务状态; 任务结果中的密码只返回给提交者一次"""
+    job = await job_service.get(job_id, reveal_to=current_user.username)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, current_user: User = Depends(get_current_user)):
+    """以SSE推送任务阶段进度, 任务结束后关闭"""
+    job = await job_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def stream():
+        queue = job_service.subscribe(job_id)
+        try:
+            # 订阅后重新读取一次, 避免错过订阅前的状态变化
+            current = await job_service.get(job_id, reveal_to=current_user.username)
+            yield f"data: {json.dumps(current)}\n\n"
+            while current['status'] not in TERMINAL_STATUSES:
+                update = await _next_update(job_id, queue, current)
+                if update:
+                    current = await _final(job_id, update, current_user.username)
+                    yield f"data: {json.dumps(current)}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            job_service.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws/{job_id}")
+async def job_websocket(websocket: WebSocket, job_id: str):
+    """以WebSocket推送任务阶段进度 (token通过查询参数传递)"""
+    user = await get_websocket_user(websocket)
+    if not user:
+        await websocket.close(code=1008, reason="无法验证凭据")
+        return
+
+    await websocket.accept()
+    queue = job_service.subscribe(job_id)
+    try:
+        current = await job_service.get(job_id, reveal_to=user.username)
+        if not current:
+            await websocket.close(code=1008, reason="任务不存在")
+            return
+        await websocket.send_json(current)
+        while current['status'] not in TERMINAL_STATUSES:
+            update = await _next_update(job_id, queue, current)
+            if update:
+                current = await _final(job_id, update, user.username)
+                await websocket.send_json(current)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        job_service.unsubscribe(job_id, queue)
@@ -1,16 +1,30 @@
 """监控数据API路由"""
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from typing import List, Dict
+from fastapi import APIRouter, Depends, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+from typing import List, Dict, Optional
 import asyncio
 import json
 
 from database.models import User
-from services.monitor_service import monitor_service
-from api.auth import get_current_user
+from services.monitor_service import monitor_service, history_metrics, select_tier, tier_retention_hours
+from services.downsample import MIN_POINTS
+from services.history_format import FORMATS, encode_binary, to_columnar
+from services.live_stats import live_stats
+from api.auth import get_current_user, get_websocket_user
+from config import settings
 
 router = APIRouter(prefix="/monitoring", tags=["监控"])
 
+MAX_POINTS = 10000  # 单次历史查询允许的最大降采样点数
+MAX_BATCH_CONTAINERS = 100  # 批量历史查询的最大容器数
+KEEPALIVE_MESSAGE = json.dumps({'type': 'keepalive'})
+
 # API路由
+@router.get("/collector/status")
+async def get_collector_status(current_user: User = Depends(get_current_user)):
+    """获取采集器每轮耗时与跳过的容器数"""
+    return monitor_service.get_collector_status()
+
 @router.get("/{name}/current")
 async def get_current_stats(name: str, current_user: User = Depends(get_current_user)):
     """获取容器当前资源使用情况"""
@@ -22,34 +36,179 @@ async def get_current_stats(name: str, current_user: User = Depends(get_current_
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取监控数据失败: {str(e)}")
 
+def _history_tier(hours: int, max_points: Optional[int], format: str) -> str:
+    """校验历史查询参数并返回所用的存储层"""
+    tier = select_tier(hours)
+    if hours < 1 or tier is None:
+        max_hours = max(tier_retention_hours().values())
+        raise HTTPException(status_code=400, detail=f"小时数必须在1-{max_hours}之间")
+    if max_points is not None and not MIN_POINTS <= max_points <= MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"max_points必须在{MIN_POINTS}-{MAX_POINTS}之间")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format必须是 {', '.join(FORMATS)} 之一")
+    return tier
+
+@router.get("/history")
+async def get_batch_history(
+    names: str,
+    hours: int = 24,
+    max_points: Optional[int] = None,
+    format: str = "columnar",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    一次获取多个容器的历史数据 (names 为逗号分隔的容器名)
+    columnar 返回 {容器名: 列式数据}; binary 返回各容器的帧依次拼接
+    """
+    tier = _history_tier(hours, max_points, format)
+    if format == "rows":
+        raise HTTPException(status_code=400, detail="批量查询仅支持 columnar 或 binary 格式")
+    container_names = [name for name in names.split(',') if name]
+    if not container_names or len(container_names) > MAX_BATCH_CONTAINERS:
+        raise HTTPException(status_code=400, detail=f"容器数必须在1-{MAX_BATCH_CONTAINERS}之间")
+    
+    try:
+        metrics = history_metrics(tier)
+        headers = {"X-Monitoring-Tier": tier}
+        if format == "binary":
+            frames = []
+            for name in container_names:
+                rows = await monitor_service.get_history_rows(name, hours, tier, max_points)
+                frames.append(encode_binary(name, rows, metrics))
+            return Response(b''.join(frames), media_type="application/octet-stream", headers=headers)
+        
+        result = {}
+        for name in container_names:
+            rows = await monitor_service.get_history_rows(name, hours, tier, max_points)
+            result[name] = to_columnar(rows, metrics)
+        return JSONResponse({'tier': tier, 'containers': result}, headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取历史数据失败: {str(e)}")
+
 @router.get("/{name}/history")
-async def get_history_stats(name: str, hours: int = 24, current_user: User = Depends(get_current_user)):
-    """获取容器历史监控数据"""
+async def get_history_stats(
+    name: str,
+    response: Response,
+    hours: int = 24,
+    max_points: Optional[int] = None,
+    format: str = "rows",
+    current_user: User = Depends(get_current_user)
+):
+    """
+    获取容器历史监控数据
+    根据时长自动选择存储层: 原始样本 / 5分钟汇总 / 1小时汇总, 所用层通过 X-Monitoring-Tier 响应头返回
+    max_points 限制返回的行数, 超出时按LTTB保留曲线形状降采样
+    format: rows (默认, 逐行对象) / columnar (列式JSON) / binary (float32二进制帧)
+    """
+    tier = _history_tier(hours, max_points, format)
     try:
-        if hours < 1 or hours > 24:
-            raise HTTPException(status_code=400, detail="小时数必须在1-24之间")
+        if format == "rows":
+            stats = await monitor_service.get_history_stats(name, hours, tier, max_points)
+            response.headers["X-Monitoring-Tier"] = tier
+            return stats
         
-        stats = await monitor_service.get_history_stats(name, hours)
-        return stats
+        rows = await monitor_service.get_history_rows(name, hours, tier, max_points)
+        headers = {"X-Monitoring-Tier": tier}
+        if format == "binary":
+            body = encode_binary(name, rows, history_metrics(tier))
+            return Response(body, media_type="application/octet-stream", headers=headers)
+        return JSONResponse({'tier': tier, **to_columnar(rows, history_metrics(tier))}, headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取历史数据失败: {str(e)}")
 
+async def _until_disconnect(websocket: WebSocket, sender, receiver=None):
+    """
+    运行推送协程直到客户端断开, 空闲时也能及时发现断开并释放订阅
+    receiver 处理客户端消息并在断开时返回, 默认只等待断开
+    """
+    async def wait_disconnect():
+        while (await websocket.receive())['type'] != 'websocket.disconnect':
+            pass
+    
+    tasks = [asyncio.create_task(sender), asyncio.create_task(receiver or wait_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = task.exception()
+            if error and not isinstance(error, WebSocketDisconnect):
+                raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+@router.websocket("/ws")
+async def monitoring_stream(websocket: WebSocket):
+    """
+    多容器实时监控WebSocket (token通过查询参数传递)
+    客户端发送 {"action": "subscribe", "containers": ["a", "b"]} 或 {"action": "subscribe", "containers": "all"}
+    修改订阅; 服务端先推送 snapshot 帧, 之后每轮采集推送一个只含变化字段的 delta 帧
+    客户端发送 {"action": "watch", "containers": ["a"]} 声明正在查看详情的容器, 采集器对其高频采样
+    """
+    user = await get_websocket_user(websocket)
+    if not user:
+        await websocket.close(code=1008, reason="无法验证凭据")
+        return
+    
+    await websocket.accept()
+    stream = live_stats.open_stream(set())
+    
+    async def send_updates():
+        while True:
+            try:
+                message = await asyncio.wait_for(stream.queue.get(), timeout=settings.WS_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                message = KEEPALIVE_MESSAGE
+            await websocket.send_text(message)
+    
+    async def receive_commands():
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            try:
+                command = json.loads(message.get('text') or '{}')
+            except ValueError:
+                continue
+            if command.get('action') == 'subscribe':
+                containers = command.get('containers')
+                names = None if containers == 'all' else set(containers or [])
+                live_stats.update_stream(stream, names)
+            elif command.get('action') == 'watch':
+                live_stats.watch(stream, set(command.get('containers') or []))
+    
+    try:
+        await _until_disconnect(websocket, send_updates(), receive_commands())
+    except Exception as e:
+        print(f"WebSocket错误: {str(e)}")
+    finally:
+        live_stats.close_stream(stream)
+
 @router.websocket("/ws/{name}")
 async def monitoring_websocket(websocket: WebSocket, name: str):
-    """实时监控数据WebSocket"""
+    """
+    实时监控数据WebSocket (token通过查询参数传递)
+    每当采集器产生该容器的新样本时推送一次, 无数据时定期发送保活消息
+    """
+    user = await get_websocket_user(websocket)
+    if not user:
+        await websocket.close(code=1008, reason="无法验证凭据")
+        return
+    
     await websocket.accept()
+    queue = live_stats.subscribe(name)
     
-    try:
+    async def send_updates():
         while True:
-            # 获取最新数据
-            stats = await monitor_service.get_current_stats(name)
-            if stats:
-                await websocket.send_json(stats)
-            
-            # 每5秒推送一次
-            await asyncio.sleep(5)
-    except WebSocketDisconnect:
-        print(f"WebSocket断开连接: {name}")
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=settings.WS_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                message = KEEPALIVE_MESSAGE
+            await websocket.send_text(message)
+    
+    try:
+        await _until_disconnect(websocket, send_updates())
     except Exception as e:
         print(f"WebSocket错误: {str(e)}")
-        await websocket.close()
+    finally:
+        live_stats.unsubscribe(name, queue)
@@ -0,0 +1,39 @@
+"""容器模板API路由"""
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+
+from database.models import User
+from services.template_service import async_template_service, is_template, template_name
+from api.auth import get_current_user
+
+router = APIRouter(prefix="/templates", tags=["容器模板"])
+
+class TemplateBake(BaseModel):
+    os_type: str
+    os_version: str
+
+@router.get("")
+async def list_templates(current_user: User = Depends(get_current_user)):
+    """获取所有模板及其是否已制作完成"""
+    return await async_template_service.list_templates()
+
+@router.post("")
+async def bake_template(config: TemplateBake, current_user: User = Depends(get_current_user)):
+    """
+    制作(或重新制作)系统模板 - 提交后台任务后立即返回任务ID
+    完成后创建该系统的容器时从模板快照复制
+    """
+    from services.job_service import job_service
+    
+    job = await job_service.submit('bake_template', config.model_dump(), current_user.username)
+    name = template_name(config.os_type, config.os_version)
+    return {"message": f"模板 {name} 制作任务已提交", "job_id": job['id']}
+
+@router.delete("/{name}")
+async def delete_template(name: str, current_user: User = Depends(get_current_user)):
+    """删除模板 (已从模板复制的容器不受影响)"""
+    if not is_template(name):
+        raise HTTPException(status_code=400, detail=f"{name} 不是模板")
+    if not await async_template_service.delete_template(name):
+        raise HTTPException(status_code=404, detail="模板不存在")
+    return {"message": f"模板 {name} 已删除"}
@@ -1,67 +1,85 @@
 """VNC访问API路由"""
 from fastapi import APIRouter, Depends, HTTPException, WebSocket
 from pydantic import BaseModel
-import secrets
 
+from config import settings
 from database.models import User
 from api.auth import get_current_user
+from services.lxd_service import async_lxd_service
+from services.vnc_proxy import vnc_proxy, vnc_tokens
 
 router = APIRouter(prefix="/vnc", tags=["VNC"])
 
-# 临时存储VNC令牌 (生产环境应使用Redis)
-vnc_tokens = {}
-
 class VNCToken(BaseModel):
     token: str
     container_name: str
+    expires_in: int
+    path: str
 
 @router.get("/{name}/token", response_model=VNCToken)
 async def get_vnc_token(name: str, current_user: User = Depends(get_current_user)):
     """
-    获取VNC访问令牌
+    获取VNC访问令牌 (一次性使用, VNC_TOKEN_TTL 秒内有效)
     注意: VNC功能需要在容器中安装VNC服务器
     """
-    # 生成令牌
-    token = secrets.token_urlsafe(32)
-    vnc_tokens[token] = {
-        'container_name': name,
-        'username': current_user.username
-    }
+    container = await async_lxd_service.get_container(name)
+    if not container:
+        raise HTTPException(status_code=404, detail="容器不存在")
     
-    return {"token": token, "container_name": name}
+    issued = await vnc_tokens.issue(name, current_user.username)
+    return {
+        "token": issued['token'],
+        "container_name": name,
+        "expires_in": issued['expires_in'],
+        "path": f"{settings.API_PREFIX}/vnc/ws/{name}?token={issued['token']}"
+    }
+
+@router.get("/sessions")
+async def list_vnc_sessions(current_user: User = Depends(get_current_user)):
+    """本进程中正在转发的VNC会话"""
+    return {"stats": vnc_proxy.stats(), "sessions": list(vnc_proxy.sessions.values())}
 
 @router.websocket("/ws/{name}")
 async def vnc_websocket(websocket: WebSocket, name: str, token: str):
     """
-    VNC WebSocket连接
-    这是一个基础实现,实际VNC代理需要更复杂的逻辑
+    VNC WebSocket连接 (noVNC等客户端)
+    在浏览器和容器IP上的VNC端口之间双向转发原始RFB数据
     """
-    # 验证令牌
-    if token not in vnc_tokens or vnc_tokens[token]['container_name'] != name:
+    # 验证并作废令牌
+    username = await vnc_tokens.consume(token, name)
+    if username is None:
         await websocket.close(code=1008, reason="无效的令牌")
         return
     
-    await websocket.accept()
+    if not vnc_proxy.reserve():
+        await websocket.close(code=1013, reason="VNC会话数已达上限")
+        return
+    try:
+        await _relay(websocket, name, username)
+    finally:
+        vnc_proxy.release()
+
+async def _relay(websocket: WebSocket, name: str, username: str):
+    container = await async_lxd_service.get_container(name)
+    if not container or not container.get('ip_address'):
+        await websocket.close(code=1011, reason="容器未运行或没有IP地址")
+        return
     
     try:
-        # 这里应该实现VNC代理逻辑
-        # 连接到容器的VNC服务器 (通常是5900端口)
-        # 然后在客户端WebSocket和VNC服务器之间转发数据
-        
-        await websocket.send_json({
-            "type": "info",
-            "message": "VNC功能需要在容器中安装x11vnc或tigervnc等VNC服务器"
-        })
-        
-        while True:
-            data = await websocket.receive_text()
-            # 处理VNC协议数据...
-            await websocket.send_text("VNC代理未完全实现")
-            
+        upstream = await vnc_proxy.connect(container['ip_address'], settings.VNC_PORT)
     except Exception as e:
-        print(f"VNC WebSocket错误: {str(e)}")
+        print(f"连接容器 {name} 的VNC端口失败: {str(e)}")
+        await websocket.close(code=1011, reason="无法连接容器的VNC服务器")
+        return
+    
+    # noVNC 会请求 binary 子协议
+    subprotocol = 'binary' if 'binary' in websocket.scope.get('subprotocols', []) else None
+    await websocket.accept(subprotocol=subprotocol)
+    
+    try:
+        await vnc_proxy.relay(websocket, upstream, name, username)
     finally:
-        await websocket.close()
-        # 清理令牌
-        if token in vnc_tokens:
-            del vnc_tokens[token]
+        try:
+            await websocket.close()
+        except Exception:
+            pass
@@ -0,0 +1,128 @@
+"""
+认证基准测试
+
+在进程内直接调用ASGI应用 (不经过网络), 对比 GET /api/auth/me 的每秒请求数:
+  before: 关闭认证缓存, 每个请求校验JWT签名并查询一次 users 表
+  after:  开启认证缓存, 命中缓存的请求不校验签名也不查询数据库
+
+用法: python benchmarks/bench_auth_me.py [--requests 5000] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from config import settings
+from database.db import Base
+from database.models import User
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+
+async def make_app(path: str, counter: QueryCounter):
+    """只挂载认证路由的应用, 数据库换成临时文件并统计查询次数"""
+    from api import auth
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    auth.AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    async with auth.AsyncSessionLocal() as session:
+        session.add(User(username="bench", hashed_password="x", is_active=True))
+        await session.commit()
+
+    app = FastAPI()
+    app.include_router(auth.router, prefix=settings.API_PREFIX)
+    token = auth.create_access_token({"sub": "bench"})
+    return app, engine, token
+
+
+async def call(app, path: str, token: str) -> int:
+    """最小化的ASGI调用, 返回状态码"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': b'', 'root_path': '', 'server': ('bench', 80), 'client': ('127.0.0.1', 1),
+        'headers': [(b'authorization', f'Bearer {token}'.encode()), (b'host', b'bench')]
+    }
+    status = {}
+    body = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+        elif message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    if status['code'] == 200:
+        json.loads(b''.join(body))
+    return status['code']
+
+
+async def run(cache: bool, requests: int, concurrency: int):
+    from services.auth_cache import auth_cache
+
+    settings.AUTH_CACHE_ENABLED = cache
+    auth_cache.tokens.clear()
+    auth_cache.users.clear()
+    counter = QueryCounter()
+    with tempfile.TemporaryDirectory() as tmp:
+        app, engine, token = await make_app(os.path.join(tmp, "bench.db"), counter)
+        path = f"{settings.API_PREFIX}/auth/me"
+        assert await call(app, path, token) == 200
+        counter.count = 0
+
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                code = await call(app, path, token)
+                assert code == 200, code
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await engine.dispose()
+    return elapsed, counter.count
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    before, before_queries = await run(False, args.requests, args.concurrency)
+    after, after_queries = await run(True, args.requests, args.concurrency)
+
+    print(f"请求数: {args.requests}, 并发: {args.concurrency}")
+    print(f"before (每次校验签名 + 查询users): {args.requests / before:,.0f} 请求/秒, 数据库查询 {before_queries} 次")
+    print(f"after  (token和用户缓存):          {args.requests / after:,.0f} 请求/秒, 数据库查询 {after_queries} 次")
+    print(f"提升: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""
+文件传输基准测试
+
+本地起一个假LXD文件API (unix socket, 下载返回size字节, 上传读取并丢弃请求体),
+对比两种实现的吞吐和Python内存分配峰值 (tracemalloc):
+  before: 与 pylxd 的 files.get/put 相同, 把整个文件读入内存后再返回/发送
+  after:  services.file_transfer, 按 FILE_TRANSFER_CHUNK_SIZE 分块流式转发
+
+用法: python benchmarks/bench_file_transfer.py [--megabytes 512]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from services.file_transfer import LXDFileStream, file_transfers
+
+BLOCK = b'\0' * 65536
+
+
+async def fake_lxd(path: str, size: int):
+    async def handle(reader, writer):
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode().partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if request_line.startswith(b'POST'):
+            remaining = int(headers['content-length'])
+            while remaining:
+                remaining -= len(await reader.read(min(remaining, 262144)))
+            body = b'{"type": "sync", "metadata": {}}'
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+        else:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nX-LXD-type: file\r\n'
+                         b'Content-Length: %d\r\n\r\n' % size)
+            sent = 0
+            while sent < size:
+                block = BLOCK[:size - sent]
+                writer.write(block)
+                await writer.drain()
+                sent += len(block)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_unix_server(handle, path)
+
+
+async def upload_body(size: int):
+    sent = 0
+    while sent < size:
+        block = BLOCK[:size - sent]
+        sent += len(block)
+        yield block
+
+
+async def download(kind: str) -> int:
+    target = file_transfers._target('bench', '/bench.img')
+    if kind == 'before':
+        stream = await LXDFileStream.request('GET', target, {})
+        content = b''.join([data async for data in stream.iter_body()])
+        stream.close()
+        return len(content)
+    result = await file_transfers.download('bench', '/bench.img', None, 'bench')
+    received = 0
+    try:
+        async for data in result.body:
+            received += len(data)
+    finally:
+        await result.aclose()
+    return received
+
+
+async def upload(kind: str, size: int) -> int:
+    if kind == 'before':
+        content = b''.join([data async for data in upload_body(size)])
+
+        async def whole():
+            yield content
+
+        stream = await LXDFileStream.request('POST', file_transfers._target('bench', '/bench.img'),
+                                             {'Content-Length': str(size)}, whole())
+        stream.close()
+        return len(content)
+    result = await file_transfers.upload('bench', '/bench.img', upload_body(size), size, 0, 0, '0644', False, 'bench')
+    return result['bytes']
+
+
+async def measure(label: str, coro):
+    tracemalloc.start()
+    started = time.perf_counter()
+    nbytes = await coro
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label}: {nbytes / elapsed / 1024 / 1024:,.0f} MB/s, 内存峰值 {peak / 1024 / 1024:,.1f} MB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=int, default=512, help="传输的文件大小(MB)")
+    args = parser.parse_args()
+
+    size = args.megabytes * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.LXD_UNIX_SOCKET = os.path.join(tmp, 'lxd.sock')
+        server = await fake_lxd(settings.LXD_UNIX_SOCKET, size)
+        print(f"文件大小: {args.megabytes} MB, 块大小: {settings.FILE_TRANSFER_CHUNK_SIZE // 1024} KB")
+        for kind, label in (('before', '整个文件读入内存'), ('after', '分块流式转发')):
+            await measure(f"下载 {kind:6} ({label})", download(kind))
+            await measure(f"上传 {kind:6} ({label})", upload(kind, size))
+        server.close()
+        await server.wait_closed()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""
+VNC转发基准测试
+
+本地起一个TCP回显服务器代替容器中的VNC服务器, 用内存中的假WebSocket代替浏览器,
+N个会话同时经由转发层把数据发给回显服务器再收回, 对比两种实现的吞吐:
+  before: asyncio streams, StreamReader.read() 每次分配新的bytes, 每次写入后 drain
+  after:  services.vnc_proxy (BufferedProtocol + 预分配缓冲区 + 合并发送 + 水位流控)
+
+用法: python benchmarks/bench_vnc_relay.py [--sessions 200] [--megabytes 4] [--chunk 16384]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from services.vnc_proxy import VNCProxy
+
+
+class FakeWebSocket:
+    """浏览器一侧: 发送total字节, 统计收回的字节数; 入站队列有界以模拟浏览器发送速度"""
+
+    def __init__(self, chunk: int, total: int):
+        self.payload = os.urandom(chunk)
+        self.total = total
+        self.received = 0
+        self.messages = 0
+        self.inbound: asyncio.Queue = asyncio.Queue(maxsize=16)
+        self.done = asyncio.Event()
+
+    async def produce(self):
+        sent = 0
+        while sent < self.total:
+            await self.inbound.put({'type': 'websocket.receive', 'bytes': self.payload})
+            sent += len(self.payload)
+        await self.done.wait()
+        await self.inbound.put({'type': 'websocket.disconnect'})
+
+    async def receive(self):
+        return await self.inbound.get()
+
+    async def send_bytes(self, data: bytes):
+        self.received += len(data)
+        self.messages += 1
+        if self.received >= self.total:
+            self.done.set()
+
+
+async def echo_server():
+    async def handle(reader, writer):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+async def stream_relay(websocket: FakeWebSocket, host: str, port: int):
+    """基线: 基于 asyncio streams 的朴素转发"""
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def upstream_to_client():
+        while True:
+            data = await reader.read(settings.VNC_BUFFER_SIZE)
+            if not data:
+                return
+            await websocket.send_bytes(data)
+
+    async def client_to_upstream():
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            writer.write(message['bytes'])
+            await writer.drain()
+
+    tasks = [asyncio.create_task(upstream_to_client()), asyncio.create_task(client_to_upstream())]
+    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    writer.close()
+
+
+async def proxy_relay(proxy: VNCProxy, websocket: FakeWebSocket, host: str, port: int):
+    upstream = await proxy.connect(host, port)
+    await proxy.relay(websocket, upstream, 'bench', 'bench')
+
+
+async def run(kind: str, sessions: int, total: int, chunk: int):
+    server = await echo_server()
+    host, port = server.sockets[0].getsockname()[:2]
+    proxy = VNCProxy()
+    sockets = [FakeWebSocket(chunk, total) for _ in range(sessions)]
+
+    async def session(websocket):
+        producer = asyncio.create_task(websocket.produce())
+        if kind == 'before':
+            await stream_relay(websocket, host, port)
+        else:
+            await proxy_relay(proxy, websocket, host, port)
+        await producer
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(ws) for ws in sockets))
+    elapsed = time.perf_counter() - started
+    server.close()
+    await server.wait_closed()
+    received = sum(ws.received for ws in sockets)
+    messages = sum(ws.messages for ws in sockets)
+    return elapsed, received, messages
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--megabytes", type=float, default=4, help="每个会话往返的数据量(MB)")
+    parser.add_argument("--chunk", type=int, default=16384, help="浏览器每条消息的字节数")
+    args = parser.parse_args()
+
+    total = int(args.megabytes * 1024 * 1024)
+    print(f"会话数: {args.sessions}, 每会话: {args.megabytes} MB, 消息大小: {args.chunk} 字节")
+    results = {}
+    for kind, label in (('before', 'streams逐次read'), ('after', '预分配缓冲+流控')):
+        elapsed, received, messages = await run(kind, args.sessions, total, args.chunk)
+        results[kind] = elapsed
+        print(f"{kind:6} ({label}): {elapsed:.2f}s, {received / elapsed / 1024 / 1024:,.1f} MB/s, "
+              f"发往浏览器 {messages} 条消息 (平均 {received / max(messages, 1) / 1024:.1f} KB)")
+    print(f"提升: {results['before'] / results['after']:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+"""
+独立监控采集进程
+
+与API进程分开运行时, API可以用多个uvicorn worker横向扩展而不会重复采集:
+  - API进程设置 MONITOR_MODE=external, 只从数据库读取监控数据
+  - 本进程竞争采集锁 (COLLECTOR_LOCK_FILE), 任意时刻只有一个实例采集,
+    可同时运行多个实例作为热备, 持锁实例退出后由其他实例接替
+
+用法: python collector.py
+"""
+import asyncio
+import os
+import signal
+import sys
+
+# 添加父目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+from database.db import init_db
+from services.executor import lxd_executor
+from services.leader import LeaderLock
+from services.monitor_service import monitor_service
+
+
+async def main():
+    with LeaderLock(settings.STARTUP_LOCK_FILE):
+        await init_db()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    print(f"监控采集进程已启动 (pid {os.getpid()})")
+    monitor_service.elect(sync_live=False)
+    await stop_event.wait()
+
+    await monitor_service.stop()
+    lxd_executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,6 @@
 """配置文件"""
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import List, Optional
 import secrets
 
 class Settings(BaseSettings):
@@ -18,16 +18,115 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440  # 24小时
+    AUTH_CACHE_ENABLED: bool = True  # 缓存已验证的token和活跃用户, 认证不再查询数据库
+    AUTH_USER_CACHE_TTL: int = 60  # 用户缓存有效期(秒), 其他途径修改数据库后最多延迟这么久生效
+    AUTH_USER_CACHE_SIZE: int = 1024
+    AUTH_TOKEN_CACHE_SIZE: int = 4096
+    AUTH_CACHE_VERSION_FILE: str = "./auth_cache.version"  # 修改用户时更新其时间戳, 通知其他进程清空缓存
+    AUTH_HASH_WORKERS: int = 2  # 执行bcrypt的线程数
+    AUTH_HASH_MAX_PENDING: int = 16  # 排队+执行中的密码校验上限, 超出时登录返回429
+    AUTH_LOGIN_PER_IP_CONCURRENCY: int = 2  # 同一IP同时进行中的登录数上限
+    AUTH_TRUSTED_PROXIES: List[str] = ["127.0.0.1", "::1"]  # 来自这些地址的请求按 X-Real-IP 识别客户端
     
     # 数据库配置
     DATABASE_URL: str = "sqlite+aiosqlite:///./lxd_panel.db"
     
     # 监控配置
-    MONITOR_INTERVAL: int = 60  # 采集间隔(秒)
-    DATA_RETENTION_HOURS: int = 24  # 数据保留时间(小时)
+    MONITOR_INTERVAL: int = 60  # 常规采集间隔(秒), 也是刷新运行中容器列表和汇总的间隔
+    MONITOR_WATCH_INTERVAL: float = 5  # 有人查看详情的容器的采样间隔(秒)
+    MONITOR_BUSY_INTERVAL: float = 15  # 繁忙容器的采样间隔(秒)
+    MONITOR_IDLE_INTERVAL: float = 300  # 空闲容器的采样间隔(秒)
+    MONITOR_BUSY_CPU: float = 20.0  # CPU使用率(%, 单核为100)达到该值视为繁忙
+    MONITOR_BUSY_NETWORK: float = 512.0  # 收发合计速率(KB/s)达到该值视为繁忙
+    MONITOR_IDLE_CPU: float = 1.0  # CPU使用率低于该值且网络低于 MONITOR_IDLE_NETWORK 视为空闲
+    MONITOR_IDLE_NETWORK: float = 4.0  # KB/s
+    MONITOR_WATCH_TTL: int = 30  # 查看心跳的有效期(秒), 页面关闭后超过该时间恢复常规采样
+    DATA_RETENTION_HOURS: int = 24  # 原始样本保留时间(小时)
+    ROLLUP_5M_RETENTION_DAYS: int = 7  # 5分钟汇总保留天数
+    ROLLUP_1H_RETENTION_DAYS: int = 90  # 1小时汇总保留天数
+    MONITOR_CONCURRENCY: int = 32  # 同时探测的容器数上限
+    MONITOR_CYCLE_DEADLINE: Optional[float] = None  # 单个容器的采集截止时间(秒), 默认为该容器采样间隔的80%
+    MONITOR_PROBE_BACKEND: str = "cgroup"  # cgroup: 读取宿主机cgroup v2文件; exec: lxc exec进入容器
+    CGROUP_ROOT: str = "/sys/fs/cgroup"
+    CGROUP_PATH_TEMPLATE: str = "lxc.payload.{name}"  # 容器cgroup相对CGROUP_ROOT的路径
+    MONITOR_WRITE_BATCH: int = 5000  # 缓冲样本达到该行数时提前写入
+    MONITOR_CLEANUP_INTERVAL: int = 600  # 过期数据清理间隔(秒)
+    LIVE_QUEUE_SIZE: int = 4  # 每个实时订阅者最多缓存的帧数, 超出时丢弃最旧的帧
+    WS_KEEPALIVE_INTERVAL: int = 30  # 无数据时发送保活消息的间隔(秒), 需小于反向代理的读超时
+    
+    # 多进程部署
+    MONITOR_MODE: str = "embedded"  # embedded: API进程竞争采集锁, 持锁者负责采集; external: 只由独立的 collector.py 进程采集
+    COLLECTOR_LOCK_FILE: str = "./collector.lock"  # 监控采集锁, 保证只有一个进程采集
+    JOB_LOCK_FILE: str = "./jobs.lock"  # 任务执行锁, 保证只有一个进程执行后台任务
+    STARTUP_LOCK_FILE: str = "./startup.lock"  # 多个进程同时启动时串行执行建表和初始化
+    LEADER_RETRY_INTERVAL: int = 10  # 未获得锁的进程重试间隔(秒), 持锁进程退出后由其接替
+    LIVE_POLL_INTERVAL: float = 2.0  # 非采集进程从数据库同步实时数据的间隔(秒)
+    JOB_POLL_INTERVAL: float = 1.0  # 任务执行进程拾取其他进程提交的任务的间隔(秒)
+    JOB_RETENTION_DAYS: int = 7  # 已结束的任务保留天数, 之后从任务表删除
+    JOB_SECRET_TTL: int = 3600  # 任务结果中的密码无人读取时最多保留的秒数
+    JOB_CLEANUP_INTERVAL: int = 600  # 清理过期任务和密码的间隔(秒)
     
     # LXD配置
     LXD_ENDPOINT: Optional[str] = None  # None表示使用本地Unix socket
+    INVENTORY_CACHE_ENABLED: bool = True  # 启用基于事件流的容器清单缓存
+    INVENTORY_MAX_AGE: int = 300  # 清单缓存最长有效期(秒), 超时后全量重载
+    
+    # 镜像缓存配置
+    IMAGE_CACHE_ENABLED: bool = True  # 预先下载常用镜像, 创建容器时使用本地镜像
+    IMAGE_SERVER: str = "https://images.linuxcontainers.org"  # simplestreams镜像服务器(HTTPS), 可指向内网镜像站
+    IMAGE_PROTOCOL: str = "simplestreams"
+    IMAGE_CACHE_ALIASES: List[str] = [
+        "debian/12", "debian/11", "ubuntu/22.04", "ubuntu/20.04", "centos/7", "centos/9-Stream"
+    ]
+    IMAGE_REFRESH_INTERVAL: int = 21600  # 后台刷新已缓存镜像的间隔(秒)
+    
+    # 容器模板配置
+    STORAGE_POOL: str = "default"  # 容器和模板所在的存储池, ZFS/btrfs池上从模板复制是写时复制
+    TEMPLATES_ENABLED: bool = True  # 有制作好的模板时从模板快照复制创建容器
+    TEMPLATE_BAKE_TIMEOUT: int = 900  # 制作模板时等待cloud-init安装软件的最长时间(秒)
+    
+    # 端口转发配置
+    PORT_FORWARD_CHAIN: str = "LXD-PANEL"  # nat表中由PREROUTING跳转的父链
+    PORT_FORWARD_LOCK_FILE: str = "./port_forward.lock"  # 多进程修改iptables规则时互斥
+    IPTABLES_SAVE: str = "iptables-save"
+    IPTABLES_RESTORE: str = "iptables-restore"
+    PORT_ALLOCATION_MIN: int = 10000  # 推荐空闲端口段时的搜索范围
+    PORT_ALLOCATION_MAX: int = 65000
+    PORT_ALLOCATION_LOCK_FILE: str = "./ports.lock"  # 多进程分配端口时互斥
+    
+    # VNC代理配置
+    VNC_PORT: int = 5900  # 容器内VNC服务器端口
+    VNC_TOKEN_TTL: int = 60  # VNC令牌有效期(秒), 令牌只能使用一次
+    VNC_CONNECT_TIMEOUT: int = 5  # 连接容器VNC端口的超时(秒)
+    VNC_BUFFER_SIZE: int = 65536  # 每个会话预分配的接收缓冲区(字节), 写满时暂停读取VNC服务器
+    VNC_MAX_SESSIONS: int = 500  # 每个API进程同时转发的VNC会话上限
+    
+    # Web终端配置
+    LXD_UNIX_SOCKET: str = ""  # LXD的unix socket路径, 为空时自动检测(snap或deb安装)
+    CONSOLE_COMMAND: List[str] = ["/bin/sh", "-c", "command -v bash >/dev/null && exec bash -l || exec sh -l"]
+    CONSOLE_MAX_SESSIONS: int = 100  # 每个API进程同时打开的终端数上限
+    CONSOLE_MAX_QUEUE: int = 32  # 从LXD接收、尚未转发给浏览器的消息数上限, 超出时暂停读取
+    CONSOLE_WRITE_LIMIT: int = 65536  # 发往LXD的缓冲字节数上限, 超出时暂停接收浏览器输入
+    
+    # 文件传输配置
+    FILE_TRANSFER_CHUNK_SIZE: int = 262144  # 上传/下载转发的块大小(字节), 每个传输常驻内存约为两个块
+    FILE_TRANSFER_MAX_ACTIVE: int = 32  # 每个API进程同时进行的传输数上限
+    FILE_TRANSFER_TIMEOUT: int = 30  # 连接LXD及等待响应头的超时(秒)
+    
+    # 执行器配置
+    LXD_EXECUTOR_WORKERS: int = 16  # pylxd调用线程池大小
+    LXD_EXECUTOR_MAX_PENDING: int = 256  # 排队+执行中任务上限, 超出返回503
+    SUBPROCESS_CONCURRENCY: int = 32  # 同时运行的lxc子进程数上限
+    
+    # 任务队列配置
+    JOB_WORKERS: int = 4  # 并发执行的后台任务数(如容器创建)
+    CREATE_NETWORK_TIMEOUT: int = 60  # 创建容器时等待IP的最长时间(秒)
+    BULK_CREATE_PARALLELISM: int = 4  # 批量创建时同时创建的容器数(请求未指定时)
+    BULK_CREATE_MAX_COUNT: int = 100  # 单次批量创建的容器数上限
+    BULK_OPERATION_CONCURRENCY: int = 10  # 批量启停/删除时同时在LXD中执行的操作数(请求未指定时)
+    BULK_OPERATION_POLL_INTERVAL: float = 0.5  # 轮询LXD操作状态的间隔(秒)
+    BULK_OPERATION_TIMEOUT: int = 300  # 单个操作的最长等待时间(秒)
+    BULK_STOP_TIMEOUT: int = 30  # 批量停止时等待容器正常关机的时间(秒), 超时则操作失败(force时直接强制停止)
     
     class Config:
         env_file = ".env"
@@ -1,4 +1,5 @@
 """数据库连接和会话管理"""
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 import os
@@ -15,6 +16,20 @@ engine = create_async_engine(
     future=True
 )
 
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL模式下读写互不阻塞, 采集器写入时API仍可读取;
+    synchronous=NORMAL 在WAL下只在checkpoint时fsync
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")  # 16MB
+    cursor.close()
+
 # 创建会话工厂
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -33,7 +48,23 @@ async def get_db() -> AsyncSession:
         finally:
             await session.close()
 
+def add_missing_columns(sync_conn, tables=None):
+    """
+    create_all不会修改已存在的表, 为旧数据库补齐新增的列
+    tables 默认为 Base.metadata 中的全部表; 按天分区的监控表不在其中, 由 monitoring_store 传入
+    """
+    inspector = inspect(sync_conn)
+    for table in tables if tables is not None else Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
 # 初始化数据库
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_columns)
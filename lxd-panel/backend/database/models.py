@@ -1,5 +1,5 @@
 """数据库模型定义"""
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Table, Index
 from sqlalchemy.sql import func
 from database.db import Base
 
@@ -31,30 +31,134 @@ class Container(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
-class MonitoringData(Base):
-    """监控数据表"""
-    __tablename__ = "monitoring_data"
+class PortAllocation(Base):
+    """主机端口分配表: 每行是一个容器占用的一段连续端口"""
+    __tablename__ = "port_allocations"
     
-    id = Column(Integer, primary_key=True, index=True)
-    container_name = Column(String(100), index=True, nullable=False)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
-    
-    # CPU数据
-    cpu_usage = Column(Float)  # 百分比
-    load_average = Column(Float)
-    
-    # 内存数据
-    memory_usage = Column(Float)  # MB
-    memory_total = Column(Float)  # MB
-    memory_percent = Column(Float)  # 百分比
+    id = Column(Integer, primary_key=True)
+    container_name = Column(String(100), nullable=False, index=True)
+    kind = Column(String(10), nullable=False)  # ssh/nat
+    start_port = Column(Integer, nullable=False, index=True)
+    end_port = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# 端口分配表的写入计数, 与每次分配/释放/重建在同一事务中递增; 各进程据此判断内存索引是否过期
+port_allocation_version = Table(
+    'port_allocation_version', Base.metadata,
+    Column('id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False)
+)
+
+class VNCToken(Base):
+    """VNC访问令牌: 一次性使用, 过期后作废 (存数据库以便任一API进程都能校验)"""
+    __tablename__ = "vnc_tokens"
     
-    # 网络数据
-    network_rx_bytes = Column(Float)  # 接收字节
-    network_tx_bytes = Column(Float)  # 发送字节
-    network_rx_rate = Column(Float)  # 接收速率 KB/s
-    network_tx_rate = Column(Float)  # 发送速率 KB/s
+    token = Column(String(64), primary_key=True)
+    container_name = Column(String(100), nullable=False)
+    username = Column(String(50), nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+def monitoring_columns() -> list:
+    """
+    监控数据列定义
+    监控数据按天分表存储 (见 database/monitoring_store.py), 每个分区表都用这组列建表,
+    主键 (container_name, timestamp) 使同一容器的样本按时间顺序聚集存放
+    """
+    return [
+        Column('container_name', String(100), primary_key=True),
+        Column('timestamp', DateTime(timezone=True), primary_key=True),
+        
+        # CPU数据
+        Column('cpu_usage', Float),  # 百分比
+        Column('load_average', Float),
+        
+        # 内存数据
+        Column('memory_usage', Float),  # MB
+        Column('memory_total', Float),  # MB
+        Column('memory_percent', Float),  # 百分比
+        
+        # 网络数据
+        Column('network_rx_bytes', Float),  # 接收字节
+        Column('network_tx_bytes', Float),  # 发送字节
+        Column('network_rx_rate', Float),  # 接收速率 KB/s
+        Column('network_tx_rate', Float),  # 发送速率 KB/s
+        
+        # 磁盘数据
+        Column('disk_usage', Float),  # GB
+        Column('disk_total', Float),  # GB
+        Column('disk_percent', Float),  # 百分比
+        
+        # PSI压力 (some avg10, 百分比) 与IO累计字节, 仅cgroup探针提供
+        Column('cpu_pressure', Float),
+        Column('memory_pressure', Float),
+        Column('io_pressure', Float),
+        Column('io_read_bytes', Float),
+        Column('io_write_bytes', Float),
+    ]
+
+# 每个容器最新一条样本, 由采集进程每轮覆盖写入, 供其他API进程同步实时数据
+monitoring_latest = Table(
+    'monitoring_latest', Base.metadata,
+    *[Column(c.name, c.type, primary_key=c.name == 'container_name') for c in monitoring_columns()]
+)
+
+# 正在被查看(打开实时面板)的容器, 各API进程定期续期, 采集进程据此提高采样频率
+monitoring_watch = Table(
+    'monitoring_watch', Base.metadata,
+    Column('container_name', String(100), primary_key=True),
+    Column('expires_at', DateTime(timezone=True), nullable=False)
+)
+
+# 汇总层级中保留 min/avg/max 的指标
+ROLLUP_METRICS = [
+    'cpu_usage', 'load_average', 'memory_percent',
+    'network_rx_rate', 'network_tx_rate', 'disk_percent',
+    'cpu_pressure', 'memory_pressure', 'io_pressure'
+]
+
+# 汇总层级: 名称 -> 时间桶宽度(秒), 每一层由上一层(第一层由原始样本)增量汇总
+ROLLUP_TIERS = {'5m': 300, '1h': 3600}
+
+def rollup_columns() -> list:
+    """汇总表列定义: 每个指标的 min/avg/max 以及桶内样本数"""
+    columns = [
+        Column('container_name', String(100), primary_key=True),
+        Column('bucket', DateTime(timezone=True), primary_key=True),  # 时间桶起点
+        Column('samples', Integer, nullable=False),
+    ]
+    for metric in ROLLUP_METRICS:
+        columns += [
+            Column(f'{metric}_min', Float),
+            Column(f'{metric}_avg', Float),
+            Column(f'{metric}_max', Float),
+        ]
+    return columns
+
+rollup_tables = {
+    tier: Table(
+        f'monitoring_rollup_{tier}', Base.metadata,
+        *rollup_columns(),
+        Index(f'ix_monitoring_rollup_{tier}_bucket', 'bucket'),  # 按保留期清理
+        sqlite_with_rowid=False
+    )
+    for tier in ROLLUP_TIERS
+}
+
+class Job(Base):
+    """后台任务表"""
+    __tablename__ = "jobs"
     
-    # 磁盘数据
-    disk_usage = Column(Float)  # GB
-    disk_total = Column(Float)  # GB
-    disk_percent = Column(Float)  # 百分比
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="pending", index=True)  # pending/running/succeeded/failed
+    stage = Column(String(50))  # 当前阶段
+    progress = Column(Integer, default=0)  # 百分比
+    message = Column(String(255))
+    params = Column(Text)  # JSON: 任务参数
+    checkpoint = Column(Text)  # JSON: 已完成阶段等断点信息, 重启后据此续跑
+    result = Column(Text)  # JSON: 任务结果 (不含密钥字段)
+    secrets = Column(Text)  # JSON: 结果中的密钥字段(如root密码), 提交者第一次读取后清除
+    owner = Column(String(50))  # 提交任务的用户名
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
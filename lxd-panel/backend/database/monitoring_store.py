@@ -0,0 +1,361 @@
+"""监控数据存储 - 按天分区的 (container_name, timestamp) 聚簇表及多级汇总表"""
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import (
+    Column, Integer, MetaData, Table, case, cast, delete, func, insert, select, text
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import add_missing_columns
+from database.models import (
+    ROLLUP_METRICS, ROLLUP_TIERS, monitoring_columns, monitoring_latest, monitoring_watch,
+    rollup_tables
+)
+
+PARTITION_PREFIX = "monitoring_data_"
+LEGACY_TABLE = "monitoring_data"
+
+
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+
+def floor_time(value: datetime, step: int) -> datetime:
+    """向下取整到step秒的时间桶起点"""
+    epoch = datetime(1970, 1, 1, tzinfo=value.tzinfo)
+    seconds = int((value - epoch).total_seconds())
+    return epoch + timedelta(seconds=seconds - seconds % step)
+
+
+def partition_day(table_name: str) -> Optional[date]:
+    suffix = table_name[len(PARTITION_PREFIX):]
+    try:
+        return datetime.strptime(suffix, '%Y%m%d').date()
+    except ValueError:
+        return None
+
+
+class MonitoringStore:
+    """
+    每个UTC日一张 WITHOUT ROWID 表, 主键 (container_name, timestamp):
+    - 历史查询在每个分区上都是一次按主键顺序的范围扫描, 无需排序
+    - 保留期清理直接 DROP 整个过期分区, 不再逐行 DELETE
+    """
+
+    def __init__(self):
+        self._metadata = MetaData()
+        self._tables: Dict[str, Table] = {}
+        self._created = set()  # 本进程已确认存在的分区
+
+    def table(self, day: date) -> Table:
+        name = partition_name(day)
+        if name not in self._tables:
+            self._tables[name] = Table(
+                name, self._metadata, *monitoring_columns(), sqlite_with_rowid=False
+            )
+        return self._tables[name]
+
+    async def _ensure(self, session: AsyncSession, day: date) -> Table:
+        table = self.table(day)
+        if table.name not in self._created:
+            await session.run_sync(lambda s: self._create(s.connection(), table))
+            self._created.add(table.name)
+        return table
+
+    @staticmethod
+    def _create(connection, table: Table):
+        # 分区在之前的版本中已建好时, 补齐之后新增的列
+        table.create(connection, checkfirst=True)
+        add_missing_columns(connection, [table])
+
+    async def existing_days(self, session: AsyncSession) -> List[date]:
+        """数据库中现有的分区日期(升序), 其他进程创建的分区也能看到"""
+        result = await session.execute(
+            text("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE :prefix"),
+            {'prefix': f'{PARTITION_PREFIX}%'}
+        )
+        days = [partition_day(row[0]) for row in result]
+        return sorted(d for d in days if d)
+
+    # ---------- 写入 ----------
+
+    async def insert_rows(self, session: AsyncSession, rows: Iterable[Dict]):
+        """按日期分组后每个分区一次 executemany"""
+        by_day: Dict[date, List[Dict]] = {}
+        for row in rows:
+            by_day.setdefault(row['timestamp'].date(), []).append(row)
+        for day, day_rows in by_day.items():
+            table = await self._ensure(session, day)
+            await session.execute(insert(table).prefix_with('OR IGNORE'), day_rows)
+
+    async def drop_before(self, session: AsyncSession, cutoff: datetime) -> int:
+        """删除整天都早于cutoff的分区, 返回删除的分区数"""
+        dropped = 0
+        for day in await self.existing_days(session):
+            if datetime.combine(day + timedelta(days=1), time.min) <= cutoff:
+                name = partition_name(day)
+                await session.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                self._created.discard(name)
+                dropped += 1
+        return dropped
+
+    async def save_latest(self, session: AsyncSession, rows: List[Dict], removed: Iterable[str] = ()):
+        """覆盖写入各容器的最新样本, 并删除已不在运行的容器"""
+        if rows:
+            await session.execute(insert(monitoring_latest).prefix_with('OR REPLACE'), rows)
+        removed = list(removed)
+        if removed:
+            await session.execute(
+                delete(monitoring_latest).where(monitoring_latest.c.container_name.in_(removed))
+            )
+
+    async def clear_latest(self, session: AsyncSession):
+        await session.execute(delete(monitoring_latest))
+
+    async def latest_since(self, session: AsyncSession, since: Optional[datetime]) -> List[Dict]:
+        """时间戳晚于since的最新样本, since为None时返回全部"""
+        stmt = select(monitoring_latest)
+        if since is not None:
+            stmt = stmt.where(monitoring_latest.c.timestamp > since)
+        result = await session.execute(stmt)
+        return [dict(row) for row in result.mappings()]
+
+    async def latest_names(self, session: AsyncSession) -> List[str]:
+        result = await session.execute(select(monitoring_latest.c.container_name))
+        return [row[0] for row in result]
+
+    async def touch_watch(self, session: AsyncSession, names: Iterable[str], expires_at: datetime):
+        """续期正在被查看的容器"""
+        rows = [{'container_name': name, 'expires_at': expires_at} for name in names]
+        if rows:
+            await session.execute(insert(monitoring_watch).prefix_with('OR REPLACE'), rows)
+
+    async def watched_names(self, session: AsyncSession, now: datetime) -> List[str]:
+        result = await session.execute(
+            select(monitoring_watch.c.container_name).where(monitoring_watch.c.expires_at > now)
+        )
+        return [row[0] for row in result]
+
+    async def delete_expired_watch(self, session: AsyncSession, now: datetime):
+        await session.execute(delete(monitoring_watch).where(monitoring_watch.c.expires_at <= now))
+
+    # ---------- 查询 ----------
+
+    async def latest(self, session: AsyncSession, container_name: str) -> Optional[Dict]:
+        """容器的最新一条样本, 从最新的分区往前找"""
+        for day in reversed(await self.existing_days(session)):
+            table = self.table(day)
+            stmt = select(table).where(
+                table.c.container_name == container_name
+            ).order_by(table.c.timestamp.desc()).limit(1)
+            row = (await session.execute(stmt)).mappings().first()
+            if row:
+                return dict(row)
+        return None
+
+    async def history(
+        self,
+        session: AsyncSession,
+        container_name: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        columns: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """按时间升序返回区间内的样本, 只访问与区间相交的分区"""
+        end = end or datetime.utcnow()
+        rows: List[Dict] = []
+        for day in await self.existing_days(session):
+            if day < start.date() or day > end.date():
+                continue
+            table = self.table(day)
+            selected = [table.c[name] for name in columns] if columns else [table]
+            stmt = select(*selected).where(
+                table.c.container_name == container_name,
+                table.c.timestamp >= start,
+                table.c.timestamp <= end
+            ).order_by(table.c.timestamp.asc())
+            result = await session.execute(stmt)
+            rows.extend(dict(row) for row in result.mappings())
+        return rows
+
+    # ---------- 多级汇总 ----------
+
+    def _source_tier(self, tier: str) -> Optional[str]:
+        """汇总来源: 第一层来自原始样本(None), 其余来自上一层"""
+        tiers = list(ROLLUP_TIERS)
+        index = tiers.index(tier)
+        return tiers[index - 1] if index else None
+
+    async def rollup_watermark(self, session: AsyncSession, tier: str) -> Optional[datetime]:
+        """该层已汇总到的时间点(最后一个桶的终点), 没有数据时返回None"""
+        table = rollup_tables[tier]
+        last = (await session.execute(select(func.max(table.c.bucket)))).scalar()
+        return last + timedelta(seconds=ROLLUP_TIERS[tier]) if last else None
+
+    async def rollup_origin(self, session: AsyncSession, tier: str) -> Optional[datetime]:
+        """该层首次汇总的起点: 来源数据中最早的时间桶"""
+        source = self._source_tier(tier)
+        if source is None:
+            days = await self.existing_days(session)
+            return datetime.combine(days[0], time.min) if days else None
+        table = rollup_tables[source]
+        first = (await session.execute(select(func.min(table.c.bucket)))).scalar()
+        return floor_time(first, ROLLUP_TIERS[tier]) if first else None
+
+    async def rollup(self, session: AsyncSession, tier: str, start: datetime, end: datetime) -> int:
+        """
+        将 [start, end) 内的来源数据汇总为该层的时间桶, 返回写入的桶数
+        start/end 需对齐到桶宽度; 重复汇总同一区间会覆盖旧结果
+        """
+        step = ROLLUP_TIERS[tier]
+        source = self._source_tier(tier)
+        rows: List[Dict] = []
+        if source is None:
+            for day in await self.existing_days(session):
+                if day < start.date() or day > end.date():
+                    continue
+                rows += await self._aggregate_raw(session, self.table(day), step, start, end)
+        else:
+            rows = await self._aggregate_rollup(session, rollup_tables[source], step, start, end)
+        if rows:
+            await session.execute(insert(rollup_tables[tier]).prefix_with('OR REPLACE'), rows)
+        return len(rows)
+
+    @staticmethod
+    def _slot(column, step: int):
+        return cast(func.strftime('%s', column), Integer) // step
+
+    @staticmethod
+    def _bucket_rows(result, step: int) -> List[Dict]:
+        rows = []
+        for row in result.mappings():
+            row = dict(row)
+            row['bucket'] = datetime.utcfromtimestamp(row.pop('slot') * step)
+            rows.append(row)
+        return rows
+
+    async def _aggregate_raw(self, session, table: Table, step, start, end) -> List[Dict]:
+        slot = self._slot(table.c.timestamp, step).label('slot')
+        aggregates = []
+        for metric in ROLLUP_METRICS:
+            aggregates += [
+                func.min(table.c[metric]).label(f'{metric}_min'),
+                func.avg(table.c[metric]).label(f'{metric}_avg'),
+                func.max(table.c[metric]).label(f'{metric}_max'),
+            ]
+        stmt = select(
+            table.c.container_name, slot, func.count().label('samples'), *aggregates
+        ).where(
+            table.c.timestamp >= start,
+            table.c.timestamp < end
+        ).group_by(table.c.container_name, slot)
+        return self._bucket_rows(await session.execute(stmt), step)
+
+    async def _aggregate_rollup(self, session, table: Table, step, start, end) -> List[Dict]:
+        slot = self._slot(table.c.bucket, step).label('slot')
+        aggregates = []
+        for metric in ROLLUP_METRICS:
+            avg = table.c[f'{metric}_avg']
+            # 按样本数加权平均, 缺少该指标的桶不计入分母
+            weight = func.sum(case((avg.isnot(None), table.c.samples)))
+            aggregates += [
+                func.min(table.c[f'{metric}_min']).label(f'{metric}_min'),
+                (func.sum(avg * table.c.samples) / weight).label(f'{metric}_avg'),
+                func.max(table.c[f'{metric}_max']).label(f'{metric}_max'),
+            ]
+        stmt = select(
+            table.c.container_name, slot, func.sum(table.c.samples).label('samples'), *aggregates
+        ).where(
+            table.c.bucket >= start,
+            table.c.bucket < end
+        ).group_by(table.c.container_name, slot)
+        return self._bucket_rows(await session.execute(stmt), step)
+
+    async def delete_rollup_before(self, session: AsyncSession, tier: str, cutoff: datetime) -> int:
+        """删除该层中早于cutoff的时间桶"""
+        table = rollup_tables[tier]
+        result = await session.execute(delete(table).where(table.c.bucket < cutoff))
+        return result.rowcount
+
+    async def rollup_history(
+        self,
+        session: AsyncSession,
+        tier: str,
+        container_name: str,
+        start: datetime,
+        end: Optional[datetime] = None,
+        metrics: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        按时间升序返回汇总层的数据
+        时间桶起点作为 timestamp, 平均值使用指标原名, 另附 <指标>_min / <指标>_max
+        """
+        table = rollup_tables[tier]
+        end = end or datetime.utcnow()
+        selected = [table.c.bucket.label('timestamp')]
+        for metric in metrics or ROLLUP_METRICS:
+            selected += [
+                table.c[f'{metric}_avg'].label(metric),
+                table.c[f'{metric}_min'],
+                table.c[f'{metric}_max'],
+            ]
+        stmt = select(*selected).where(
+            table.c.container_name == container_name,
+            table.c.bucket >= floor_time(start, ROLLUP_TIERS[tier]),
+            table.c.bucket <= end
+        ).order_by(table.c.bucket.asc())
+        result = await session.execute(stmt)
+        return [dict(row) for row in result.mappings()]
+
+    # ---------- 旧表迁移 ----------
+
+    async def upgrade_partitions(self, session: AsyncSession):
+        """为所有已有分区补齐新增的列, 查询旧分区时才能选取全部监控列"""
+        tables = [self.table(day) for day in await self.existing_days(session)]
+        if tables:
+            await session.run_sync(lambda s: add_missing_columns(s.connection(), tables))
+
+    async def migrate_legacy(self, session: AsyncSession):
+        """把旧版单表 monitoring_data 中的数据按天搬入分区后删除旧表"""
+        exists = await session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+            {'name': LEGACY_TABLE}
+        )
+        if exists.first() is None:
+            return
+
+        # 旧表可能缺少后来新增的列, 只搬运两边都有的列
+        info = await session.execute(text(f'PRAGMA table_info("{LEGACY_TABLE}")'))
+        legacy_columns = {row[1] for row in info}
+        columns = [c for c in monitoring_columns() if c.name in legacy_columns]
+        legacy = Table(
+            LEGACY_TABLE, MetaData(),
+            Column('id', Integer, primary_key=True),
+            *[Column(c.name, c.type) for c in columns]
+        )
+        names = [c.name for c in columns]
+        result = await session.execute(
+            select(legacy.c.timestamp).order_by(legacy.c.timestamp.asc()).limit(1)
+        )
+        first = result.scalar()
+        if first is not None:
+            day = first.date()
+            today = datetime.utcnow().date()
+            while day <= today:
+                table = await self._ensure(session, day)
+                day_start = datetime.combine(day, time.min)
+                day_end = day_start + timedelta(days=1)
+                source = select(*[legacy.c[n] for n in names]).where(
+                    legacy.c.timestamp >= day_start,
+                    legacy.c.timestamp < day_end,
+                    legacy.c.container_name.isnot(None)
+                )
+                await session.execute(insert(table).prefix_with('OR IGNORE').from_select(names, source))
+                day += timedelta(days=1)
+        await session.execute(text(f'DROP TABLE "{LEGACY_TABLE}"'))
+        print("旧监控数据表已迁移到按天分区存储")
+
+
+# 全局存储实例
+monitoring_store = MonitoringStore()
@@ -1,5 +1,6 @@
 """FastAPI主应用程序"""
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from sqlalchemy import select
@@ -12,44 +13,97 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import settings
 from database.db import init_db, AsyncSessionLocal
 from database.models import User
-from api import auth, containers, monitoring, vnc
+from api import auth, containers, jobs, monitoring, templates, vnc
+from services.lxd_service import async_lxd_service, lxd_service
 from services.monitor_service import monitor_service
+from services.job_service import job_service
+from services.auth_cache import auth_cache
+from services.bulk_service import bulk_create_job, bulk_operation_job
+from services.console import console_service
+from services.container_creator import create_container_job
+from services.template_service import bake_template_job
+from services.executor import ExecutorSaturated, auth_executor, executor_stats, lxd_executor
+from services.file_transfer import file_transfers
+from services.image_cache import image_cache
+from services.leader import LeaderLock
+from services.port_allocator import port_allocator
+from services.port_forward import async_port_forwards
+from services.vnc_proxy import vnc_proxy
 from api.auth import get_password_hash
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时执行
-    print("初始化数据库...")
-    await init_db()
-    
-    # 创建默认管理员账号
-    async with AsyncSessionLocal() as session:
-        stmt = select(User).where(User.username == "admin")
-        result = await session.execute(stmt)
-        admin = result.scalar_one_or_none()
+    # 启动时执行 (多个worker同时启动时依次建表和创建管理员)
+    with LeaderLock(settings.STARTUP_LOCK_FILE):
+        print("初始化数据库...")
+        await init_db()
         
-        if not admin:
-            admin = User(
-                username="admin",
-                hashed_password=get_password_hash("admin"),
-                is_active=True
-            )
-            session.add(admin)
-            await session.commit()
-            print("已创建默认管理员账号: admin/admin")
-        else:
-            print("管理员账号已存在")
+        # 创建默认管理员账号
+        async with AsyncSessionLocal() as session:
+            stmt = select(User).where(User.username == "admin")
+            result = await session.execute(stmt)
+            admin = result.scalar_one_or_none()
+            
+            if not admin:
+                admin = User(
+                    username="admin",
+                    hashed_password=await auth_executor.run(get_password_hash, "admin"),
+                    is_active=True
+                )
+                session.add(admin)
+                await session.commit()
+                # 其他进程可能缓存了同名的旧用户(如数据库被重建), 通知它们重新查询
+                auth_cache.invalidate_user(admin.username)
+                print("已创建默认管理员账号: admin/admin")
+            else:
+                print("管理员账号已存在")
+    
+    # 订阅LXD事件, 维护容器清单缓存
+    if settings.INVENTORY_CACHE_ENABLED:
+        print("启动容器清单缓存...")
+        lxd_service.inventory.start()
+    
+    # 以LXD中容器的配置为准重建端口分配表
+    with LeaderLock(settings.STARTUP_LOCK_FILE):
+        try:
+            allocated = await port_allocator.rebuild(await async_lxd_service.get_all_containers())
+            print(f"已重建端口分配表: {allocated} 个容器")
+        except Exception as e:
+            print(f"重建端口分配表失败: {str(e)}")
+    
+    # 从当前iptables规则重建端口转发索引
+    forwarded = await async_port_forwards.load()
+    print(f"已加载 {forwarded} 个容器的端口转发规则")
+    
+    # 启动后台任务服务(恢复重启前未完成的任务)
+    job_service.register('create_container', create_container_job)
+    job_service.register('bake_template', bake_template_job)
+    job_service.register('bulk_create', bulk_create_job)
+    job_service.register('bulk_operation', bulk_operation_job)
+    await job_service.start()
     
-    # 启动监控服务
-    print("启动监控服务...")
-    await monitor_service.start()
+    # 预取常用镜像并定期刷新 (只由执行任务的进程下载)
+    image_cache.start(lambda: job_service.is_runner)
+    
+    # 启动监控服务: 只有持有采集锁的进程采集, 其余进程从数据库同步实时数据
+    if settings.MONITOR_MODE == "external":
+        print("监控由独立采集进程 (collector.py) 负责")
+        monitor_service.follow()
+    else:
+        print("启动监控服务...")
+        monitor_service.elect()
     
     yield
     
     # 关闭时执行
     print("停止监控服务...")
     await monitor_service.stop()
+    await job_service.stop()
+    await image_cache.stop()
+    lxd_service.inventory.stop()
+    lxd_executor.shutdown()
+    auth_executor.shutdown()
 
 # 创建FastAPI应用
 app = FastAPI(
@@ -67,10 +121,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 执行队列已满时快速失败, 而不是无限排队
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(status_code=503, content={"detail": f"服务繁忙, 请稍后重试: {str(exc)}"})
+
 # 注册路由
 app.include_router(auth.router, prefix=settings.API_PREFIX)
 app.include_router(containers.router, prefix=settings.API_PREFIX)
+app.include_router(jobs.router, prefix=settings.API_PREFIX)
 app.include_router(monitoring.router, prefix=settings.API_PREFIX)
+app.include_router(templates.router, prefix=settings.API_PREFIX)
 app.include_router(vnc.router, prefix=settings.API_PREFIX)
 
 # 健康检查
@@ -84,7 +145,14 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "executors": executor_stats(),
+        "auth_cache": auth_cache.stats(),
+        "vnc": vnc_proxy.stats(),
+        "console": console_service.stats(),
+        "files": file_transfers.stats()
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,169 @@
+"""
+认证缓存 - 已验证的token和活跃用户缓存在进程内存中
+
+稳定状态下每个已认证请求既不查询数据库, 也不重复校验JWT签名:
+  token缓存: token -> (用户名, 过期时间), 只缓存签名校验通过的token, 到期自动失效
+  用户缓存:  用户名 -> 用户快照, TTL到期后重新查询数据库
+
+用户被禁用或修改时调用 invalidate_user: 本进程立即清除, 并更新版本文件的时间戳,
+其他API进程在下一个请求时发现版本变化后清空自己的缓存。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from config import settings
+from database.models import User
+
+
+class LRUCache:
+    """带TTL的LRU缓存, 条目过期时间由调用方在写入时给出"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, now: float):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value, expires_at: float):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def remove_where(self, predicate) -> int:
+        with self._lock:
+            keys = [key for key, (value, _) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def snapshot_user(user: User) -> User:
+    """脱离会话的用户副本, 可在多个请求间共享(只读)"""
+    return User(
+        id=user.id,
+        username=user.username,
+        hashed_password=user.hashed_password,
+        is_active=user.is_active,
+        created_at=user.created_at
+    )
+
+
+class AuthCache:
+    def __init__(self, version_file: str):
+        self.version_file = version_file
+        self.tokens = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE)
+        self.users = LRUCache(settings.AUTH_USER_CACHE_SIZE)
+        self._version: Optional[int] = self._read_version()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.AUTH_CACHE_ENABLED
+
+    # ---------- 跨进程失效 ----------
+
+    def _read_version(self) -> Optional[int]:
+        try:
+            return os.stat(self.version_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_version(self):
+        """其他进程修改过用户时清空本进程的缓存"""
+        version = self._read_version()
+        if version != self._version:
+            self._version = version
+            self.tokens.clear()
+            self.users.clear()
+
+    def invalidate_user(self, username: str):
+        """
+        用户被创建、禁用、删除或修改(如密码)后调用
+        目前只有启动时创建管理员账号会写用户表; 以后增加用户管理接口时, 在提交修改后调用此方法
+        """
+        self.users.pop(username)
+        self.tokens.remove_where(lambda value: value == username)
+        try:
+            with open(self.version_file, 'a'):
+                pass
+            os.utime(self.version_file)
+        except OSError as e:
+            print(f"更新认证缓存版本文件失败: {str(e)}")
+        self._version = self._read_version()
+
+    # ---------- token ----------
+
+    def get_token(self, token: str) -> Optional[str]:
+        """已验证过且未过期的token对应的用户名"""
+        if not self.enabled:
+            return None
+        self._check_version()
+        return self.tokens.get(token, time.time())
+
+    def put_token(self, token: str, username: str, expires_at: float):
+        if self.enabled:
+            self.tokens.put(token, username, expires_at)
+
+    # ---------- 用户 ----------
+
+    def get_user(self, username: str) -> Optional[User]:
+        if not self.enabled:
+            return None
+        user = self.users.get(username, time.monotonic())
+        if user is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return user
+
+    def put_user(self, user: User) -> User:
+        """缓存活跃用户, 返回可共享的用户副本; 已禁用的用户不缓存"""
+        snapshot = snapshot_user(user)
+        if self.enabled:
+            if user.is_active:
+                self.users.put(user.username, snapshot, time.monotonic() + settings.AUTH_USER_CACHE_TTL)
+            else:
+                self.users.pop(user.username)
+                self.tokens.remove_where(lambda value: value == user.username)
+        return snapshot
+
+    def stats(self) -> Dict:
+        lookups = self._hits + self._misses
+        return {
+            'enabled': self.enabled,
+            'tokens': len(self.tokens),
+            'users': len(self.users),
+            'user_hit_rate': round(self._hits / lookups, 4) if lookups else None
+        }
+
+
+# 全局认证缓存
+auth_cache = AuthCache(settings.AUTH_CACHE_VERSION_FILE)
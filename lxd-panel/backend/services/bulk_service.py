@@ -0,0 +1,363 @@
+"""
+批量操作 - 按名称模板一次创建多台容器, 以及批量启动/停止/重启/删除
+
+批量创建作为一个 bulk_create 后台任务执行: 每台容器复用 create_container_job 的
+分阶段流程, 由 BulkItemContext 把各自的阶段断点保存在批量任务的断点中,
+后端重启后已完成的容器不会重复创建。所有容器共用 container_creator 的同一个LXD客户端连接,
+同时创建的数量由 parallelism 限制。
+
+批量启停/删除向LXD提交不等待完成的操作 (同时在途的操作数有上限),
+由 OperationWatcher 的一个轮询任务通过 /1.0/operations 跟踪全部操作的结果。
+"""
+import asyncio
+import fnmatch
+import re
+from typing import Dict, Iterable, List, Optional
+
+from config import settings
+from services.container_creator import async_container_creator, container_creator, create_container_job
+from services.lxd_service import async_lxd_service
+from services.port_allocator import port_allocator
+from services.port_forward import async_port_forwards
+from services.template_service import is_template
+
+BULK_ACTIONS = ('start', 'stop', 'restart', 'delete')
+
+# 名称模板中的序号占位符: {n} 或补零的 {n:03d}
+INDEX_PLACEHOLDER = re.compile(r'\{n(?::0(\d)d)?\}')
+# LXD实例名: 字母开头, 字母数字和连字符, 不以连字符结尾, 最长63字符
+INSTANCE_NAME = re.compile(r'^[a-zA-Z]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?$')
+
+
+def expand_names(pattern: str, count: int, start: int = 1) -> List[str]:
+    """按名称模板生成容器名, 如 web-{n:02d} -> web-01, web-02, ..."""
+    placeholders = INDEX_PLACEHOLDER.findall(pattern)
+    if len(placeholders) != 1 or pattern.count('{') != 1 or pattern.count('}') != 1:
+        raise ValueError("名称模板必须包含且只包含一个序号占位符 {n} 或 {n:0Nd}")
+    width = int(placeholders[0] or 0)
+    names = [
+        INDEX_PLACEHOLDER.sub(str(i).zfill(width), pattern)
+        for i in range(start, start + count)
+    ]
+    for name in names:
+        if not INSTANCE_NAME.match(name):
+            raise ValueError(f"容器名 {name} 不合法")
+    return names
+
+
+class BulkItemContext:
+    """
+    单台容器的任务上下文, 接口与 JobContext 相同,
+    阶段断点保存在批量任务断点的 items[name] 中
+    """
+
+    def __init__(self, batch: "BulkCreateBatch", params: Dict):
+        self.batch = batch
+        self.params = params
+        self.name = params['name']
+        self.checkpoint = batch.item_state(self.name)
+
+    def stage_done(self, stage: str) -> bool:
+        return stage in self.checkpoint.get('stages', [])
+
+    async def update(self, stage: str, progress: int, message: str = ""):
+        self.checkpoint['stage'] = stage
+        self.batch.progress[self.name] = progress
+        await self.batch.report(f'{self.name}: {message}')
+
+    async def complete_stage(self, stage: str, **data):
+        stages = self.checkpoint.setdefault('stages', [])
+        if stage not in stages:
+            stages.append(stage)
+        self.checkpoint.update(data)
+        await self.batch.save()
+
+
+class BulkCreateBatch:
+    """一次批量创建的运行状态"""
+
+    def __init__(self, job):
+        self.job = job
+        self.items: List[Dict] = job.params['items']
+        self.job.checkpoint.setdefault('items', {})
+        self.progress: Dict[str, int] = {
+            item['name']: 100 if self.item_state(item['name']).get('status') else 0
+            for item in self.items
+        }
+        self._save_lock = asyncio.Lock()
+
+    def item_state(self, name: str) -> Dict:
+        return self.job.checkpoint['items'].setdefault(name, {})
+
+    def item_params(self, item: Dict) -> Dict:
+        """单台容器的创建参数: 批量的公共规格 + 该容器的名称/端口/密码"""
+        params = {k: v for k, v in self.job.params.items() if k not in ('items', 'parallelism')}
+        params.update(item)
+        return params
+
+    def counts(self) -> Dict[str, int]:
+        states = [self.item_state(item['name']).get('status') for item in self.items]
+        return {
+            'succeeded': states.count('succeeded'),
+            'failed': states.count('failed')
+        }
+
+    async def save(self):
+        # 并发的容器各自保存断点, 加锁保证较新的断点最后写入
+        async with self._save_lock:
+            await self.job.save()
+
+    async def report(self, message: str):
+        counts = self.counts()
+        progress = sum(self.progress.values()) // max(len(self.items), 1)
+        await self.job.update(
+            'create', progress,
+            f"{counts['succeeded'] + counts['failed']}/{len(self.items)} 完成 ({message})"
+        )
+
+    async def run_item(self, item: Dict, semaphore: asyncio.Semaphore):
+        name = item['name']
+        state = self.item_state(name)
+        if state.get('status'):
+            return
+        async with semaphore:
+            try:
+                result = await create_container_job(BulkItemContext(self, self.item_params(item)))
+                state.update(status='succeeded', result=result)
+                message = '创建完成'
+            except Exception as e:
+                state.update(status='failed', error=str(e))
+                message = f'创建失败: {str(e)}'
+                print(f"批量创建 {name} 失败: {str(e)}")
+        self.progress[name] = 100
+        await self.save()
+        await self.report(f'{name}: {message}')
+
+    def result(self) -> Dict:
+        items = []
+        for item in self.items:
+            state = self.item_state(item['name'])
+            entry = {
+                'name': item['name'],
+                'status': state.get('status', 'failed'),
+                'ssh_port': item['ssh_port'],
+                'nat_start': item.get('nat_start', 0),
+                'nat_end': item.get('nat_end', 0)
+            }
+            if state.get('status') == 'succeeded':
+                entry.update(ip=state['result']['ip'], password=item['password'])
+            else:
+                entry['error'] = state.get('error', '未执行')
+            items.append(entry)
+        return {'total': len(items), **self.counts(), 'items': items}
+
+
+async def bulk_create_job(job) -> Dict:
+    """批量创建任务: 以有限并发对每台容器执行 create_container_job, 汇总每台的结果"""
+    if not container_creator.client:
+        raise Exception('LXD客户端初始化失败，请确保LXD已安装并运行')
+
+    batch = BulkCreateBatch(job)
+    params = job.params
+    parallelism = max(1, min(params.get('parallelism') or settings.BULK_CREATE_PARALLELISM, len(batch.items)))
+
+    # 各容器开始前先准备一次镜像, 避免并发的首个创建重复下载同一镜像
+    if not job.stage_done('prepare'):
+        await job.update('prepare', 0, '正在准备镜像')
+        template = await async_container_creator.find_template(params['os_type'], params['os_version'])
+        if not template:
+            await async_container_creator.prepare_image(params['os_type'], params['os_version'])
+        await job.complete_stage('prepare')
+
+    semaphore = asyncio.Semaphore(parallelism)
+    await asyncio.gather(*(batch.run_item(item, semaphore) for item in batch.items))
+    return batch.result()
+
+
+# ---------- 批量启停/删除 ----------
+
+def select_containers(
+    containers: Iterable[Dict],
+    names: Optional[List[str]] = None,
+    status: Optional[str] = None,
+    pattern: Optional[str] = None
+) -> List[str]:
+    """按名称列表、状态和通配符模式(如 web-*)筛选容器, 多个条件同时满足; 不含模板容器"""
+    wanted = set(names) if names is not None else None
+    selected = []
+    for container in containers:
+        name = container['name']
+        if is_template(name):
+            continue
+        if wanted is not None and name not in wanted:
+            continue
+        if status and container['status'].lower() != status.lower():
+            continue
+        if pattern and not fnmatch.fnmatchcase(name, pattern):
+            continue
+        selected.append(name)
+    return selected
+
+
+class OperationWatcher:
+    """
+    跟踪多个LXD后台操作
+
+    每轮只请求一次 GET /1.0/operations 取得全部操作的状态, 不为每个操作占用一个等待线程;
+    LXD只保留已结束的操作几秒钟, 列表中已找不到的操作再单独查询一次。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self, operation_id: str, timeout: float) -> Dict:
+        """等待操作结束, 返回 {status, err}; status 为 Unknown 表示操作记录已被清除"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[operation_id] = future
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll())
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiting.pop(operation_id, None)
+
+    async def _poll(self):
+        while self._waiting:
+            await asyncio.sleep(self.interval)
+            try:
+                operations = await async_lxd_service.list_operations()
+            except Exception as e:
+                print(f"查询LXD操作失败: {str(e)}")
+                continue
+            for operation_id, future in list(self._waiting.items()):
+                op = operations.get(operation_id)
+                if op is None:
+                    try:
+                        op = await async_lxd_service.get_operation(operation_id)
+                    except Exception as e:
+                        print(f"查询LXD操作 {operation_id} 失败: {str(e)}")
+                        continue
+                    op = op or {'status': 'Unknown', 'err': ''}
+                if op['status'] in ('Pending', 'Running'):
+                    continue
+                if not future.done():
+                    future.set_result(op)
+
+
+class BulkOperationBatch:
+    """一次批量启停/删除的运行状态, 每台容器的结果保存在任务断点的 items 中"""
+
+    # 操作成功后容器应处于的状态 (None 表示已删除), 结果被LXD清除时据此核对
+    EXPECTED = {'start': 'Running', 'stop': 'Stopped', 'restart': 'Running', 'delete': None}
+
+    def __init__(self, job):
+        self.job = job
+        self.action = job.params['action']
+        self.force = job.params.get('force', False)
+        self.names: List[str] = job.params['names']
+        self.results: Dict[str, Dict] = job.checkpoint.setdefault('items', {})
+        self.watcher = OperationWatcher(settings.BULK_OPERATION_POLL_INTERVAL)
+        self._save_lock = asyncio.Lock()
+
+    async def _save(self, name: str, status: str, error: Optional[str] = None):
+        self.results[name] = {'status': status, **({'error': error} if error else {})}
+        async with self._save_lock:
+            await self.job.save()
+        done = len(self.results)
+        await self.job.update(
+            self.action, done * 100 // max(len(self.names), 1), f'{done}/{len(self.names)} 完成'
+        )
+
+    async def _run_operation(self, name: str, action: str) -> Optional[str]:
+        """提交一个操作并等待其结束, 返回错误信息(成功时为None)"""
+        if action == 'delete':
+            operation_id = await async_lxd_service.submit_delete(name)
+        else:
+            # 删除前的停止总是强制执行
+            force = self.force or self.action == 'delete'
+            timeout = settings.BULK_STOP_TIMEOUT if action == 'stop' and not force else -1
+            operation_id = await async_lxd_service.submit_state_change(name, action, force=force, timeout=timeout)
+        try:
+            op = await self.watcher.wait(operation_id, settings.BULK_OPERATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            return f'操作超时 ({settings.BULK_OPERATION_TIMEOUT}s)'
+        if op['status'] == 'Success':
+            return None
+        if op['status'] == 'Unknown':
+            status = await async_lxd_service.instance_status(name)
+            expected = self.EXPECTED[action]
+            return None if status == expected else f'操作结果未知, 容器当前状态: {status}'
+        return op['err'] or op['status']
+
+    async def run_item(self, name: str, status: Optional[str], semaphore: asyncio.Semaphore):
+        if name in self.results:
+            return
+        if status is None and self.action != 'delete':
+            await self._save(name, 'failed', '容器不存在')
+            return
+        if (self.action == 'start' and status == 'Running') or \
+                (self.action == 'stop' and status == 'Stopped') or \
+                (self.action == 'restart' and status != 'Running'):
+            await self._save(name, 'skipped', f'容器状态为 {status}')
+            return
+        if self.action == 'delete' and status is None:
+            await self._save(name, 'skipped', '容器不存在')
+            return
+
+        async with semaphore:
+            try:
+                error = None
+                # 运行中的容器先强制停止再删除
+                if self.action == 'delete' and status == 'Running':
+                    error = await self._run_operation(name, 'stop')
+                    if error:
+                        error = f'停止失败: {error}'
+                if error is None:
+                    error = await self._run_operation(name, self.action)
+            except Exception as e:
+                error = str(e)
+        if error:
+            print(f"批量{self.action} {name} 失败: {error}")
+        await self._save(name, 'failed' if error else 'succeeded', error)
+
+    def result(self) -> Dict:
+        items = [{'name': name, **self.results.get(name, {'status': 'failed', 'error': '未执行'})}
+                 for name in self.names]
+        statuses = [item['status'] for item in items]
+        return {
+            'action': self.action,
+            'total': len(items),
+            'succeeded': statuses.count('succeeded'),
+            'skipped': statuses.count('skipped'),
+            'failed': statuses.count('failed'),
+            'items': items
+        }
+
+
+async def bulk_operation_job(job) -> Dict:
+    """批量启动/停止/重启/删除任务: 有限并发地提交LXD操作并汇总结果"""
+    batch = BulkOperationBatch(job)
+    concurrency = job.params.get('concurrency') or settings.BULK_OPERATION_CONCURRENCY
+
+    # 以执行时的状态为准决定每台容器是否需要操作 (重启续跑时部分容器可能已处理)
+    await job.update(batch.action, 0, '正在读取容器状态')
+    current = {c['name']: c['status'] for c in await async_lxd_service.get_all_containers()}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(*(
+        batch.run_item(name, current.get(name), semaphore) for name in batch.names
+    ))
+
+    if batch.action == 'delete':
+        # 已删除容器的端口转发在一次 iptables-restore 中清除, 再释放分配的端口
+        deleted = [name for name in batch.names if batch.results[name]['status'] != 'failed']
+        if deleted:
+            try:
+                await async_port_forwards.remove_many(deleted)
+            except Exception as e:
+                print(f"删除端口转发失败: {str(e)}")
+            for name in deleted:
+                await port_allocator.release(name)
+    return batch.result()
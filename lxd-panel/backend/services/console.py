@@ -0,0 +1,190 @@
+"""
+Web终端 - 把浏览器WebSocket桥接到LXD的交互式exec websocket
+
+LXD为交互式exec分配pty并开放两个websocket:
+  "0":       终端的输入输出, 二进制帧
+  "control": 控制消息, 如调整窗口大小 window-resize、发送信号 signal
+
+与浏览器之间:
+  二进制帧 = 终端字节流, 原样转发, 不做JSON封装
+  文本帧   = 控制消息 {"type": "resize", "cols": 120, "rows": 40} 或 {"type": "signal", "signal": 2}
+
+两个方向都有界: 从LXD接收的消息最多排队 CONSOLE_MAX_QUEUE 条,
+发往LXD的数据超过 CONSOLE_WRITE_LIMIT 字节时暂停接收浏览器输入。
+"""
+import asyncio
+import json
+import time
+from typing import Dict
+
+import websockets
+from fastapi import WebSocketDisconnect
+
+from config import settings
+from services.lxd_service import async_lxd_service
+from services.lxd_socket import lxd_socket_path
+
+CONSOLE_ENVIRONMENT = {
+    'TERM': 'xterm-256color',
+    'HOME': '/root',
+    'USER': 'root',
+    'LANG': 'C.UTF-8'
+}
+
+
+async def connect_operation_websocket(operation_id: str, secret: str):
+    """连接LXD操作的websocket (经由unix socket), 关闭压缩以降低按键延迟"""
+    return await websockets.unix_connect(
+        lxd_socket_path(),
+        f'ws://lxd/1.0/operations/{operation_id}/websocket?secret={secret}',
+        compression=None,
+        max_size=None,
+        max_queue=settings.CONSOLE_MAX_QUEUE,
+        write_limit=settings.CONSOLE_WRITE_LIMIT,
+        ping_interval=None
+    )
+
+
+class ConsoleSession:
+    """一个终端会话: LXD的数据和控制websocket"""
+
+    def __init__(self, container_name: str, data, control):
+        self.container_name = container_name
+        self.data = data
+        self.control = control
+        self.bytes_in = 0  # 浏览器 -> 容器
+        self.bytes_out = 0  # 容器 -> 浏览器
+
+    async def resize(self, cols: int, rows: int):
+        await self.control.send(json.dumps({
+            'command': 'window-resize',
+            'args': {'width': str(cols), 'height': str(rows)}
+        }))
+
+    async def signal(self, signum: int):
+        await self.control.send(json.dumps({'command': 'signal', 'signal': signum}))
+
+    async def _handle_control(self, text: str):
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        if message.get('type') == 'resize':
+            await self.resize(int(message['cols']), int(message['rows']))
+        elif message.get('type') == 'signal':
+            await self.signal(int(message['signal']))
+
+    async def bridge(self, websocket) -> str:
+        """双向转发直到进程退出或浏览器断开, 返回结束原因"""
+
+        async def container_to_client():
+            async for message in self.data:
+                if isinstance(message, str):
+                    message = message.encode()
+                await websocket.send_bytes(message)
+                self.bytes_out += len(message)
+            return 'exited'
+
+        async def client_to_container():
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    return 'disconnected'
+                if message.get('bytes') is not None:
+                    await self.data.send(message['bytes'])
+                    self.bytes_in += len(message['bytes'])
+                elif message.get('text'):
+                    await self._handle_control(message['text'])
+
+        tasks = [asyncio.create_task(container_to_client()), asyncio.create_task(client_to_container())]
+        reason = 'closed'
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    reason = task.result()
+                elif not isinstance(error, (websockets.ConnectionClosed, WebSocketDisconnect, ConnectionError)):
+                    print(f"终端转发错误 ({self.container_name}): {str(error)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.close(hangup=reason != 'exited')
+        return reason
+
+    async def close(self, hangup: bool = False):
+        """浏览器先断开时向shell发送SIGHUP, 避免进程残留"""
+        if hangup:
+            try:
+                await self.signal(1)
+            except Exception:
+                pass
+        for ws in (self.data, self.control):
+            try:
+                await ws.close()
+            except Exception:
+                pass
+
+
+class ConsoleService:
+    """管理本进程中的终端会话"""
+
+    def __init__(self):
+        self.sessions: Dict[int, Dict] = {}
+        self._next_id = 0
+        self._total = 0
+        self._rejected = 0
+        self._reserved = 0  # 已占用的名额, 含尚在握手中的连接
+
+    def reserve(self) -> bool:
+        """占用一个终端名额(在打开LXD exec之前), 已达上限时返回False; 结束时须调用 release()"""
+        if self._reserved >= settings.CONSOLE_MAX_SESSIONS:
+            self._rejected += 1
+            return False
+        self._reserved += 1
+        return True
+
+    def release(self):
+        self._reserved -= 1
+
+    async def open(self, container_name: str, cols: int, rows: int) -> ConsoleSession:
+        """在容器中启动交互式shell并连接其websocket"""
+        result = await async_lxd_service.exec_interactive(
+            container_name, settings.CONSOLE_COMMAND, CONSOLE_ENVIRONMENT, cols, rows
+        )
+        fds = result['fds']
+        data = await connect_operation_websocket(result['operation'], fds['0'])
+        try:
+            control = await connect_operation_websocket(result['operation'], fds['control'])
+        except Exception:
+            await data.close()
+            raise
+        return ConsoleSession(container_name, data, control)
+
+    async def run(self, websocket, session: ConsoleSession, username: str) -> str:
+        self._next_id += 1
+        session_id = self._next_id
+        self.sessions[session_id] = {
+            'container': session.container_name,
+            'username': username,
+            'started_at': time.time()
+        }
+        self._total += 1
+        try:
+            return await session.bridge(websocket)
+        finally:
+            self.sessions.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            'active': len(self.sessions),
+            'reserved': self._reserved,
+            'max_sessions': settings.CONSOLE_MAX_SESSIONS,
+            'total': self._total,
+            'rejected': self._rejected
+        }
+
+
+# 全局终端服务
+console_service = ConsoleService()
@@ -2,8 +2,16 @@
 import pylxd
 import secrets
 import string
-import time
-from typing import Dict
+import asyncio
+import subprocess
+from typing import Dict, Optional
+
+from config import settings
+from services.executor import AsyncFacade, lxd_executor
+from services.image_cache import image_cache
+from services.port_allocator import NAT_PORTS_KEY, SSH_PORT_KEY, port_allocator
+from services.port_forward import port_forwards
+from services.template_service import template_service
 
 class ContainerCreator:
     def __init__(self):
@@ -17,7 +25,7 @@ class ContainerCreator:
         chars = string.ascii_letters + string.digits
         return ''.join(secrets.choice(chars) for _ in range(length))
     
-    def create_container(
+    def build_config(
         self,
         name: str,
         cpu: float,
@@ -25,117 +33,108 @@ class ContainerCreator:
         disk: int,
         os_type: str,
         os_version: str,
+        password: str,
         ssh_port: int,
+        bandwidth: int = 10,
         nat_start: int = 0,
         nat_end: int = 0,
-        bandwidth: int = 10
+        template: Optional[str] = None
     ) -> Dict:
         """
-        创建并配置容器
+        生成LXD实例配置 (端口写入 user.panel.* 键, 供启动时重建端口分配表)
+        template 为模板快照 "<模板>/<快照>" 时从其复制, cloud-init只设置密码
         """
-        if not self.client:
-            return {
-                'success': False,
-                'message': 'LXD客户端初始化失败，请确保LXD已安装并运行'
-            }
-
-        try:
-            password = self.generate_password()
-            
-            # 1. 创建容器配置
-            config = {
-                'name': name,
-                'source': {
-                    'type': 'image',
-                    'mode': 'pull',
-                    'server': 'https://images.linuxcontainers.org',
-                    'protocol': 'simplestreams',
-                    'alias': f'{os_type}/{os_version}'
-                },
-                'config': {
-                    'limits.cpu': str(cpu),
-                    'limits.memory': f'{memory}MB',
-                    'user.user-data': self._get_cloud_init_config(password, ssh_port)
+        if template:
+            source = {'type': 'copy', 'source': template}
+        else:
+            source = image_cache.source(os_type, os_version)
+        config = {
+            'name': name,
+            'source': source,
+            'config': {
+                'limits.cpu': str(cpu),
+                'limits.memory': f'{memory}MB',
+                'user.user-data': self._get_cloud_init_config(password, ssh_port, baked=bool(template))
+            },
+            'devices': {
+                'root': {
+                    'path': '/',
+                    'pool': settings.STORAGE_POOL,
+                    'type': 'disk',
+                    'size': f'{disk}GB'
                 },
-                'devices': {
-                    'root': {
-                        'path': '/',
-                        'pool': 'default',
-                        'type': 'disk',
-                        'size': f'{disk}GB'
-                    },
-                    'eth0': {
-                        'name': 'eth0',
-                        'nictype': 'bridged',
-                        'parent': 'lxdbr0',
-                        'type': 'nic'
-                    }
+                'eth0': {
+                    'name': 'eth0',
+                    'nictype': 'bridged',
+                    'parent': 'lxdbr0',
+                    'type': 'nic'
                 }
             }
-            
-            # 添加带宽限制
-            if bandwidth > 0:
-                config['devices']['eth0']['limits.ingress'] = f'{bandwidth}Mbit'
-                config['devices']['eth0']['limits.egress'] = f'{bandwidth}Mbit'
-            
-            # 2. 创建容器
-            print(f"正在创建容器 {name}...")
-            container = self.client.containers.create(config, wait=True)
-            
-            # 3. 启动容器
-            print(f"正在启动容器 {name}...")
+        }
+        
+        if ssh_port:
+            config['config'][SSH_PORT_KEY] = str(ssh_port)
+        if nat_start > 0 and nat_end > 0:
+            config['config'][NAT_PORTS_KEY] = f'{nat_start}-{nat_end}'
+        
+        # 添加带宽限制
+        if bandwidth > 0:
+            config['devices']['eth0']['limits.ingress'] = f'{bandwidth}Mbit'
+            config['devices']['eth0']['limits.egress'] = f'{bandwidth}Mbit'
+        return config
+    
+    def find_template(self, os_type: str, os_version: str) -> Optional[str]:
+        """该系统已制作好的模板快照"""
+        if not settings.TEMPLATES_ENABLED:
+            return None
+        try:
+            return template_service.snapshot_source(os_type, os_version)
+        except Exception as e:
+            print(f"查询模板失败: {str(e)}")
+            return None
+    
+    def prepare_image(self, os_type: str, os_version: str):
+        """确保镜像已缓存到本地; 失败时 build_config 回退到从远程拉取"""
+        if not settings.IMAGE_CACHE_ENABLED:
+            return
+        try:
+            image_cache.ensure(f'{os_type}/{os_version}')
+        except Exception as e:
+            print(f"缓存镜像 {os_type}/{os_version} 失败, 改为从远程拉取: {str(e)}")
+    
+    def instance_exists(self, name: str) -> bool:
+        """容器是否已存在"""
+        return self.client.containers.exists(name)
+    
+    def create_instance(self, config: Dict):
+        """阶段1: 创建容器"""
+        print(f"正在创建容器 {config['name']}...")
+        self.client.containers.create(config, wait=True)
+    
+    def start_instance(self, name: str):
+        """阶段2: 启动容器"""
+        print(f"正在启动容器 {name}...")
+        container = self.client.containers.get(name)
+        if container.status != 'Running':
             container.start(wait=True)
-            
-            # 4. 等待网络就绪
-            time.sleep(10) # 增加等待时间
-            
-            # 5. 获取IP地址
-            # 尝试多次获取IP
-            ip_address = None
-            for _ in range(5):
-                container.sync()
-                ip_address = self._get_container_ip(container)
-                if ip_address:
-                    break
-                time.sleep(2)
-            
-            if not ip_address:
-                print(f"警告: 无法获取容器 {name} 的IP地址")
-            
-            # 6. 配置SSH端口转发（如果需要）
-            if ssh_port and ssh_port != 22 and ip_address:
-                self._setup_ssh_port_forward(name, ssh_port, ip_address)
-            
-            # 7. 配置NAT端口转发（如果需要）
-            if nat_start > 0 and nat_end > 0 and ip_address:
-                self._setup_nat_forwards(name, nat_start, nat_end, ip_address)
-            
-            return {
-                'success': True,
-                'message': f'容器 {name} 创建成功',
-                'data': {
-                    'name': name,
-                    'ip': ip_address or '获取中...',
-                    'password': password,
-                    'ssh_port': ssh_port,
-                    'status': 'Running'
-                }
-            }
-            
-        except pylxd.exceptions.LXDAPIException as e:
-            return {
-                'success': False,
-                'message': f'LXD API错误: {str(e)}'
-            }
+    
+    def get_instance_ip(self, name: str) -> Optional[str]:
+        """阶段3: 查询容器IP(由调用方负责轮询)"""
+        container = self.client.containers.get(name)
+        return self._get_container_ip(container)
+    
+    def setup_port_forwards(self, name: str, ssh_port: int, nat_start: int, nat_end: int, ip_address: str):
+        """阶段4: 配置SSH和NAT端口转发 (一次iptables-restore应用全部规则)"""
+        try:
+            port_forwards.apply(name, ip_address, ssh_port, nat_start, nat_end)
+        except subprocess.CalledProcessError as e:
+            print(f"设置端口转发失败: {e.stderr.strip() if e.stderr else str(e)}")
         except Exception as e:
-            return {
-                'success': False,
-                'message': f'创建失败: {str(e)}'
-            }
+            print(f"设置端口转发失败: {str(e)}")
     
-    def _get_cloud_init_config(self, password: str, ssh_port: int = 22) -> str:
-        """生成cloud-init配置"""
-        return f"""#cloud-config
+    def _get_cloud_init_config(self, password: str, ssh_port: int = 22, baked: bool = False) -> str:
+        """生成cloud-init配置, baked 为True(从模板复制)时软件和sshd已就绪, 只设置密码"""
+        config = f"""#cloud-config
 users:
   - name: root
     lock_passwd: false
@@ -143,7 +142,10 @@ users:
     
 ssh_pwauth: true
 disable_root: false
-
+"""
+        if baked:
+            return config
+        return config + """
 packages:
   - openssh-server
   - curl
@@ -172,33 +174,76 @@ runcmd:
             return None
         except:
             return None
-    
-    def _setup_ssh_port_forward(self, container_name: str, host_port: int, container_ip: str):
-        """设置SSH端口转发"""
-        try:
-            import subprocess
-            # 移除旧规则（如果存在）
-            cleanup_cmd = f"iptables -t nat -D PREROUTING -p tcp --dport {host_port} -j DNAT --to-destination {container_ip}:22 2>/dev/null || true"
-            subprocess.run(cleanup_cmd, shell=True)
-            
-            # 添加新规则
-            cmd = f"iptables -t nat -A PREROUTING -p tcp --dport {host_port} -j DNAT --to-destination {container_ip}:22"
-            subprocess.run(cmd, shell=True, check=True)
-            print(f"SSH端口转发设置成功: {host_port} -> {container_ip}:22")
-        except Exception as e:
-            print(f"设置SSH端口转发失败: {str(e)}")
-    
-    def _setup_nat_forwards(self, container_name: str, start_port: int, end_port: int, container_ip: str):
-        """设置NAT端口转发范围"""
-        try:
-            import subprocess
-            for port in range(start_port, end_port + 1):
-                # 简单添加，生产环境应该有更复杂的规则管理
-                cmd = f"iptables -t nat -A PREROUTING -p tcp --dport {port} -j DNAT --to-destination {container_ip}:{port}"
-                subprocess.run(cmd, shell=True, check=True)
-            print(f"NAT端口转发设置成功: {start_port}-{end_port} -> {container_ip}")
-        except Exception as e:
-            print(f"设置NAT端口转发失败: {str(e)}")
 
 # 全局实例
 container_creator = ContainerCreator()
+async_container_creator = AsyncFacade(container_creator, lxd_executor)
+
+
+async def create_container_job(job) -> Dict:
+    """
+    容器创建任务: create -> start -> network -> port_forward
+    每个阶段完成后保存断点, 后端重启后从未完成的阶段继续
+    """
+    if not container_creator.client:
+        raise Exception('LXD客户端初始化失败，请确保LXD已安装并运行')
+    
+    params = job.params
+    name = params['name']
+    
+    if not job.stage_done('create'):
+        await job.update('create', 10, f'正在创建容器 {name}')
+        # 重启续跑时容器可能已创建成功
+        if not await async_container_creator.instance_exists(name):
+            # 有制作好的模板时从模板快照复制, 否则从(缓存的)镜像创建
+            template = await async_container_creator.find_template(params['os_type'], params['os_version'])
+            if not template:
+                await async_container_creator.prepare_image(params['os_type'], params['os_version'])
+            config = container_creator.build_config(
+                name, params['cpu'], params['memory'], params['disk'],
+                params['os_type'], params['os_version'], params['password'],
+                params['ssh_port'], params.get('bandwidth', 10),
+                params.get('nat_start', 0), params.get('nat_end', 0), template
+            )
+            try:
+                await async_container_creator.create_instance(config)
+            except Exception:
+                # 容器未能创建, 释放提交任务时分配的端口
+                if not await async_container_creator.instance_exists(name):
+                    await port_allocator.release(name)
+                raise
+        await job.complete_stage('create')
+    
+    if not job.stage_done('start'):
+        await job.update('start', 40, f'正在启动容器 {name}')
+        await async_container_creator.start_instance(name)
+        await job.complete_stage('start')
+    
+    ip_address = job.checkpoint.get('ip')
+    if not job.stage_done('network'):
+        await job.update('network', 60, '等待网络就绪')
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.CREATE_NETWORK_TIMEOUT
+        while True:
+            ip_address = await async_container_creator.get_instance_ip(name)
+            if ip_address or loop.time() >= deadline:
+                break
+            await asyncio.sleep(1)
+        if not ip_address:
+            print(f"警告: 无法获取容器 {name} 的IP地址")
+        await job.complete_stage('network', ip=ip_address)
+    
+    if not job.stage_done('port_forward') and ip_address:
+        await job.update('port_forward', 85, '配置端口转发')
+        await async_container_creator.setup_port_forwards(
+            name, params['ssh_port'], params.get('nat_start', 0), params.get('nat_end', 0), ip_address
+        )
+        await job.complete_stage('port_forward')
+    
+    return {
+        'name': name,
+        'ip': ip_address or '获取中...',
+        'password': params['password'],
+        'ssh_port': params['ssh_port'],
+        'status': 'Running'
+    }
@@ -0,0 +1,86 @@
+"""监控历史数据降采样 - Largest-Triangle-Three-Buckets (LTTB)"""
+from datetime import datetime, timezone
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# LTTB至少保留首尾两点和中间一个桶
+MIN_POINTS = 3
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    对单条序列执行LTTB, 返回被选中点的下标(升序)
+
+    首尾两点固定保留, 其余点均分到 n_out-2 个桶中; 每个桶选出与
+    "上一个选中点"和"下一个桶的平均点"构成三角形面积最大的点。
+    桶边界与各桶平均点一次性向量化计算, 逐桶循环中只做一次向量化的面积计算。
+    """
+    n = len(x)
+    if n_out >= n or n_out < MIN_POINTS:
+        return np.arange(n)
+
+    # 中间点 [1, n-1) 均分为 n_out-2 个桶
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+
+    # 每个桶的平均点, 供前一个桶作为第三个顶点; 最后一个桶使用末尾点
+    sum_x = np.add.reduceat(x[1:n - 1], starts - 1)
+    sum_y = np.add.reduceat(y[1:n - 1], starts - 1)
+    counts = ends - starts
+    avg_x = np.append(sum_x[1:] / counts[1:], x[-1])
+    avg_y = np.append(sum_y[1:] / counts[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = starts[i], ends[i]
+        bx = x[start:end]
+        by = y[start:end]
+        # 三角形面积的两倍, 比较大小时无需乘0.5
+        area = np.abs(
+            (x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_rows(rows: List[Dict], max_points: int, metrics: Sequence[str]) -> List[Dict]:
+    """
+    将按时间升序排列的样本降到最多 max_points 行
+
+    每个有数据的指标分得 max_points // 指标数 个点(至少 MIN_POINTS 个)分别执行LTTB,
+    最终返回所有指标选中下标的并集, 因此每条曲线的峰谷都得到保留。
+    max_points 小于 指标数 * MIN_POINTS 时并集可能超出, 此时在并集中均匀抽取
+    (保留首尾), 总行数始终不超过 max_points。
+    """
+    if max_points is None or len(rows) <= max_points:
+        return rows
+
+    x = np.array([to_epoch(row['timestamp']) for row in rows], dtype=np.float64)
+    series = []
+    for metric in metrics:
+        y = np.array([row.get(metric) for row in rows], dtype=np.float64)  # None -> nan
+        if not np.isnan(y).all():
+            series.append(np.nan_to_num(y))
+    if not series:
+        step = len(rows) / max_points
+        return [rows[int(i * step)] for i in range(max_points)]
+
+    budget = max(max_points // len(series), MIN_POINTS)
+    keep = np.unique(np.concatenate([lttb_indices(x, y, budget) for y in series]))
+    if len(keep) > max_points:
+        keep = keep[np.linspace(0, len(keep) - 1, max_points).round().astype(np.int64)]
+    return [rows[i] for i in keep]
+
+
+def to_epoch(value) -> float:
+    """样本时间戳(UTC, 不带时区的datetime或ISO字符串)转换为epoch秒"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
@@ -0,0 +1,202 @@
+"""阻塞调用执行层 - 将pylxd/子进程调用移出asyncio事件循环"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from config import settings
+
+
+class ExecutorSaturated(Exception):
+    """执行队列已满"""
+
+
+class BlockingExecutor:
+    """
+    有界线程池
+
+    同时在途(排队+执行中)的任务数超过 max_pending 时直接拒绝,
+    避免无限排队拖垮整个进程。
+    """
+
+    def __init__(self, name: str, max_workers: int, max_pending: int = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行同步函数并等待结果"""
+        with self._lock:
+            if self.max_pending and self._pending >= self.max_pending:
+                self._rejected += 1
+                raise ExecutorSaturated(f"{self.name} 执行队列已满 ({self._pending})")
+            self._pending += 1
+            queue_depth = self._pending - self._active
+            self._max_queue_depth = max(self._max_queue_depth, queue_depth)
+
+        submitted = time.monotonic()
+        try:
+            future = self._pool.submit(self._call, partial(func, *args, **kwargs), submitted)
+        except BaseException:
+            self._done(None)
+            raise
+        # 在线程中的调用结束(或排队时被取消)后才释放名额; 调用方await被取消时线程仍在执行, 仍占用名额
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _call(self, func: Callable, submitted: float) -> Any:
+        with self._lock:
+            self._active += 1
+            self._total_wait += time.monotonic() - submitted
+        try:
+            result = func()
+        except BaseException:
+            with self._lock:
+                self._failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+        return result
+
+    def stats(self) -> Dict:
+        """队列深度等运行指标"""
+        with self._lock:
+            completed = self._completed
+            return {
+                'workers': self.max_workers,
+                'max_pending': self.max_pending,
+                'active': self._active,
+                'queued': self._pending - self._active,
+                'max_queue_depth': self._max_queue_depth,
+                'completed': completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._total_wait / completed * 1000, 2) if completed else 0.0
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class CommandResult:
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+class CommandRunner:
+    """基于asyncio子进程的命令执行器, 限制并发子进程数量"""
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+        self._running = 0
+        self._completed = 0
+        self._timeouts = 0
+
+    async def run(self, args: List[str], timeout: float = 10) -> CommandResult:
+        """执行命令, 超时后杀掉子进程并抛出 asyncio.TimeoutError"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                proc.kill()
+                await proc.wait()
+                raise
+            return CommandResult(
+                proc.returncode,
+                stdout.decode(errors='replace'),
+                stderr.decode(errors='replace')
+            )
+        finally:
+            self._running -= 1
+            self._completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            'concurrency': self.concurrency,
+            'running': self._running,
+            'queued': self._waiting,
+            'completed': self._completed,
+            'timeouts': self._timeouts
+        }
+
+
+class AsyncFacade:
+    """将同步服务对象的方法包装为在指定线程池中执行的协程"""
+
+    def __init__(self, target: Any, executor: BlockingExecutor):
+        self._target = target
+        self._executor = executor
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await self._executor.run(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+# 全局执行器实例
+lxd_executor = BlockingExecutor(
+    "lxd",
+    max_workers=settings.LXD_EXECUTOR_WORKERS,
+    max_pending=settings.LXD_EXECUTOR_MAX_PENDING
+)
+command_runner = CommandRunner(settings.SUBPROCESS_CONCURRENCY)
+# 密码哈希(bcrypt)专用: CPU密集, 线程数按核数设置, bcrypt计算时释放GIL
+auth_executor = BlockingExecutor(
+    "auth",
+    max_workers=settings.AUTH_HASH_WORKERS,
+    max_pending=settings.AUTH_HASH_MAX_PENDING
+)
+
+
+def executor_stats() -> Dict:
+    """所有执行器的指标"""
+    return {
+        'lxd': lxd_executor.stats(),
+        'auth': auth_executor.stats(),
+        'subprocess': command_runner.stats()
+    }
@@ -0,0 +1,393 @@
+"""
+文件传输 - 经LXD文件API在浏览器和容器之间流式上传/下载
+
+pylxd的 files.get/put 会把整个文件读入内存, 这里改为直接在LXD的unix socket上发送HTTP请求
+(h11负责HTTP/1.1的分帧), 请求体和响应体都按 FILE_TRANSFER_CHUNK_SIZE 分块转发:
+  上传: 浏览器 -> 合并为固定大小的块 -> LXD, 每块写入后等待发送缓冲排空
+  下载: LXD -> 每次最多读一块 -> 浏览器, 浏览器接收慢时不再读取LXD socket
+每个传输任何时候在内存中只保留约两个块, 与文件大小无关。
+
+下载支持单个字节范围的 Range 请求 (断点续传): 转发给LXD,
+LXD忽略Range返回整个文件时, 由本层跳过前面的字节并在范围末尾截断。
+"""
+import asyncio
+import itertools
+import json
+import re
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import h11
+
+from config import settings
+from services.lxd_socket import lxd_socket_path
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+PASSTHROUGH_HEADERS = ('content-type', 'x-lxd-type', 'x-lxd-uid', 'x-lxd-gid', 'x-lxd-mode')
+
+
+class LXDFileError(Exception):
+    """LXD返回的错误, status为LXD的HTTP状态码"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析 bytes=a-b / bytes=a- / bytes=-n, 返回闭区间 (start, end)
+    多个范围或无法解析时返回None (按规范忽略Range, 返回整个文件)
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(0) == 'bytes=-':
+        return None
+    first, last = match.groups()
+    if not first:
+        # 后缀范围: 最后n个字节
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+async def chunked(body: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """把大小不一的请求体片段合并为固定大小的块 (最后一块可能较小)"""
+    buffer = bytearray()
+    async for data in body:
+        buffer += data
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class LXDFileStream:
+    """LXD文件API上的一次HTTP请求, 每个传输独占一条unix socket连接"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.conn = h11.Connection(h11.CLIENT)
+        self.status = 0
+        self.headers: Dict[str, str] = {}
+
+    @classmethod
+    async def request(cls, method: str, target: str, headers: Dict[str, str],
+                      body: Optional[AsyncIterator[bytes]] = None) -> 'LXDFileStream':
+        """发送请求 (含请求体) 并读取响应头; 响应体由 iter_body() 逐块读取"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(lxd_socket_path(), limit=settings.FILE_TRANSFER_CHUNK_SIZE),
+            settings.FILE_TRANSFER_TIMEOUT
+        )
+        stream = cls(reader, writer)
+        # 边发送请求体边等待响应: LXD可能不读完请求体就返回错误 (如路径不存在)
+        sending = asyncio.create_task(stream._send_request(method, target, headers, body))
+        head = asyncio.create_task(stream._read_head())
+        try:
+            await asyncio.wait([sending, head], return_when=asyncio.FIRST_COMPLETED)
+            if not sending.done():
+                sending.cancel()
+            elif sending.exception() and not isinstance(sending.exception(), ConnectionError):
+                raise sending.exception()
+            await asyncio.wait_for(head, settings.FILE_TRANSFER_TIMEOUT)
+        except BaseException:
+            stream.close()
+            raise
+        finally:
+            for task in (sending, head):
+                task.cancel()
+            await asyncio.gather(sending, head, return_exceptions=True)
+        return stream
+
+    async def _send(self, event):
+        self.writer.write(self.conn.send(event))
+        await self.writer.drain()
+
+    async def _send_request(self, method: str, target: str, headers: Dict[str, str],
+                            body: Optional[AsyncIterator[bytes]]):
+        request_headers = [('Host', 'lxd'), ('Connection', 'close')]
+        request_headers += list(headers.items())
+        if body is not None and 'Content-Length' not in headers:
+            request_headers.append(('Transfer-Encoding', 'chunked'))
+        await self._send(h11.Request(method=method, target=target, headers=request_headers))
+        if body is not None:
+            async for data in body:
+                await self._send(h11.Data(data=data))
+        await self._send(h11.EndOfMessage())
+
+    async def _next_event(self):
+        while True:
+            event = self.conn.next_event()
+            if event is not h11.NEED_DATA:
+                return event
+            self.conn.receive_data(await self.reader.read(settings.FILE_TRANSFER_CHUNK_SIZE))
+
+    async def _read_head(self):
+        event = await self._next_event()
+        while isinstance(event, h11.InformationalResponse):
+            event = await self._next_event()
+        self.status = event.status_code
+        self.headers = {name.decode().lower(): value.decode('latin-1') for name, value in event.headers}
+
+    async def iter_body(self) -> AsyncIterator[bytes]:
+        while True:
+            event = await self._next_event()
+            if isinstance(event, h11.Data):
+                yield bytes(event.data)  # h11可能给出bytearray
+            elif isinstance(event, (h11.EndOfMessage, h11.ConnectionClosed)):
+                return
+
+    async def error(self) -> LXDFileError:
+        """读取LXD的错误响应 ({"error": "...", "error_code": 404})"""
+        body = bytearray()
+        async for data in self.iter_body():
+            body += data
+            if len(body) > 65536:
+                break
+        try:
+            message = json.loads(bytes(body)).get('error') or ''
+        except ValueError:
+            message = bytes(body[:200]).decode(errors='replace')
+        return LXDFileError(self.status, message or f"LXD返回 {self.status}")
+
+    def close(self):
+        if not self.writer.is_closing():
+            self.writer.close()
+
+
+class FileDownload:
+    """
+    下载响应: 状态码、响应头和逐块产生的响应体
+    调用方必须在响应结束后调用 aclose() 释放传输名额并关闭LXD连接;
+    客户端在第一块发出前断开时响应体生成器不会启动, 不能依赖其 finally
+    """
+
+    def __init__(self, status: int, headers: Dict[str, str], body: Optional[AsyncIterator[bytes]] = None,
+                 on_close: Optional[Callable[[], None]] = None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self._on_close = on_close
+
+    async def aclose(self):
+        """可重复调用"""
+        if self.body is not None:
+            await self.body.aclose()
+        on_close, self._on_close = self._on_close, None
+        if on_close:
+            on_close()
+
+
+class FileTransferService:
+    """管理本进程中的文件传输, 统计吞吐"""
+
+    def __init__(self):
+        self.transfers: Dict[int, Dict] = {}
+        self._ids = itertools.count(1)
+        self._recent = deque(maxlen=20)
+        self._rejected = 0
+        self._failed = 0
+        self._counts = {'upload': 0, 'download': 0}
+        self._bytes = {'upload': 0, 'download': 0}
+
+    @property
+    def full(self) -> bool:
+        return len(self.transfers) >= settings.FILE_TRANSFER_MAX_ACTIVE
+
+    def reject(self):
+        self._rejected += 1
+
+    @staticmethod
+    def _target(container_name: str, path: str) -> str:
+        return f"/1.0/containers/{quote(container_name, safe='')}/files?path={quote(path, safe='')}"
+
+    def _begin(self, direction: str, container_name: str, path: str, username: str) -> int:
+        transfer_id = next(self._ids)
+        self.transfers[transfer_id] = {
+            'id': transfer_id,
+            'direction': direction,
+            'container': container_name,
+            'path': path,
+            'username': username,
+            'started_at': time.time(),
+            'bytes': 0
+        }
+        return transfer_id
+
+    def _finish(self, transfer_id: int, ok: bool) -> Dict:
+        transfer = self.transfers.pop(transfer_id)
+        transfer['seconds'] = round(time.time() - transfer['started_at'], 3)
+        transfer['throughput'] = self._throughput(transfer['bytes'], transfer['seconds'])
+        transfer['ok'] = ok
+        self._counts[transfer['direction']] += 1
+        self._bytes[transfer['direction']] += transfer['bytes']
+        if not ok:
+            self._failed += 1
+        self._recent.append(transfer)
+        return transfer
+
+    @staticmethod
+    def _throughput(nbytes: int, seconds: float) -> float:
+        """MB/s"""
+        return round(nbytes / max(seconds, 0.001) / 1024 / 1024, 2)
+
+    async def download(self, container_name: str, path: str, range_header: Optional[str], username: str) -> FileDownload:
+        """打开下载; 只有响应头已从LXD读到后才返回, 出错时抛出 LXDFileError"""
+        transfer_id = self._begin('download', container_name, path, username)
+        try:
+            headers = {'Range': range_header} if range_header else {}
+            stream = await LXDFileStream.request('GET', self._target(container_name, path), headers)
+        except BaseException:
+            self._finish(transfer_id, False)
+            raise
+        try:
+            if stream.status >= 400:
+                raise await stream.error()
+            return self._prepare_download(stream, transfer_id, path, range_header)
+        except BaseException:
+            stream.close()
+            self._finish(transfer_id, False)
+            raise
+
+    def _prepare_download(self, stream: LXDFileStream, transfer_id: int, path: str,
+                          range_header: Optional[str]) -> FileDownload:
+        headers = {name: stream.headers[name] for name in PASSTHROUGH_HEADERS if name in stream.headers}
+        is_file = stream.headers.get('x-lxd-type', 'file') == 'file'
+        length = stream.headers.get('content-length')
+        status = stream.status
+        skip, limit = 0, None
+
+        if is_file:
+            filename = path.rstrip('/').rsplit('/', 1)[-1] or 'download'
+            headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+            headers['Accept-Ranges'] = 'bytes'
+        if status == 206:
+            headers['Content-Range'] = stream.headers.get('content-range', '')
+        elif status == 200 and range_header and is_file and length is not None:
+            # LXD未处理Range: 在本层跳过前面的字节并截断
+            size = int(length)
+            try:
+                selected = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                stream.close()
+                self._finish(transfer_id, False)
+                return FileDownload(416, {'Content-Range': f"bytes */{size}"})
+            if selected:
+                skip, end = selected
+                limit = end - skip + 1
+                status = 206
+                headers['Content-Range'] = f"bytes {skip}-{end}/{size}"
+                length = str(limit)
+        if length is not None:
+            headers['Content-Length'] = length
+        state = {'ok': False}
+
+        def close():
+            stream.close()
+            self._finish(transfer_id, state['ok'])
+
+        body = self._relay_download(stream, self.transfers[transfer_id], skip, limit, state)
+        return FileDownload(status, headers, body, close)
+
+    @staticmethod
+    async def _relay_download(stream: LXDFileStream, transfer: Dict, skip: int, limit: Optional[int],
+                              state: Dict) -> AsyncIterator[bytes]:
+        async for data in stream.iter_body():
+            if skip:
+                if len(data) <= skip:
+                    skip -= len(data)
+                    continue
+                data = data[skip:]
+                skip = 0
+            if limit is not None:
+                data = data[:limit]
+                limit -= len(data)
+            transfer['bytes'] += len(data)
+            yield data
+            if limit == 0:
+                break
+        state['ok'] = True
+
+    async def upload(self, container_name: str, path: str, body: AsyncIterator[bytes], content_length: Optional[int],
+                     uid: int, gid: int, mode: str, append: bool, username: str) -> Dict:
+        """把请求体分块写入容器中的文件, 返回字节数、耗时和吞吐"""
+        transfer_id = self._begin('upload', container_name, path, username)
+        transfer = self.transfers[transfer_id]
+
+        async def counted():
+            async for data in chunked(body, settings.FILE_TRANSFER_CHUNK_SIZE):
+                transfer['bytes'] += len(data)
+                yield data
+
+        headers = {
+            'X-LXD-type': 'file',
+            'X-LXD-uid': str(uid),
+            'X-LXD-gid': str(gid),
+            'X-LXD-mode': mode,
+            'X-LXD-write': 'append' if append else 'overwrite',
+            'Content-Type': 'application/octet-stream'
+        }
+        if content_length is not None:
+            headers['Content-Length'] = str(content_length)
+        ok = False
+        try:
+            stream = await LXDFileStream.request('POST', self._target(container_name, path), headers, counted())
+            try:
+                if stream.status >= 400:
+                    raise await stream.error()
+            finally:
+                stream.close()
+            ok = True
+        finally:
+            result = self._finish(transfer_id, ok)
+        return {
+            'path': path,
+            'bytes': result['bytes'],
+            'seconds': result['seconds'],
+            'throughput': result['throughput']
+        }
+
+    def active(self) -> List[Dict]:
+        """进行中的传输及其当前吞吐"""
+        now = time.time()
+        return [
+            {**transfer, 'throughput': self._throughput(transfer['bytes'], now - transfer['started_at'])}
+            for transfer in self.transfers.values()
+        ]
+
+    def recent(self) -> List[Dict]:
+        return list(self._recent)
+
+    def stats(self) -> Dict:
+        in_flight = {'upload': 0, 'download': 0}
+        for transfer in self.transfers.values():
+            in_flight[transfer['direction']] += transfer['bytes']
+        return {
+            'active': len(self.transfers),
+            'max_active': settings.FILE_TRANSFER_MAX_ACTIVE,
+            'uploads': self._counts['upload'],
+            'downloads': self._counts['download'],
+            'failed': self._failed,
+            'rejected': self._rejected,
+            'bytes_up': self._bytes['upload'] + in_flight['upload'],
+            'bytes_down': self._bytes['download'] + in_flight['download']
+        }
+
+
+# 全局文件传输服务
+file_transfers = FileTransferService()
@@ -0,0 +1,65 @@
+"""
+监控历史数据的紧凑编码
+
+columnar (JSON):
+    {"count": N, "start": 起始时间(epoch秒), "step": 固定间隔秒数 或 null,
+     "deltas": 相邻时间差(秒)数组 或 null, "metrics": {指标: [值...]}}
+    时间戳等间隔(汇总层)时只给出 step, 否则给出 N-1 个差值
+
+binary (application/octet-stream, 小端序):
+    每个容器一帧, 多个容器的帧直接拼接:
+    - 帧头 24 字节: magic 'LXDM', uint8 版本, uint8 保留, uint16 指标数M,
+      uint32 点数N, float64 起始时间(epoch秒), uint16 名称长度, uint16 指标名长度
+    - 容器名(UTF-8) + 逗号分隔的指标名(UTF-8), 补零到4字节对齐
+    - float32[N] 相对起始时间的秒数, 随后M个 float32[N] 指标数组, 缺失值为NaN
+"""
+import struct
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from services.downsample import to_epoch
+
+FORMATS = ('rows', 'columnar', 'binary')
+
+BINARY_MAGIC = b'LXDM'
+BINARY_VERSION = 1
+_HEADER = struct.Struct('<4sBBHIdHH')
+
+
+def _epochs(rows: List[Dict]) -> np.ndarray:
+    return np.array([to_epoch(row['timestamp']) for row in rows], dtype=np.float64)
+
+
+def to_columnar(rows: List[Dict], metrics: Sequence[str]) -> Dict:
+    """按列编码一组按时间升序的样本"""
+    times = np.round(_epochs(rows)).astype(np.int64)
+    deltas = np.diff(times)
+    regular = len(deltas) > 0 and bool((deltas == deltas[0]).all())
+    return {
+        'count': len(rows),
+        'start': int(times[0]) if len(times) else None,
+        'step': int(deltas[0]) if regular else None,
+        'deltas': None if regular else deltas.tolist(),
+        'metrics': {metric: [row.get(metric) for row in rows] for metric in metrics}
+    }
+
+
+def encode_binary(container_name: str, rows: List[Dict], metrics: Sequence[str]) -> bytes:
+    """将一个容器的样本编码为一帧 float32 二进制数据"""
+    times = _epochs(rows)
+    start = float(times[0]) if len(times) else 0.0
+    name = container_name.encode('utf-8')
+    metric_names = ','.join(metrics).encode('utf-8')
+    header = _HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, 0, len(metrics), len(rows),
+        start, len(name), len(metric_names)
+    )
+    labels = name + metric_names
+    labels += b'\0' * (-(len(header) + len(labels)) % 4)
+
+    columns = [times - start]
+    for metric in metrics:
+        columns.append(np.array([row.get(metric) for row in rows], dtype=np.float64))
+    body = np.stack(columns).astype('<f4') if rows else np.empty(0, dtype='<f4')
+    return header + labels + body.tobytes()
@@ -0,0 +1,197 @@
+"""
+镜像缓存 - 把常用系统镜像预先下载到本地LXD镜像库
+
+每个 os_type/os_version 在本地对应一个别名 panel/<os_type>/<os_version>,
+创建容器时直接按本地指纹引用镜像, 不再每次向远程镜像服务器检查更新,
+宿主机离线时也能创建。后台定期刷新已缓存的镜像, 刷新后别名指向新镜像。
+
+IMAGE_SERVER 可以指向内网的simplestreams镜像站, 必须是HTTPS地址 (LXD不支持从本地目录拉取)。
+"""
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pylxd
+
+from config import settings
+from services.executor import AsyncFacade, lxd_executor
+
+LOCAL_ALIAS_PREFIX = 'panel/'
+
+
+def local_alias(alias: str) -> str:
+    return LOCAL_ALIAS_PREFIX + alias
+
+
+class ImageCache:
+    def __init__(self):
+        try:
+            self.client = pylxd.Client()
+        except:
+            self.client = None
+        self._fingerprints: Dict[str, str] = {}  # 远程别名 -> 本地镜像指纹
+        self._refreshed_at: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._refresh_task: Optional[asyncio.Task] = None  # 手动触发的刷新
+
+    # ---------- 同步方法 (在lxd线程池中执行) ----------
+
+    def lookup(self, alias: str) -> Optional[str]:
+        """本地镜像库中该别名对应的指纹"""
+        try:
+            image = self.client.images.get_by_alias(local_alias(alias))
+        except pylxd.exceptions.NotFound:
+            return None
+        with self._lock:
+            self._fingerprints[alias] = image.fingerprint
+        return image.fingerprint
+
+    def ensure(self, alias: str) -> str:
+        """确保镜像已缓存到本地, 返回指纹; 未缓存时从 IMAGE_SERVER 下载"""
+        fingerprint = self.lookup(alias)
+        if fingerprint:
+            return fingerprint
+        print(f"正在下载镜像 {alias} ...")
+        started = time.monotonic()
+        image = self.client.images.create_from_simplestreams(
+            settings.IMAGE_SERVER, alias, auto_update=True
+        )
+        try:
+            image.add_alias(local_alias(alias), f'lxd-panel cache of {alias}')
+        except pylxd.exceptions.LXDAPIException:
+            # 其他进程同时下载并已创建别名
+            pass
+        with self._lock:
+            self._fingerprints[alias] = image.fingerprint
+            self._refreshed_at[alias] = time.time()
+            self._errors.pop(alias, None)
+        print(f"镜像 {alias} 已缓存 ({image.fingerprint[:12]}, {time.monotonic() - started:.1f}s)")
+        return image.fingerprint
+
+    def refresh(self, alias: str) -> str:
+        """让LXD检查远程是否有新版本, 有则下载并把本地别名移到新镜像"""
+        fingerprint = self.lookup(alias)
+        if not fingerprint:
+            return self.ensure(alias)
+        response = self.client.api.images[fingerprint].refresh.post()
+        operation = response.json().get('operation')
+        if operation:
+            self.client.operations.wait_for_operation(operation)
+        new = self.lookup(alias) or fingerprint
+        with self._lock:
+            self._refreshed_at[alias] = time.time()
+            self._errors.pop(alias, None)
+        if new != fingerprint:
+            print(f"镜像 {alias} 已更新: {fingerprint[:12]} -> {new[:12]}")
+        return new
+
+    def sync_all(self, refresh: bool = False) -> Dict[str, Optional[str]]:
+        """缓存(refresh时刷新)配置中的全部镜像, 单个镜像失败不影响其他镜像"""
+        results = {}
+        for alias in settings.IMAGE_CACHE_ALIASES:
+            try:
+                results[alias] = self.refresh(alias) if refresh else self.ensure(alias)
+            except Exception as e:
+                with self._lock:
+                    self._errors[alias] = str(e)
+                results[alias] = None
+                print(f"缓存镜像 {alias} 失败: {str(e)}")
+        return results
+
+    # ---------- 供创建容器使用 ----------
+
+    def source(self, os_type: str, os_version: str) -> Dict:
+        """
+        容器的镜像来源: 已缓存时按本地指纹引用, 否则回退到从远程拉取
+        只读内存中的指纹, 不发起请求, 可在事件循环中调用
+        """
+        alias = f'{os_type}/{os_version}'
+        with self._lock:
+            fingerprint = self._fingerprints.get(alias)
+        if fingerprint:
+            return {'type': 'image', 'fingerprint': fingerprint}
+        return {
+            'type': 'image',
+            'mode': 'pull',
+            'server': settings.IMAGE_SERVER,
+            'protocol': settings.IMAGE_PROTOCOL,
+            'alias': alias
+        }
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': settings.IMAGE_CACHE_ENABLED,
+                'server': settings.IMAGE_SERVER,
+                'images': [
+                    {
+                        'alias': alias,
+                        'fingerprint': self._fingerprints.get(alias),
+                        'refreshed_at': self._refreshed_at.get(alias),
+                        'error': self._errors.get(alias)
+                    }
+                    for alias in self._aliases()
+                ]
+            }
+
+    def _aliases(self) -> List[str]:
+        return list(dict.fromkeys(list(settings.IMAGE_CACHE_ALIASES) + list(self._fingerprints)))
+
+    # ---------- 后台刷新 ----------
+
+    def start(self, is_active):
+        """
+        启动后台预取与定期刷新; is_active() 为真时才执行,
+        多进程部署时只由执行后台任务的进程下载镜像
+        """
+        if self.client and settings.IMAGE_CACHE_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop(is_active))
+
+    def refresh_now(self) -> bool:
+        """在后台立即刷新全部缓存镜像; 上一次手动刷新尚未结束时返回False"""
+        if self._refresh_task and not self._refresh_task.done():
+            return False
+        self._refresh_task = asyncio.create_task(async_image_cache.sync_all(refresh=True))
+        self._refresh_task.add_done_callback(self._refresh_done)
+        return True
+
+    @staticmethod
+    def _refresh_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            print(f"刷新镜像失败: {str(task.exception())}")
+
+    async def stop(self):
+        for task in (self._task, self._refresh_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._refresh_task = None
+
+    async def _refresh_loop(self, is_active):
+        # 所有进程都读取本地已有的镜像指纹, 保证创建时能直接使用
+        for alias in settings.IMAGE_CACHE_ALIASES:
+            try:
+                await async_image_cache.lookup(alias)
+            except Exception as e:
+                print(f"读取本地镜像 {alias} 失败: {str(e)}")
+
+        refresh = False
+        while True:
+            if not is_active():
+                await asyncio.sleep(settings.LEADER_RETRY_INTERVAL)
+                continue
+            await async_image_cache.sync_all(refresh=refresh)
+            refresh = True
+            await asyncio.sleep(settings.IMAGE_REFRESH_INTERVAL)
+
+
+# 全局镜像缓存
+image_cache = ImageCache()
+async_image_cache = AsyncFacade(image_cache, lxd_executor)
@@ -0,0 +1,227 @@
+"""容器清单缓存 - 批量加载 + LXD事件流增量失效"""
+import json
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+import pylxd
+from pylxd.client import EventType
+from ws4py.client import WebSocketBaseClient
+
+from config import settings
+
+# LXD操作的终态: Success / Failure / Cancelled
+_FINAL_OPERATION_CODES = (200, 400, 401)
+
+
+def instance_name_from_url(url: str) -> Optional[str]:
+    """从 /1.0/instances/<name>[/...] 或 /1.0/containers/<name> 中解析实例名"""
+    path = url.split('?', 1)[0]
+    parts = [p for p in path.split('/') if p]
+    if len(parts) >= 3 and parts[1] in ('instances', 'containers'):
+        return parts[2]
+    return None
+
+
+class _EventListener(WebSocketBaseClient):
+    """LXD /1.0/events 客户端, 将事件转交给清单缓存"""
+
+    def __init__(self, inventory, url, **kwargs):
+        super().__init__(url, **kwargs)
+        self.inventory = inventory
+
+    def received_message(self, message):
+        try:
+            event = json.loads(message.data)
+        except ValueError:
+            return
+        self.inventory.handle_event(event)
+
+
+class ContainerInventory:
+    """
+    进程内容器清单
+
+    首次访问时通过一次 recursion=2 请求加载全部容器(含state),
+    之后订阅LXD事件流, 只重新获取被事件标记为失效的条目。
+    事件流未连接时退化为每次访问都做一次批量加载。
+    """
+
+    def __init__(self, client: pylxd.Client, build_info: Callable[[Dict], Dict]):
+        self.client = client
+        self._build_info = build_info
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = set()
+        self._loaded_at = 0.0
+        self._needs_reload = True
+        self._listening = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._ws = None
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """启动事件订阅线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run_events, name="lxd-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止事件订阅线程"""
+        self._stop_event.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread:
+            self._thread.join(timeout=5)
+        self._listening = False
+
+    def _run_events(self):
+        """事件循环, 断线后自动重连并全量重载"""
+        while not self._stop_event.is_set():
+            try:
+                ws = self.client.events(
+                    websocket_client=partial(_EventListener, self),
+                    event_types={EventType.Lifecycle, EventType.Operation}
+                )
+                ws.connect()
+                self._ws = ws
+                # 先订阅再全量加载, 断线期间遗漏的事件由这次重载覆盖
+                with self._lock:
+                    self._needs_reload = True
+                self._listening = True
+                print("LXD事件订阅已建立")
+                ws.run()
+            except Exception as e:
+                print(f"LXD事件订阅错误: {str(e)}")
+            finally:
+                self._listening = False
+                self._ws = None
+            self._stop_event.wait(5)
+
+    # ---------- 事件处理 ----------
+
+    def handle_event(self, event: Dict):
+        """根据lifecycle/operation事件使相关条目失效"""
+        event_type = event.get('type')
+        metadata = event.get('metadata') or {}
+
+        if event_type == 'lifecycle':
+            action = metadata.get('action', '')
+            name = instance_name_from_url(metadata.get('source', ''))
+            if not name:
+                return
+            if action.endswith('-renamed'):
+                self.invalidate_all()
+            elif action in ('instance-deleted', 'container-deleted'):
+                self._remove(name)
+            else:
+                self.invalidate(name)
+
+        elif event_type == 'operation':
+            if metadata.get('status_code') not in _FINAL_OPERATION_CODES:
+                return
+            resources = metadata.get('resources') or {}
+            for key in ('instances', 'containers'):
+                for url in resources.get(key) or []:
+                    name = instance_name_from_url(url)
+                    if name:
+                        self.invalidate(name)
+
+    def invalidate(self, name: str):
+        """标记单个容器需要重新获取"""
+        with self._lock:
+            self._dirty.add(name)
+
+    def invalidate_all(self):
+        """标记需要全量重载"""
+        with self._lock:
+            self._needs_reload = True
+
+    def _remove(self, name: str):
+        with self._lock:
+            self._entries.pop(name, None)
+            self._dirty.discard(name)
+
+    # ---------- 读取 ----------
+
+    def all(self) -> List[Dict]:
+        """获取所有容器信息"""
+        self._refresh()
+        with self._lock:
+            return [dict(info) for info in self._entries.values()]
+
+    def get(self, name: str) -> Optional[Dict]:
+        """获取单个容器信息"""
+        self._refresh()
+        with self._lock:
+            info = self._entries.get(name)
+            return dict(info) if info else None
+
+    def _refresh(self):
+        """按需执行全量重载或增量刷新"""
+        with self._lock:
+            stale = time.monotonic() - self._loaded_at > settings.INVENTORY_MAX_AGE
+            reload_all = self._needs_reload or stale or not self._listening
+            if not reload_all:
+                # 运行中但尚未拿到IP的容器没有对应事件, 每次读取时重新获取
+                pending = {
+                    name for name, info in self._entries.items()
+                    if info['status'] == 'Running' and not info.get('ip_address')
+                }
+                dirty = self._dirty | pending
+                self._dirty = set()
+
+        if reload_all:
+            self._reload()
+            return
+
+        dirty = list(dirty)
+        for i, name in enumerate(dirty):
+            try:
+                data = self._fetch_one(name)
+            except Exception:
+                # 获取失败时把尚未刷新的容器放回待刷新集合, 下次读取时重试
+                with self._lock:
+                    self._dirty.update(dirty[i:])
+                raise
+            with self._lock:
+                if data is None:
+                    self._entries.pop(name, None)
+                else:
+                    self._entries[name] = self._build_info(data)
+
+    def _reload(self):
+        """通过一次recursion=2请求加载全部容器"""
+        with self._lock:
+            covered = set(self._dirty)
+        response = self.client.api.containers.get(params={'recursion': 2})
+        entries = {}
+        for data in response.json()['metadata']:
+            info = self._build_info(data)
+            entries[info['name']] = info
+        with self._lock:
+            self._entries = entries
+            # 加载期间新到达的失效事件保留到下次刷新
+            self._dirty -= covered
+            self._needs_reload = False
+            self._loaded_at = time.monotonic()
+
+    def _fetch_one(self, name: str) -> Optional[Dict]:
+        """重新获取单个容器(含state)"""
+        node = self.client.api.containers[name]
+        try:
+            data = node.get(params={'recursion': 1}).json()['metadata']
+            if 'state' not in data:
+                data['state'] = node.state.get().json()['metadata']
+            return data
+        except pylxd.exceptions.NotFound:
+            return None
@@ -0,0 +1,363 @@
+"""后台任务服务 - 持久化到SQLite的异步任务队列"""
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select, update
+
+from database.db import AsyncSessionLocal
+from database.models import Job
+from services.leader import LeaderLock
+from config import settings
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+SECRET_KEYS = ('password',)
+
+
+def split_secrets(value: Any) -> Tuple[Any, Any]:
+    """
+    拆出value中(任意层级)的密钥字段, 返回 (去除密钥后的值, 只含密钥的同结构值)
+    没有密钥字段时第二项为None
+    """
+    if isinstance(value, dict):
+        public, secret = {}, {}
+        for key, item in value.items():
+            if key in SECRET_KEYS:
+                secret[key] = item
+                continue
+            public[key], item_secret = split_secrets(item)
+            if item_secret is not None:
+                secret[key] = item_secret
+        return public, secret or None
+    if isinstance(value, list):
+        parts = [split_secrets(item) for item in value]
+        secrets = [secret for _, secret in parts]
+        return [public for public, _ in parts], secrets if any(x is not None for x in secrets) else None
+    return value, None
+
+
+def merge_secrets(value: Any, secret: Any) -> Any:
+    """split_secrets 的逆操作"""
+    if secret is None:
+        return value
+    if isinstance(secret, dict) and isinstance(value, dict):
+        merged = dict(value)
+        for key, item in secret.items():
+            merged[key] = merge_secrets(value[key], item) if key in value else item
+        return merged
+    if isinstance(secret, list) and isinstance(value, list):
+        return [merge_secrets(item, item_secret) for item, item_secret in zip(value, secret)]
+    return secret
+
+
+class JobContext:
+    """传给任务处理函数的上下文, 用于汇报阶段进度和保存断点"""
+
+    def __init__(self, service: "JobService", job_id: str, params: Dict, checkpoint: Dict):
+        self.service = service
+        self.job_id = job_id
+        self.params = params
+        self.checkpoint = checkpoint
+
+    def stage_done(self, stage: str) -> bool:
+        """该阶段在之前的运行中是否已经完成"""
+        return stage in self.checkpoint.get('stages', [])
+
+    async def update(self, stage: str, progress: int, message: str = ""):
+        """进入新阶段"""
+        await self.service._update(self.job_id, stage=stage, progress=progress, message=message)
+
+    async def complete_stage(self, stage: str, **data):
+        """标记阶段完成并保存断点数据"""
+        stages = self.checkpoint.setdefault('stages', [])
+        if stage not in stages:
+            stages.append(stage)
+        self.checkpoint.update(data)
+        await self.save()
+
+    async def save(self):
+        """保存当前断点"""
+        await self.service._update(self.job_id, checkpoint=json.dumps(self.checkpoint))
+
+
+JobHandler = Callable[[JobContext], Awaitable[Dict]]
+
+
+class JobService:
+    """
+    多个API进程共用同一个任务表, 但只有持有任务锁的进程执行任务:
+    其他进程提交的任务只写入数据库, 由执行进程每隔 JOB_POLL_INTERVAL 拾取。
+
+    密码等密钥字段(SECRET_KEYS)只在任务未结束时保留在参数和断点中(续跑需要);
+    任务结束时从参数和断点中删除, 结果中的密钥单独存放, 只返回给提交者一次。
+    已结束的任务保留 JOB_RETENTION_DAYS 天。
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._queued: Set[str] = set()  # 已入队或执行中的任务, 避免重复拾取
+        self._leader_task: Optional[asyncio.Task] = None
+        self.lock = LeaderLock(settings.JOB_LOCK_FILE)
+
+    @property
+    def is_runner(self) -> bool:
+        """本进程是否负责执行任务"""
+        return self.lock.held
+
+    def register(self, kind: str, handler: JobHandler):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = handler
+
+    async def start(self):
+        """竞争任务锁; 获得锁的进程启动worker, 恢复未完成的任务并拾取新任务"""
+        if self._leader_task:
+            return
+        self._queue = asyncio.Queue()
+        self._leader_task = asyncio.create_task(self._leader_loop())
+
+    async def _leader_loop(self):
+        while not self.lock.try_acquire():
+            await asyncio.sleep(settings.LEADER_RETRY_INTERVAL)
+
+        # 只有持锁进程执行任务, 因此 running 状态的任务都是上一个执行进程遗留的
+        async with AsyncSessionLocal() as session:
+            stmt = select(Job).where(Job.status.in_(('pending', 'running'))).order_by(Job.created_at.asc())
+            result = await session.execute(stmt)
+            unfinished = result.scalars().all()
+            for job in unfinished:
+                job.status = 'pending'
+                self._enqueue(job.id)
+            await session.commit()
+        if unfinished:
+            print(f"恢复 {len(unfinished)} 个未完成任务")
+
+        for i in range(settings.JOB_WORKERS):
+            self._workers.append(asyncio.create_task(self._worker(i)))
+        print(f"任务服务已启动 ({settings.JOB_WORKERS} 个worker)")
+
+        last_cleanup = 0.0
+        while True:
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+            try:
+                await self._poll_pending()
+            except Exception as e:
+                print(f"拾取待执行任务错误: {str(e)}")
+            if time.monotonic() - last_cleanup >= settings.JOB_CLEANUP_INTERVAL:
+                last_cleanup = time.monotonic()
+                try:
+                    await self.cleanup()
+                except Exception as e:
+                    print(f"清理过期任务错误: {str(e)}")
+
+    async def _poll_pending(self):
+        """拾取其他进程提交的任务"""
+        async with AsyncSessionLocal() as session:
+            stmt = select(Job.id).where(Job.status == 'pending').order_by(Job.created_at.asc())
+            result = await session.execute(stmt)
+            for job_id in result.scalars().all():
+                self._enqueue(job_id)
+
+    async def cleanup(self) -> int:
+        """删除超过保留期的已结束任务, 清除无人读取的过期密码; 返回删除的任务数"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(Job)
+                .where(Job.secrets.is_not(None), Job.updated_at < now - timedelta(seconds=settings.JOB_SECRET_TTL))
+                .values(secrets=None)
+            )
+            result = await session.execute(
+                delete(Job).where(
+                    Job.status.in_(TERMINAL_STATUSES),
+                    Job.updated_at < now - timedelta(days=settings.JOB_RETENTION_DAYS)
+                )
+            )
+            await session.commit()
+        if result.rowcount:
+            print(f"已删除 {result.rowcount} 个过期任务")
+        return result.rowcount
+
+    def _enqueue(self, job_id: str):
+        if job_id not in self._queued:
+            self._queued.add(job_id)
+            self._queue.put_nowait(job_id)
+
+    async def stop(self):
+        """停止worker, 运行中的任务在下次启动时续跑"""
+        tasks = self._workers + ([self._leader_task] if self._leader_task else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._leader_task = None
+        self.lock.release()
+        print("任务服务已停止")
+
+    async def submit(self, kind: str, params: Dict, owner: Optional[str] = None) -> Dict:
+        """创建任务并入队, 立即返回任务信息; owner为提交者, 只有提交者能读取结果中的密钥字段"""
+        if kind not in self._handlers:
+            raise ValueError(f"未知任务类型: {kind}")
+        now = datetime.utcnow()
+        job = Job(
+            id=uuid.uuid4().hex,
+            kind=kind,
+            status='pending',
+            progress=0,
+            message='等待执行',
+            params=json.dumps(params),
+            checkpoint=json.dumps({}),
+            owner=owner,
+            created_at=now,
+            updated_at=now
+        )
+        async with AsyncSessionLocal() as session:
+            session.add(job)
+            await session.commit()
+        if self.is_runner:
+            self._enqueue(job.id)
+        return self._to_dict(job)
+
+    async def get(self, job_id: str, reveal_to: Optional[str] = None) -> Optional[Dict]:
+        """
+        获取任务状态
+        reveal_to 为任务提交者时, 结果中附带密钥字段并将其从数据库清除 (只能读取一次)
+        """
+        async with AsyncSessionLocal() as session:
+            job = await session.get(Job, job_id)
+            if not job:
+                return None
+            data = self._to_dict(job)
+            if reveal_to is None or not job.secrets or job.owner != reveal_to:
+                return data
+            secrets = json.loads(job.secrets)
+            # 以UPDATE影响的行数判断, 并发读取时只有一个请求拿到密钥
+            result = await session.execute(
+                update(Job).where(Job.id == job_id, Job.secrets.is_not(None)).values(secrets=None)
+            )
+            await session.commit()
+            if result.rowcount == 1:
+                data['result'] = merge_secrets(data['result'], secrets)
+            return data
+
+    async def list(self, limit: int = 50) -> List[Dict]:
+        """最近的任务"""
+        async with AsyncSessionLocal() as session:
+            stmt = select(Job).order_by(Job.created_at.desc()).limit(limit)
+            result = await session.execute(stmt)
+            return [self._to_dict(job) for job in result.scalars().all()]
+
+    # ---------- 进度订阅 ----------
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """订阅任务进度事件"""
+        queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(job_id)
+        if subscribers:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def _publish(self, job: Dict):
+        for queue in self._subscribers.get(job['id'], ()):
+            if queue.full():
+                # 慢消费者丢弃最旧的进度
+                queue.get_nowait()
+            queue.put_nowait(job)
+
+    # ---------- 执行 ----------
+
+    async def _worker(self, index: int):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"任务 {job_id} 执行异常: {str(e)}")
+            finally:
+                self._queued.discard(job_id)
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        async with AsyncSessionLocal() as session:
+            job = await session.get(Job, job_id)
+            if not job or job.status in TERMINAL_STATUSES:
+                return
+            kind = job.kind
+            params = json.loads(job.params or '{}')
+            checkpoint = json.loads(job.checkpoint or '{}')
+
+        handler = self._handlers.get(kind)
+        if handler is None:
+            await self._update(job_id, status='failed', error=f"未知任务类型: {kind}")
+            return
+
+        await self._update(job_id, status='running')
+        context = JobContext(self, job_id, params, checkpoint)
+        try:
+            result = await handler(context)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._update(
+                job_id, status='failed', message='任务失败', error=str(e), **self._scrubbed(context)
+            )
+            return
+        result, secrets = split_secrets(result)
+        await self._update(
+            job_id, status='succeeded', progress=100, message='任务完成', result=json.dumps(result),
+            secrets=json.dumps(secrets) if secrets is not None else None, **self._scrubbed(context)
+        )
+
+    @staticmethod
+    def _scrubbed(context: JobContext) -> Dict[str, str]:
+        """任务结束后不再需要续跑, 从参数和断点中删除密钥字段"""
+        return {
+            'params': json.dumps(split_secrets(context.params)[0]),
+            'checkpoint': json.dumps(split_secrets(context.checkpoint)[0])
+        }
+
+    async def _update(self, job_id: str, **fields):
+        """更新任务记录并推送给订阅者"""
+        async with AsyncSessionLocal() as session:
+            job = await session.get(Job, job_id)
+            if not job:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            job.updated_at = datetime.utcnow()
+            await session.commit()
+            data = self._to_dict(job)
+        self._publish(data)
+
+    @staticmethod
+    def _to_dict(job: Job) -> Dict:
+        return {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'stage': job.stage,
+            'progress': job.progress or 0,
+            'message': job.message,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'updated_at': job.updated_at.isoformat() if job.updated_at else None
+        }
+
+
+# 全局任务服务实例
+job_service = JobService()
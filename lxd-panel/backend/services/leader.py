@@ -0,0 +1,68 @@
+"""基于文件锁的单实例选举"""
+import fcntl
+import os
+from typing import Optional
+
+
+class LeaderLock:
+    """
+    用 flock 保证同一时间只有一个进程持有角色(如监控采集)
+
+    锁随文件描述符存在, 持有者进程退出(包括崩溃)时由内核自动释放,
+    其他进程的下一次 try_acquire 即可接替。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试获取锁, 成功后把本进程pid写入锁文件"""
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def acquire(self):
+        """阻塞直到获得锁, 用于启动阶段的短暂互斥(如建表)"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._fd = fd
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        if self._fd is None:
+            return
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def holder(self) -> Optional[int]:
+        """当前持有者的pid (仅供展示, 锁未被持有时可能是过期值)"""
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
@@ -0,0 +1,199 @@
+"""实时监控数据 - 最新样本缓存与WebSocket广播"""
+import asyncio
+import json
+from typing import Dict, Iterable, List, Optional, Set
+
+from config import settings
+
+
+def diff_payload(previous: Dict, current: Dict) -> Dict:
+    """返回current中相对previous发生变化的字段, 嵌套字典只保留变化的子字段"""
+    changed = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            nested = diff_payload(old, value)
+            if nested:
+                changed[key] = nested
+        elif key not in previous or old != value:
+            changed[key] = value
+    return changed
+
+
+class Stream:
+    """多容器订阅: names 为 None 时订阅全部容器"""
+
+    def __init__(self, names: Optional[Set[str]] = None):
+        self.names = names
+        self.watching: Set[str] = set()  # 客户端正在查看详情的容器, 采集器会提高其采样频率
+        self.queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+
+    def wants(self, container_name: str) -> bool:
+        return self.names is None or container_name in self.names
+
+
+class LiveStatsHub:
+    """
+    保存每个容器最新一条样本, 并把新样本广播给订阅者
+
+    样本在发布时序列化一次, 所有订阅者收到同一个字符串;
+    每个订阅者使用有界队列, 消费过慢时丢弃最旧的帧, 只保留最新的数据。
+
+    多容器订阅(Stream)每轮采集只收到一帧, 其中只包含所订阅容器变化的字段;
+    订阅集合相同的Stream共用同一个序列化结果。Stream丢帧后增量无法再拼接,
+    此时清空其队列并补发一帧完整快照。
+    """
+
+    def __init__(self):
+        self._latest: Dict[str, Dict] = {}
+        self._messages: Dict[str, str] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._streams: Set[Stream] = set()
+        self.cycle = 0
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, container_name: str, payload: Dict):
+        """发布容器的一条新样本"""
+        message = json.dumps(payload)
+        self._latest[container_name] = payload
+        self._messages[container_name] = message
+        self.published += 1
+        for queue in self._subscribers.get(container_name, ()):
+            self._offer(queue, message)
+
+    def publish_cycle(self, payloads: Dict[str, Dict], active: Optional[Iterable[str]] = None):
+        """
+        发布一轮采集的全部样本, 并向多容器订阅推送合并后的增量帧
+        active 为本轮仍在运行的容器, 不在其中的容器会被移除并在增量帧中列出
+        """
+        deltas = {}
+        for name, payload in payloads.items():
+            previous = self._latest.get(name)
+            deltas[name] = diff_payload(previous, payload) if previous else payload
+            self.publish(name, payload)
+
+        removed = []
+        if active is not None:
+            active = set(active)
+            removed = [name for name in self._latest if name not in active]
+            for name in removed:
+                self.forget(name)
+
+        self.cycle += 1
+        messages: Dict[Optional[frozenset], Optional[str]] = {}
+        for stream in list(self._streams):
+            key = None if stream.names is None else frozenset(stream.names)
+            if key not in messages:
+                messages[key] = self._delta_message(stream, deltas, removed)
+            if messages[key] is not None:
+                self._offer_stream(stream, messages[key])
+
+    def _delta_message(self, stream: Stream, deltas: Dict, removed: List[str]) -> Optional[str]:
+        containers = {name: delta for name, delta in deltas.items() if stream.wants(name)}
+        gone = [name for name in removed if stream.wants(name)]
+        if not containers and not gone:
+            return None
+        return json.dumps({
+            'type': 'delta',
+            'cycle': self.cycle,
+            'containers': containers,
+            'removed': gone
+        })
+
+    def snapshot_message(self, stream: Stream) -> str:
+        """Stream所订阅容器的完整当前数据"""
+        return json.dumps({
+            'type': 'snapshot',
+            'cycle': self.cycle,
+            'containers': {
+                name: payload for name, payload in self._latest.items() if stream.wants(name)
+            }
+        })
+
+    def _offer(self, queue: asyncio.Queue, message: str):
+        if queue.full():
+            # 丢弃最旧的帧, 慢客户端只需要最新数据
+            queue.get_nowait()
+            self.dropped += 1
+        queue.put_nowait(message)
+
+    def _offer_stream(self, stream: Stream, message: str):
+        if stream.queue.full():
+            self.dropped += stream.queue.qsize()
+            self._resync(stream)
+        else:
+            stream.queue.put_nowait(message)
+
+    def _resync(self, stream: Stream):
+        """清空队列并放入完整快照"""
+        while not stream.queue.empty():
+            stream.queue.get_nowait()
+        stream.queue.put_nowait(self.snapshot_message(stream))
+
+    def latest(self, container_name: str) -> Optional[Dict]:
+        return self._latest.get(container_name)
+
+    def containers(self) -> List[str]:
+        return list(self._latest)
+
+    def subscribe(self, container_name: str) -> asyncio.Queue:
+        """订阅容器的新样本, 已有最新样本时立即放入队列"""
+        queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+        self._subscribers.setdefault(container_name, set()).add(queue)
+        if container_name in self._messages:
+            queue.put_nowait(self._messages[container_name])
+        return queue
+
+    def unsubscribe(self, container_name: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(container_name)
+        if subscribers:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[container_name]
+
+    def open_stream(self, names: Optional[Set[str]] = None) -> Stream:
+        """创建多容器订阅, 首帧为完整快照"""
+        stream = Stream(names)
+        self._streams.add(stream)
+        self._resync(stream)
+        return stream
+
+    def update_stream(self, stream: Stream, names: Optional[Set[str]]):
+        """修改订阅的容器集合, 并补发新集合的快照"""
+        stream.names = names
+        self._resync(stream)
+
+    def close_stream(self, stream: Stream):
+        self._streams.discard(stream)
+
+    def watch(self, stream: Stream, names: Set[str]):
+        """设置Stream正在查看的容器"""
+        stream.watching = names
+
+    def watched(self) -> Set[str]:
+        """本进程中有人查看的容器: 单容器订阅者以及各Stream的查看集合"""
+        names = set(self._subscribers)
+        for stream in self._streams:
+            names |= stream.watching
+        return names
+
+    def forget(self, container_name: str):
+        """容器已停止或删除时移除其最新样本"""
+        self._latest.pop(container_name, None)
+        self._messages.pop(container_name, None)
+
+    def stats(self) -> Dict:
+        return {
+            'containers': len(self._latest),
+            'subscribers': sum(len(s) for s in self._subscribers.values()),
+            'streams': len(self._streams),
+            'watched': len(self.watched()),
+            'cycle': self.cycle,
+            'published': self.published,
+            'dropped': self.dropped
+        }
+
+
+# 全局实时数据中心
+live_stats = LiveStatsHub()
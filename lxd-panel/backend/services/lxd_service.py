@@ -4,6 +4,12 @@ from typing import List, Dict, Optional
 import subprocess
 import re
 
+from config import settings
+from services.inventory_cache import ContainerInventory
+from services.executor import AsyncFacade, lxd_executor
+from services.port_allocator import ports_from_config
+from services.port_forward import port_forwards
+
 class LXDService:
     def __init__(self):
         """初始化LXD客户端"""
@@ -11,62 +17,59 @@ class LXDService:
             self.client = pylxd.Client()
         except Exception as e:
             raise Exception(f"无法连接到LXD: {str(e)}")
+        self.inventory = ContainerInventory(self.client, self._get_container_info)
     
     def get_all_containers(self) -> List[Dict]:
         """获取所有容器列表"""
-        containers = []
-        for container in self.client.containers.all():
-            info = self._get_container_info(container)
-            containers.append(info)
-        return containers
+        if settings.INVENTORY_CACHE_ENABLED:
+            return self.inventory.all()
+        response = self.client.api.containers.get(params={'recursion': 2})
+        return [self._get_container_info(data) for data in response.json()['metadata']]
     
     def get_container(self, name: str) -> Optional[Dict]:
         """获取单个容器信息"""
-        try:
-            container = self.client.containers.get(name)
-            return self._get_container_info(container)
-        except pylxd.exceptions.NotFound:
-            return None
+        if settings.INVENTORY_CACHE_ENABLED:
+            return self.inventory.get(name)
+        return next((c for c in self.get_all_containers() if c['name'] == name), None)
     
-    def _get_container_info(self, container) -> Dict:
-        """提取容器信息"""
-        # 从description中解析信息
-        desc = container.config.get('user.description', '')
-        parts = desc.split()
+    def _get_container_info(self, data: Dict) -> Dict:
+        """从LXD API返回的实例数据(含state)中提取容器信息"""
+        config = data.get('config') or {}
+        state = data.get('state') or {}
         
-        ssh_port = parts[1] if len(parts) > 1 else None
+        # 端口取自 user.panel.* 配置键, 旧容器从description中解析
+        ports = ports_from_config(config)
+        parts = config.get('user.description', '').split()
         password = parts[2] if len(parts) > 2 else None
-        nat_start = int(parts[3]) if len(parts) > 3 and parts[3] != '0' else None
-        nat_end = int(parts[4]) if len(parts) > 4 and parts[4] != '0' else None
         
         # 获取IP地址
         ip_address = None
-        if container.state().network:
-            eth0 = container.state().network.get('eth0', {})
+        if state.get('network'):
+            eth0 = state['network'].get('eth0', {})
             for addr in eth0.get('addresses', []):
                 if addr['family'] == 'inet':
                     ip_address = addr['address']
                     break
         
         # 获取资源配置
-        cpu_limit = container.config.get('limits.cpu', '1')
-        memory_limit = container.config.get('limits.memory', '512MiB')
+        cpu_limit = config.get('limits.cpu', '1')
+        memory_limit = config.get('limits.memory', '512MiB')
         
         # 解析内存值
         memory_mb = self._parse_memory(memory_limit)
         
         return {
-            'name': container.name,
-            'status': container.status,
+            'name': data['name'],
+            'status': data['status'],
             'ip_address': ip_address,
             'cpu': cpu_limit,
             'memory': memory_mb,
-            'ssh_port': ssh_port,
+            'ssh_port': ports['ssh_port'],
             'password': password,
-            'nat_start': nat_start,
-            'nat_end': nat_end,
-            'architecture': container.architecture,
-            'created_at': container.created_at
+            'nat_start': ports['nat_start'],
+            'nat_end': ports['nat_end'],
+            'architecture': data.get('architecture'),
+            'created_at': data.get('created_at')
         }
     
     def _parse_memory(self, memory_str: str) -> int:
@@ -83,6 +86,7 @@ class LXDService:
             container = self.client.containers.get(name)
             if container.status != 'Running':
                 container.start(wait=True)
+            self.inventory.invalidate(name)
             return True
         except Exception as e:
             raise Exception(f"启动容器失败: {str(e)}")
@@ -93,6 +97,7 @@ class LXDService:
             container = self.client.containers.get(name)
             if container.status == 'Running':
                 container.stop(wait=True)
+            self.inventory.invalidate(name)
             return True
         except Exception as e:
             raise Exception(f"停止容器失败: {str(e)}")
@@ -102,6 +107,7 @@ class LXDService:
         try:
             container = self.client.containers.get(name)
             container.restart(wait=True)
+            self.inventory.invalidate(name)
             return True
         except Exception as e:
             raise Exception(f"重启容器失败: {str(e)}")
@@ -113,9 +119,78 @@ class LXDService:
             if container.status == 'Running':
                 container.stop(wait=True)
             container.delete(wait=True)
-            return True
+            self.inventory.invalidate(name)
         except Exception as e:
             raise Exception(f"删除容器失败: {str(e)}")
+        try:
+            port_forwards.remove(name)
+        except Exception as e:
+            print(f"删除容器 {name} 的端口转发失败: {str(e)}")
+        return True
+    
+    # ---------- 不等待完成的操作 (批量操作使用) ----------
+    
+    def submit_state_change(self, name: str, action: str, force: bool = False, timeout: int = -1) -> str:
+        """提交 start/stop/restart 后立即返回LXD操作ID, 不等待操作完成"""
+        response = self.client.api.containers[name].state.put(
+            json={'action': action, 'timeout': timeout, 'force': force}
+        )
+        self.inventory.invalidate(name)
+        return self._operation_id(response)
+    
+    def submit_delete(self, name: str) -> str:
+        """提交删除后立即返回LXD操作ID (容器须已停止)"""
+        response = self.client.api.containers[name].delete()
+        self.inventory.invalidate(name)
+        return self._operation_id(response)
+    
+    @staticmethod
+    def _operation_id(response) -> str:
+        # 返回形如 /1.0/operations/<uuid>
+        return response.json()['operation'].rsplit('/', 1)[-1]
+    
+    def list_operations(self) -> Dict[str, Dict]:
+        """LXD上的全部操作(含刚结束、尚未清除的): 操作ID -> {status, err}"""
+        response = self.client.api.operations.get(params={'recursion': 1})
+        operations = {}
+        for group in (response.json()['metadata'] or {}).values():
+            for op in group or []:
+                operations[op['id']] = {'status': op['status'], 'err': op.get('err') or ''}
+        return operations
+    
+    def get_operation(self, operation_id: str) -> Optional[Dict]:
+        """单个操作的状态, 已被LXD清除时返回None"""
+        try:
+            op = self.client.api.operations[operation_id].get().json()['metadata']
+        except pylxd.exceptions.NotFound:
+            return None
+        return {'status': op['status'], 'err': op.get('err') or ''}
+    
+    def instance_status(self, name: str) -> Optional[str]:
+        """直接查询LXD中容器的当前状态(不经过清单缓存), 不存在时返回None"""
+        try:
+            return self.client.api.containers[name].get().json()['metadata']['status']
+        except pylxd.exceptions.NotFound:
+            return None
+    
+    def exec_interactive(self, name: str, command: List[str], environment: Dict[str, str], width: int, height: int) -> Dict:
+        """
+        启动交互式命令(分配pty), 返回操作ID和各websocket的secret;
+        进程在 fds 中的 "0"(数据) 和 "control" 都连接后才开始运行
+        """
+        response = self.client.api.containers[name].exec.post(json={
+            'command': command,
+            'environment': environment,
+            'wait-for-websocket': True,
+            'interactive': True,
+            'width': width,
+            'height': height
+        })
+        data = response.json()
+        return {
+            'operation': self._operation_id(response),
+            'fds': data['metadata']['metadata']['fds']
+        }
     
     def create_container(self, config: Dict) -> Dict:
         """
@@ -149,6 +224,7 @@ class LXDService:
             if result.returncode != 0:
                 raise Exception(f"重装失败: {result.stderr}")
             
+            self.inventory.invalidate(name)
             return True
         except Exception as e:
             raise Exception(f"重装容器失败: {str(e)}")
@@ -156,43 +232,73 @@ class LXDService:
     def get_container_stats(self, name: str) -> Optional[Dict]:
         """获取容器实时统计信息"""
         try:
-            container = self.client.containers.get(name)
-            if container.status != 'Running':
+            node = self.client.api.containers[name]
+            state = node.state.get().json()['metadata']
+            if state.get('status') != 'Running':
                 return None
-            
-            state = container.state()
-            
-            # CPU使用率
-            cpu_usage = 0
-            if hasattr(state, 'cpu') and state.cpu:
-                cpu_usage = state.cpu.usage / 1000000000  # 转换为秒
-            
-            # 内存使用
-            memory_usage = 0
-            memory_total = 0
-            if hasattr(state, 'memory') and state.memory:
-                memory_usage = state.memory.usage / (1024 * 1024)  # 转换为MB
-                memory_total = state.memory.usage_peak / (1024 * 1024) if hasattr(state.memory, 'usage_peak') else memory_usage
-            
-            # 网络统计
-            network_rx = 0
-            network_tx = 0
-            if state.network:
-                eth0 = state.network.get('eth0', {})
-                if 'counters' in eth0:
-                    network_rx = eth0['counters'].get('bytes_received', 0)
-                    network_tx = eth0['counters'].get('bytes_sent', 0)
-            
-            return {
-                'cpu_usage': cpu_usage,
-                'memory_usage': memory_usage,
-                'memory_total': memory_total,
-                'network_rx': network_rx,
-                'network_tx': network_tx
-            }
+            return self._parse_stats(state)
         except Exception as e:
             print(f"获取容器统计失败: {str(e)}")
             return None
+    
+    def get_all_container_stats(self) -> Dict[str, Dict]:
+        """通过一次recursion=2请求获取所有运行中容器的统计信息"""
+        response = self.client.api.containers.get(params={'recursion': 2})
+        all_stats = {}
+        for data in response.json()['metadata']:
+            if data['status'] != 'Running':
+                continue
+            stats = self._parse_stats(data.get('state') or {})
+            root = (data.get('expanded_devices') or {}).get('root') or {}
+            stats['pool'] = root.get('pool')
+            all_stats[data['name']] = stats
+        return all_stats
+    
+    def get_volume_usage(self, name: str, pool: str) -> Dict:
+        """通过存储卷state API获取容器根卷用量(字节)"""
+        node = self.client.api.storage_pools[pool].volumes.container[name]
+        usage = node.state.get().json()['metadata'].get('usage') or {}
+        return {'used': usage.get('used', 0), 'total': usage.get('total', 0)}
+    
+    def _parse_stats(self, state: Dict) -> Dict:
+        """从实例state中提取统计信息"""
+        # CPU使用率
+        cpu_usage = 0
+        if state.get('cpu'):
+            cpu_usage = state['cpu'].get('usage', 0) / 1000000000  # 转换为秒
+        
+        # 内存使用
+        memory_usage = 0
+        memory_total = 0
+        if state.get('memory'):
+            memory = state['memory']
+            memory_usage = memory.get('usage', 0) / (1024 * 1024)  # 转换为MB
+            memory_total = memory['usage_peak'] / (1024 * 1024) if 'usage_peak' in memory else memory_usage
+        
+        # 网络统计
+        network_rx = 0
+        network_tx = 0
+        if state.get('network'):
+            eth0 = state['network'].get('eth0', {})
+            if 'counters' in eth0:
+                network_rx = eth0['counters'].get('bytes_received', 0)
+                network_tx = eth0['counters'].get('bytes_sent', 0)
+        
+        # 根磁盘用量(字节), 取决于存储驱动是否支持
+        root_disk = (state.get('disk') or {}).get('root') or {}
+        
+        return {
+            'cpu_usage': cpu_usage,
+            'memory_usage': memory_usage,
+            'memory_total': memory_total,
+            'network_rx': network_rx,
+            'network_tx': network_tx,
+            'disk_used': root_disk.get('usage', 0),
+            'disk_total': root_disk.get('total', 0)
+        }
 
 # 全局LXD服务实例
 lxd_service = LXDService()
+
+# 异步门面: 所有方法在lxd线程池中执行, 供async路由和后台任务使用
+async_lxd_service = AsyncFacade(lxd_service, lxd_executor)
@@ -0,0 +1,16 @@
+"""LXD的unix socket路径, 供绕过pylxd直接发起HTTP/WebSocket请求的模块使用"""
+import os
+
+from config import settings
+
+LXD_SOCKET_PATHS = ('/var/snap/lxd/common/lxd/unix.socket', '/var/lib/lxd/unix.socket')
+
+
+def lxd_socket_path() -> str:
+    """LXD_UNIX_SOCKET 为空时自动检测 (snap或deb安装)"""
+    if settings.LXD_UNIX_SOCKET:
+        return settings.LXD_UNIX_SOCKET
+    for path in LXD_SOCKET_PATHS:
+        if os.path.exists(path):
+            return path
+    return LXD_SOCKET_PATHS[-1]
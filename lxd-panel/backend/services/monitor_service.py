@@ -1,32 +1,162 @@
 """监控数据收集服务"""
 import asyncio
+import heapq
+import os
+import time
+from collections import Counter, deque
 from datetime import datetime, timedelta
-from typing import Dict, Optional
-from sqlalchemy import select, delete
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional
 import psutil
 
 from database.db import AsyncSessionLocal
-from database.models import MonitoringData
-from services.lxd_service import lxd_service
+from database.models import ROLLUP_TIERS
+from database.monitoring_store import floor_time, monitoring_store
+from services.lxd_service import async_lxd_service
+from services.downsample import downsample_rows
+from services.leader import LeaderLock
+from services.live_stats import live_stats
+from services.probes import create_probe
+from services.sample_writer import SampleWriter
 from config import settings
 
+# 历史数据接口返回的字段
+HISTORY_COLUMNS = [
+    'timestamp', 'cpu_usage', 'load_average', 'memory_percent',
+    'network_rx_rate', 'network_tx_rate', 'disk_percent'
+]
+
+def history_metrics(tier: str) -> List[str]:
+    """历史接口在该层返回的指标字段, 汇总层额外包含 min/max"""
+    metrics = HISTORY_COLUMNS[1:]
+    if tier == 'raw':
+        return metrics
+    return [f'{metric}{suffix}' for metric in metrics for suffix in ('', '_min', '_max')]
+
+# 调度循环的最小睡眠时间, 相差不超过该值的到期时间合并为一批
+SCHEDULE_SLACK = 0.1
+
+def activity_intervals() -> Dict[str, float]:
+    """各活跃程度对应的采样间隔(秒)"""
+    return {
+        'watched': settings.MONITOR_WATCH_INTERVAL,
+        'busy': settings.MONITOR_BUSY_INTERVAL,
+        'normal': settings.MONITOR_INTERVAL,
+        'idle': settings.MONITOR_IDLE_INTERVAL
+    }
+
+def tier_retention_hours() -> Dict[str, int]:
+    """各存储层的保留时长(小时), 按精度从高到低排列"""
+    return {
+        'raw': settings.DATA_RETENTION_HOURS,
+        '5m': settings.ROLLUP_5M_RETENTION_DAYS * 24,
+        '1h': settings.ROLLUP_1H_RETENTION_DAYS * 24
+    }
+
+def select_tier(hours: int) -> Optional[str]:
+    """选择能覆盖所请求时长的最高精度层, 超出所有层的保留期时返回None"""
+    for tier, retention in tier_retention_hours().items():
+        if hours <= retention:
+            return tier
+    return None
+
+def format_current_stats(data: Dict) -> Dict:
+    """将一条样本整理为当前状态接口的结构"""
+    return {
+        'timestamp': data['timestamp'].isoformat(),
+        'cpu_usage': data['cpu_usage'],
+        'load_average': data['load_average'],
+        'memory': {
+            'usage': data['memory_usage'],
+            'total': data['memory_total'],
+            'percent': data['memory_percent']
+        },
+        'network': {
+            'rx_bytes': data['network_rx_bytes'],
+            'tx_bytes': data['network_tx_bytes'],
+            'rx_rate': data['network_rx_rate'],
+            'tx_rate': data['network_tx_rate']
+        },
+        'disk': {
+            'usage': data['disk_usage'],
+            'total': data['disk_total'],
+            'percent': data['disk_percent']
+        },
+        'pressure': {
+            'cpu': data['cpu_pressure'],
+            'memory': data['memory_pressure'],
+            'io': data['io_pressure']
+        },
+        'io': {
+            'read_bytes': data['io_read_bytes'],
+            'write_bytes': data['io_write_bytes']
+        }
+    }
+
 class MonitorService:
     def __init__(self):
         self.running = False
         self.task: Optional[asyncio.Task] = None
-        self._previous_stats = {}  # 存储上一次的网络统计
+        self._previous_stats = {}  # 每个容器上一次的累计计数器及其读取时刻
+        self.last_cycle: Optional[Dict] = None  # 最近一轮采集的耗时与跳过情况
+        self.cycle_history = deque(maxlen=60)
+        self.probe = create_probe(async_lxd_service.get_volume_usage)
+        self.writer = SampleWriter()
+        self._last_cleanup = 0.0
+        self._rollup_marks: Dict[str, datetime] = {}  # 各汇总层已完成到的时间点
+        self.lock = LeaderLock(settings.COLLECTOR_LOCK_FILE)
+        self._follow_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._active: Optional[set] = None  # 最近一次刷新时运行中的容器
+        self._live_since: Optional[datetime] = None  # 已从数据库同步到的最新样本时间
+        self._schedule: List[tuple] = []  # (下次采样的单调时钟, 容器名) 小顶堆
+        self._next_due: Dict[str, float] = {}  # 各容器当前有效的下次采样时间, 堆中其余条目已过期
+        self._activity: Dict[str, str] = {}  # 各容器的活跃程度, 决定采样间隔
+        self._watched: set = set()  # 有人查看详情的容器
+        self._pools: Dict[str, str] = {}  # 容器根卷所在存储池, 单独查询state时补充
     
     async def start(self):
-        """启动监控服务"""
+        """启动监控服务 (调用方需保证只有一个进程采集, 见 elect)"""
         if self.running:
             return
         self.running = True
+        async with AsyncSessionLocal() as session:
+            await monitoring_store.migrate_legacy(session)
+            await monitoring_store.upgrade_partitions(session)
+            await session.commit()
         self.task = asyncio.create_task(self._monitor_loop())
         print("监控服务已启动")
     
+    def elect(self, sync_live: bool = True):
+        """
+        竞争采集锁: 获得锁后开始采集, 否则每隔 LEADER_RETRY_INTERVAL 重试,
+        持锁进程退出后自动接替; 等待期间从数据库同步实时数据 (sync_live)
+        """
+        if self._follow_task is None:
+            self._follow_task = asyncio.create_task(self._follow_loop(True, sync_live))
+        if sync_live:
+            self._start_watch_heartbeat()
+    
+    def follow(self):
+        """不参与采集, 只从数据库同步其他进程采集的实时数据"""
+        if self._follow_task is None:
+            self._follow_task = asyncio.create_task(self._follow_loop(False, True))
+        self._start_watch_heartbeat()
+    
+    def _start_watch_heartbeat(self):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_heartbeat_loop())
+    
     async def stop(self):
         """停止监控服务"""
+        for task in (self._follow_task, self._watch_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._follow_task = None
+        self._watch_task = None
         self.running = False
         if self.task:
             self.task.cancel()
@@ -34,197 +164,477 @@ class MonitorService:
                 await self.task
             except asyncio.CancelledError:
                 pass
+        self.lock.release()
         print("监控服务已停止")
     
+    async def _follow_loop(self, collect: bool, sync_live: bool):
+        loop = asyncio.get_running_loop()
+        next_attempt = loop.time()
+        if collect and not self.lock.try_acquire():
+            print(f"监控采集锁由进程 {self.lock.holder()} 持有, 本进程等待接替")
+        while True:
+            if collect and loop.time() >= next_attempt:
+                next_attempt = loop.time() + settings.LEADER_RETRY_INTERVAL
+                if self.lock.try_acquire():
+                    print(f"进程 {os.getpid()} 获得监控采集锁")
+                    await self.start()
+                    return
+            if sync_live:
+                await self._sync_live()
+                await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            else:
+                await asyncio.sleep(max(next_attempt - loop.time(), 0.1))
+    
+    async def _sync_live(self):
+        """从最新样本表同步采集进程写入的新数据到本进程的实时数据中心"""
+        try:
+            async with AsyncSessionLocal() as session:
+                rows = await monitoring_store.latest_since(session, self._live_since)
+                names = await monitoring_store.latest_names(session)
+            removed = set(live_stats.containers()) - set(names)
+            if not rows and not removed:
+                return
+            live_stats.publish_cycle(
+                {row['container_name']: format_current_stats(row) for row in rows},
+                active=names
+            )
+            if rows:
+                self._live_since = max(row['timestamp'] for row in rows)
+        except Exception as e:
+            print(f"同步实时监控数据错误: {str(e)}")
+    
+    async def _watch_heartbeat_loop(self):
+        """
+        把本进程WebSocket客户端正在查看的容器写入数据库并定期续期,
+        采集进程(可能是其他进程)据此提高这些容器的采样频率
+        """
+        loop = asyncio.get_running_loop()
+        last = set()
+        renewed = 0.0
+        while True:
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+            watched = live_stats.watched()
+            now = loop.time()
+            if not watched or (watched == last and now - renewed < settings.MONITOR_WATCH_TTL / 3):
+                last = watched
+                continue
+            try:
+                async with AsyncSessionLocal() as session:
+                    await monitoring_store.touch_watch(
+                        session, watched,
+                        datetime.utcnow() + timedelta(seconds=settings.MONITOR_WATCH_TTL)
+                    )
+                    await session.commit()
+                last = watched
+                renewed = now
+            except Exception as e:
+                print(f"写入容器查看心跳错误: {str(e)}")
+    
     async def _monitor_loop(self):
-        """监控循环"""
+        """
+        监控循环: 按各容器的下次采样时间调度
+        每隔 MONITOR_INTERVAL 用一次批量请求刷新运行中的容器并采集其中到期的容器,
+        两次刷新之间只单独查询到期的(繁忙或有人查看的)容器
+        """
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time()
+        next_watch = next_refresh
         while self.running:
+            now = loop.time()
             try:
-                await self._collect_all_containers()
-                await self._cleanup_old_data()
-                await asyncio.sleep(settings.MONITOR_INTERVAL)
+                if now >= next_watch:
+                    next_watch = now + settings.LIVE_POLL_INTERVAL
+                    await self._refresh_watched(now)
+                
+                all_stats = None
+                removed = set()
+                if now + SCHEDULE_SLACK >= next_refresh:
+                    next_refresh = now + settings.MONITOR_INTERVAL
+                    all_stats = await async_lxd_service.get_all_container_stats()
+                    removed = self._sync_members(all_stats, now)
+                
+                due = self._pop_due(now)
+                if due or removed or removed is None:
+                    await self._collect_containers(due, all_stats, removed)
+                
+                if all_stats is not None:
+                    await self._rollup()
+                    # 保留期以小时计, 无需每轮都执行范围删除
+                    if now - self._last_cleanup >= settings.MONITOR_CLEANUP_INTERVAL:
+                        await self._cleanup_old_data()
+                        self._last_cleanup = now
             except Exception as e:
                 print(f"监控循环错误: {str(e)}")
-                await asyncio.sleep(settings.MONITOR_INTERVAL)
+            # 睡到最早到期的容器、下次刷新或下次同步查看列表
+            wake = min(self._next_wakeup(), next_refresh, next_watch)
+            await asyncio.sleep(max(wake - loop.time(), SCHEDULE_SLACK))
+    
+    # ---------- 调度 ----------
+    
+    def _schedule_at(self, container_name: str, due: float):
+        self._next_due[container_name] = due
+        heapq.heappush(self._schedule, (due, container_name))
+    
+    def _pop_due(self, now: float) -> List[str]:
+        """取出所有已到期的容器, 堆中已被重新调度或移除的过期条目直接丢弃"""
+        due = []
+        while self._schedule and self._schedule[0][0] <= now + SCHEDULE_SLACK:
+            when, name = heapq.heappop(self._schedule)
+            if self._next_due.get(name) == when:
+                del self._next_due[name]
+                due.append(name)
+        return due
+    
+    def _next_wakeup(self) -> float:
+        while self._schedule and self._next_due.get(self._schedule[0][1]) != self._schedule[0][0]:
+            heapq.heappop(self._schedule)
+        return self._schedule[0][0] if self._schedule else float('inf')
+    
+    def _sync_members(self, all_stats: Dict, now: float) -> set:
+        """按批量请求的结果更新运行中的容器: 新容器立即采样, 返回已停止的容器"""
+        current = set(all_stats)
+        previous = self._active or set()
+        for name in current - previous:
+            self._activity.setdefault(name, 'normal')
+            self._schedule_at(name, now)
+        removed = previous - current
+        for name in removed:
+            self._next_due.pop(name, None)
+            self._activity.pop(name, None)
+            self._previous_stats.pop(name, None)
+            self._pools.pop(name, None)
+        for name, stats in all_stats.items():
+            self._pools[name] = stats.get('pool')
+        if self._active is None:
+            # 本进程首次采集, 清除上一个采集进程留下的最新样本
+            removed = None
+        self._active = current
+        return removed
     
-    async def _collect_all_containers(self):
-        """收集所有容器的监控数据"""
+    async def _refresh_watched(self, now: float):
+        """
+        合并本进程和其他API进程(数据库中未过期的心跳)正在查看的容器,
+        新增的被查看容器立即采样
+        """
+        watched = live_stats.watched()
         try:
-            containers = lxd_service.get_all_containers()
             async with AsyncSessionLocal() as session:
-                for container in containers:
-                    if container['status'] == 'Running':
-                        await self._collect_container_data(container['name'], session)
-                await session.commit()
+                watched |= set(await monitoring_store.watched_names(session, datetime.utcnow()))
         except Exception as e:
-            print(f"收集监控数据错误: {str(e)}")
+            print(f"读取容器查看心跳错误: {str(e)}")
+        for name in watched - self._watched:
+            if self._active and name in self._active:
+                self._activity[name] = 'watched'
+                self._schedule_at(name, now)
+        self._watched = watched
+    
+    def _classify(self, container_name: str, sample: Dict) -> str:
+        """根据最新样本决定容器的活跃程度, 即下次采样间隔"""
+        if container_name in self._watched:
+            return 'watched'
+        cpu = sample['cpu_usage']
+        if cpu is None:
+            # 首次采样还没有速率, 尽快再采一次
+            return 'busy'
+        network = (sample['network_rx_rate'] or 0) + (sample['network_tx_rate'] or 0)
+        if cpu >= settings.MONITOR_BUSY_CPU or network >= settings.MONITOR_BUSY_NETWORK:
+            return 'busy'
+        if cpu < settings.MONITOR_IDLE_CPU and network < settings.MONITOR_IDLE_NETWORK:
+            return 'idle'
+        return 'normal'
+    
+    # ---------- 采集 ----------
+    
+    async def _fetch_stats(self, names: List[str]) -> Dict[str, Dict]:
+        """两次刷新之间查询到期容器的state, 到期容器较多时仍使用一次批量请求"""
+        if len(names) * 4 >= len(self._active or ()):
+            all_stats = await async_lxd_service.get_all_container_stats()
+            return {name: all_stats[name] for name in names if name in all_stats}
+        
+        semaphore = asyncio.Semaphore(settings.MONITOR_CONCURRENCY)
+        
+        async def fetch(name):
+            async with semaphore:
+                return await async_lxd_service.get_container_stats(name)
+        
+        results = await asyncio.gather(*(fetch(name) for name in names), return_exceptions=True)
+        fetched = {}
+        for name, stats in zip(names, results):
+            if isinstance(stats, dict):
+                fetched[name] = {**stats, 'pool': self._pools.get(name)}
+        return fetched
     
-    async def _collect_container_data(self, container_name: str, session: AsyncSession):
-        """收集单个容器的监控数据"""
+    async def _collect_containers(self, names: List[str], all_stats: Optional[Dict], removed: Optional[set]):
+        """
+        采集一批到期容器的监控数据
+        并发执行各容器的探测, 每个容器有自己的截止时间(其采样间隔的80%),
+        超时仍未完成的容器记为跳过, 慢速容器不会因与快速容器同批而被提前截断;
+        无论成败, 每个容器都按其活跃程度重新排入调度队列
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadlines = {
+            name: settings.MONITOR_CYCLE_DEADLINE or 0.8 * self._interval_of(name)
+            for name in names
+        }
+        cycle = {
+            'started_at': datetime.utcnow().isoformat(),
+            'refresh': all_stats is not None,
+            'containers': len(names),
+            'collected': 0,
+            'skipped': 0,
+            'duration': 0.0,
+            'deadline_exceeded': False
+        }
         try:
-            # 获取LXD统计
-            stats = lxd_service.get_container_stats(container_name)
-            if not stats:
-                return
+            if all_stats is None:
+                stats_by_name = await self._fetch_stats(names)
+            else:
+                stats_by_name = {name: all_stats[name] for name in names if name in all_stats}
+            read_at = time.monotonic()
+            cycle['containers'] = len(stats_by_name)  # 期间已停止的容器不计入
             
-            # 通过lxc exec获取容器内部信息
-            load_avg = await self._get_container_load(container_name)
-            disk_info = await self._get_container_disk(container_name)
+            semaphore = asyncio.Semaphore(settings.MONITOR_CONCURRENCY)
+            elapsed = loop.time() - started
+            results = await asyncio.gather(*(
+                asyncio.wait_for(
+                    self._collect_container_data(name, stats, read_at, semaphore),
+                    timeout=max(deadlines[name] - elapsed, 0)
+                )
+                for name, stats in stats_by_name.items()
+            ), return_exceptions=True)
+            cycle['deadline_exceeded'] = any(isinstance(r, asyncio.TimeoutError) for r in results)
+            samples = [r for r in results if isinstance(r, dict)]
             
-            # 计算网络速率
-            network_rx_rate, network_tx_rate = self._calculate_network_rate(
-                container_name, 
-                stats['network_rx'], 
-                stats['network_tx']
-            )
+            cycle['collected'] = len(samples)
+            cycle['skipped'] = cycle['containers'] - len(samples)
             
-            # 创建监控数据记录
-            data = MonitoringData(
-                container_name=container_name,
-                timestamp=datetime.utcnow(),
-                cpu_usage=stats.get('cpu_usage', 0),
-                load_average=load_avg,
-                memory_usage=stats.get('memory_usage', 0),
-                memory_total=stats.get('memory_total', 0),
-                memory_percent=(stats.get('memory_usage', 0) / stats.get('memory_total', 1)) * 100 if stats.get('memory_total', 0) > 0 else 0,
-                network_rx_bytes=stats.get('network_rx', 0),
-                network_tx_bytes=stats.get('network_tx', 0),
-                network_rx_rate=network_rx_rate,
-                network_tx_rate=network_tx_rate,
-                disk_usage=disk_info.get('used', 0),
-                disk_total=disk_info.get('total', 0),
-                disk_percent=disk_info.get('percent', 0)
-            )
-            
-            session.add(data)
+            # 先推送给实时订阅者, 再落库
+            self._publish(samples)
+            await self.writer.add_many(samples)
+            await self.writer.flush()
+            await self._save_latest(samples, removed)
         except Exception as e:
-            print(f"收集容器 {container_name} 数据错误: {str(e)}")
+            print(f"收集监控数据错误: {str(e)}")
+        finally:
+            for name in names:
+                if name in self._active:
+                    self._schedule_at(name, started + self._interval_of(name))
+            cycle['duration'] = round(loop.time() - started, 3)
+            self.last_cycle = cycle
+            self.cycle_history.append(cycle)
+            if cycle['skipped']:
+                print(f"本批监控采集跳过 {cycle['skipped']}/{cycle['containers']} 个容器, 耗时 {cycle['duration']}s")
     
-    async def _get_container_load(self, container_name: str) -> float:
-        """获取容器负载"""
-        try:
-            import subprocess
-            result = subprocess.run(
-                ['lxc', 'exec', container_name, '--', 'cat', '/proc/loadavg'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                load_str = result.stdout.strip().split()[0]
-                return float(load_str)
-        except Exception:
-            pass
-        return 0.0
-    
-    async def _get_container_disk(self, container_name: str) -> Dict:
-        """获取容器磁盘使用"""
+    def _interval_of(self, container_name: str) -> float:
+        return activity_intervals()[self._activity.get(container_name, 'normal')]
+    
+    def _publish(self, samples: List[Dict]):
+        """把本批样本作为一批发布到实时数据中心, 并移除已不在运行的容器"""
+        live_stats.publish_cycle(
+            {sample['container_name']: format_current_stats(sample) for sample in samples},
+            active=self._active
+        )
+    
+    async def _save_latest(self, samples: List[Dict], removed: Optional[set]):
+        """覆盖写入最新样本表, 供不采集的API进程读取; removed 为 None 时先清空整张表"""
+        async with AsyncSessionLocal() as session:
+            if removed is None:
+                await monitoring_store.clear_latest(session)
+                removed = ()
+            await monitoring_store.save_latest(session, samples, removed)
+            await session.commit()
+    
+    async def _collect_container_data(
+        self,
+        container_name: str,
+        stats: Dict,
+        read_at: float,
+        semaphore: asyncio.Semaphore
+    ) -> Optional[Dict]:
+        """收集单个容器的监控数据, read_at 为读取LXD state时的单调时钟"""
         try:
-            import subprocess
-            result = subprocess.run(
-                ['lxc', 'exec', container_name, '--', 'df', '-BG', '/'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                if len(lines) > 1:
-                    parts = lines[1].split()
-                    total = float(parts[1].replace('G', ''))
-                    used = float(parts[2].replace('G', ''))
-                    percent = float(parts[4].replace('%', ''))
-                    return {'total': total, 'used': used, 'percent': percent}
-        except Exception:
-            pass
-        return {'total': 0, 'used': 0, 'percent': 0}
-    
-    def _calculate_network_rate(self, container_name: str, rx_bytes: float, tx_bytes: float) -> tuple:
-        """计算网络速率 (KB/s)"""
-        rx_rate = 0.0
-        tx_rate = 0.0
-        
-        if container_name in self._previous_stats:
-            prev = self._previous_stats[container_name]
-            time_delta = settings.MONITOR_INTERVAL
+            async with semaphore:
+                probed = await self.probe.probe(container_name, stats)
+            probed_at = time.monotonic()
+            # 探针读到的CPU/内存比LXD state更精确, 覆盖同名字段
+            disk_info = probed.pop('disk')
+            cpu_at = probed_at if 'cpu_usage' in probed else read_at
+            stats = {**stats, **probed}
             
-            rx_rate = (rx_bytes - prev['rx']) / time_delta / 1024  # KB/s
-            tx_rate = (tx_bytes - prev['tx']) / time_delta / 1024  # KB/s
-        
+            # 累计计数器按实际读取时刻之差换算为速率
+            rates = self._calculate_rates(container_name, {
+                'cpu': (stats.get('cpu_usage'), cpu_at),
+                'rx': (stats.get('network_rx'), read_at),
+                'tx': (stats.get('network_tx'), read_at)
+            })
+            
+            # 监控数据记录 (由SampleWriter批量写入)
+            sample = {
+                'container_name': container_name,
+                'timestamp': datetime.utcnow(),
+                'cpu_usage': None if rates['cpu'] is None else round(rates['cpu'] * 100, 2),  # 单核为100%
+                'load_average': stats.get('load_average'),
+                'memory_usage': stats.get('memory_usage', 0),
+                'memory_total': stats.get('memory_total', 0),
+                'memory_percent': (stats.get('memory_usage', 0) / stats.get('memory_total', 1)) * 100 if stats.get('memory_total', 0) > 0 else 0,
+                'network_rx_bytes': stats.get('network_rx', 0),
+                'network_tx_bytes': stats.get('network_tx', 0),
+                'network_rx_rate': None if rates['rx'] is None else rates['rx'] / 1024,  # KB/s
+                'network_tx_rate': None if rates['tx'] is None else rates['tx'] / 1024,
+                'disk_usage': disk_info.get('used', 0),
+                'disk_total': disk_info.get('total', 0),
+                'disk_percent': disk_info.get('percent', 0),
+                'cpu_pressure': stats.get('cpu_pressure'),
+                'memory_pressure': stats.get('memory_pressure'),
+                'io_pressure': stats.get('io_pressure'),
+                'io_read_bytes': stats.get('io_read_bytes'),
+                'io_write_bytes': stats.get('io_write_bytes')
+            }
+            self._activity[container_name] = self._classify(container_name, sample)
+            return sample
+        except Exception as e:
+            print(f"收集容器 {container_name} 数据错误: {str(e)}")
+            return None
+    
+    def _calculate_rates(self, container_name: str, counters: Dict[str, tuple]) -> Dict[str, Optional[float]]:
+        """
+        根据累计计数器 (值, 读取时的单调时钟) 计算每秒增量
+        首次采样或计数器回退(容器重启)时该项为None
+        """
+        previous = self._previous_stats.get(container_name, {})
+        rates = {}
+        for key, (value, at) in counters.items():
+            rates[key] = None
+            if value is None or key not in previous:
+                continue
+            prev_value, prev_at = previous[key]
+            elapsed = at - prev_at
+            if elapsed > 0 and value >= prev_value:
+                rates[key] = (value - prev_value) / elapsed
         self._previous_stats[container_name] = {
-            'rx': rx_bytes,
-            'tx': tx_bytes
+            key: counter for key, counter in counters.items() if counter[0] is not None
         }
-        
-        return max(0, rx_rate), max(0, tx_rate)
+        return rates
+    
+    async def _rollup(self):
+        """
+        增量维护汇总层: raw -> 5m -> 1h
+        每层只汇总上次之后已经结束的时间桶, 积压较多时按天分批提交
+        """
+        try:
+            now = datetime.utcnow()
+            source_end = None  # 上一层已完成到的时间点
+            for tier, step in ROLLUP_TIERS.items():
+                end = floor_time(now if source_end is None else source_end, step)
+                async with AsyncSessionLocal() as session:
+                    start = self._rollup_marks.get(tier)
+                    if start is None:
+                        start = (await monitoring_store.rollup_watermark(session, tier)
+                                 or await monitoring_store.rollup_origin(session, tier))
+                    while start is not None and start < end:
+                        chunk_end = min(start + timedelta(days=1), end)
+                        await monitoring_store.rollup(session, tier, start, chunk_end)
+                        await session.commit()
+                        start = chunk_end
+                if start is not None:
+                    self._rollup_marks[tier] = start
+                source_end = start
+                if source_end is None:
+                    break
+        except Exception as e:
+            print(f"监控数据汇总错误: {str(e)}")
     
     async def _cleanup_old_data(self):
-        """清理旧数据"""
+        """清理旧数据: 原始样本整天过期的分区直接删除, 汇总层按各自保留期删除"""
         try:
-            cutoff_time = datetime.utcnow() - timedelta(hours=settings.DATA_RETENTION_HOURS)
+            now = datetime.utcnow()
+            retention = tier_retention_hours()
             async with AsyncSessionLocal() as session:
-                stmt = delete(MonitoringData).where(MonitoringData.timestamp < cutoff_time)
-                await session.execute(stmt)
+                dropped = await monitoring_store.drop_before(
+                    session, now - timedelta(hours=retention['raw'])
+                )
+                for tier in ROLLUP_TIERS:
+                    await monitoring_store.delete_rollup_before(
+                        session, tier, now - timedelta(hours=retention[tier])
+                    )
+                await monitoring_store.delete_expired_watch(session, now)
                 await session.commit()
+            if dropped:
+                print(f"已删除 {dropped} 个过期监控分区")
         except Exception as e:
             print(f"清理旧数据错误: {str(e)}")
     
+    def get_collector_status(self) -> Dict:
+        """采集器运行状态"""
+        history = list(self.cycle_history)
+        return {
+            'running': self.running,
+            'mode': settings.MONITOR_MODE,
+            'collector_pid': os.getpid() if self.running else self.lock.holder(),
+            'interval': settings.MONITOR_INTERVAL,
+            'scheduler': {
+                'running': len(self._active or ()),
+                'watched': len(self._watched),
+                'activity': dict(Counter(self._activity.values())),
+                'intervals': activity_intervals()
+            },
+            'last_cycle': self.last_cycle,
+            'writer': self.writer.stats(),
+            'live': live_stats.stats(),
+            'rollup_marks': {tier: mark.isoformat() for tier, mark in self._rollup_marks.items()},
+            'avg_duration': round(sum(c['duration'] for c in history) / len(history), 3) if history else 0.0,
+            'recent_cycles': history[-10:]
+        }
+    
     async def get_current_stats(self, container_name: str) -> Optional[Dict]:
-        """获取容器当前统计信息"""
+        """获取容器当前统计信息, 优先读取内存中的最新样本"""
+        latest = live_stats.latest(container_name)
+        if latest:
+            return latest
+        # 服务刚启动尚未完成一轮采集时回退到数据库
         async with AsyncSessionLocal() as session:
-            stmt = select(MonitoringData).where(
-                MonitoringData.container_name == container_name
-            ).order_by(MonitoringData.timestamp.desc()).limit(1)
-            
-            result = await session.execute(stmt)
-            data = result.scalar_one_or_none()
-            
-            if data:
-                return {
-                    'timestamp': data.timestamp.isoformat(),
-                    'cpu_usage': data.cpu_usage,
-                    'load_average': data.load_average,
-                    'memory': {
-                        'usage': data.memory_usage,
-                        'total': data.memory_total,
-                        'percent': data.memory_percent
-                    },
-                    'network': {
-                        'rx_bytes': data.network_rx_bytes,
-                        'tx_bytes': data.network_tx_bytes,
-                        'rx_rate': data.network_rx_rate,
-                        'tx_rate': data.network_tx_rate
-                    },
-                    'disk': {
-                        'usage': data.disk_usage,
-                        'total': data.disk_total,
-                        'percent': data.disk_percent
-                    }
-                }
-            return None
+            row = await monitoring_store.latest(session, container_name)
+        return format_current_stats(row) if row else None
     
-    async def get_history_stats(self, container_name: str, hours: int = 24) -> list:
-        """获取容器历史统计信息"""
+    async def get_history_rows(
+        self,
+        container_name: str,
+        hours: int = 24,
+        tier: str = 'raw',
+        max_points: Optional[int] = None
+    ) -> list:
+        """
+        获取容器历史样本, 时间戳保持为datetime
+        tier 为 raw 时返回原始样本; 为汇总层时每个时间桶返回平均值及 <指标>_min / <指标>_max
+        指定 max_points 时用LTTB降采样到不超过该行数
+        """
         start_time = datetime.utcnow() - timedelta(hours=hours)
         
         async with AsyncSessionLocal() as session:
-            stmt = select(MonitoringData).where(
-                MonitoringData.container_name == container_name,
-                MonitoringData.timestamp >= start_time
-            ).order_by(MonitoringData.timestamp.asc())
-            
-            result = await session.execute(stmt)
-            data_list = result.scalars().all()
-            
-            return [{
-                'timestamp': data.timestamp.isoformat(),
-                'cpu_usage': data.cpu_usage,
-                'load_average': data.load_average,
-                'memory_percent': data.memory_percent,
-                'network_rx_rate': data.network_rx_rate,
-                'network_tx_rate': data.network_tx_rate,
-                'disk_percent': data.disk_percent
-            } for data in data_list]
+            if tier == 'raw':
+                rows = await monitoring_store.history(
+                    session, container_name, start_time, columns=HISTORY_COLUMNS
+                )
+            else:
+                rows = await monitoring_store.rollup_history(
+                    session, tier, container_name, start_time, metrics=HISTORY_COLUMNS[1:]
+                )
+        
+        return downsample_rows(rows, max_points, HISTORY_COLUMNS[1:])
+    
+    async def get_history_stats(
+        self,
+        container_name: str,
+        hours: int = 24,
+        tier: str = 'raw',
+        max_points: Optional[int] = None
+    ) -> list:
+        """获取容器历史统计信息 (逐行格式, ISO时间戳)"""
+        rows = await self.get_history_rows(container_name, hours, tier, max_points)
+        for row in rows:
+            row['timestamp'] = row['timestamp'].isoformat()
+        return rows
 
 # 全局监控服务实例
 monitor_service = MonitorService()
@@ -0,0 +1,370 @@
+"""主机端口分配 - 持久化的端口占用表与内存中的有序区间索引"""
+import asyncio
+import json
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+
+from config import settings
+from database.db import AsyncSessionLocal
+from database.models import Job, PortAllocation, port_allocation_version
+from services.leader import LeaderLock
+
+# 创建容器时写入LXD实例配置的端口信息, 启动时据此重建分配表
+SSH_PORT_KEY = 'user.panel.ssh_port'
+NAT_PORTS_KEY = 'user.panel.nat_ports'
+
+
+class PortConflict(Exception):
+    """请求的端口与已分配的端口重叠"""
+
+
+def ports_from_config(config: Dict) -> Dict[str, Optional[int]]:
+    """
+    从LXD实例配置中读取端口: 优先使用 user.panel.* 键,
+    旧容器回退到 user.description ("<os> <ssh端口> <密码> <NAT起> <NAT止>")
+    """
+    ssh_port = config.get(SSH_PORT_KEY)
+    nat_ports = config.get(NAT_PORTS_KEY)
+    if ssh_port is not None or nat_ports is not None:
+        nat_start, _, nat_end = (nat_ports or '').partition('-')
+        return {
+            'ssh_port': int(ssh_port) if ssh_port else None,
+            'nat_start': int(nat_start) if nat_start else None,
+            'nat_end': int(nat_end or nat_start) if nat_start else None
+        }
+    parts = config.get('user.description', '').split()
+    try:
+        return {
+            'ssh_port': int(parts[1]) if len(parts) > 1 else None,
+            'nat_start': int(parts[3]) if len(parts) > 3 and parts[3] != '0' else None,
+            'nat_end': int(parts[4]) if len(parts) > 4 and parts[4] != '0' else None
+        }
+    except ValueError:
+        return {'ssh_port': None, 'nat_start': None, 'nat_end': None}
+
+
+def requested_ranges(ssh_port: Optional[int], nat_start: Optional[int], nat_end: Optional[int]) -> List[Tuple[str, int, int]]:
+    """容器需要占用的主机端口段: (类型, 起始, 结束); 22端口不转发, 不占用"""
+    ranges = []
+    if ssh_port and ssh_port != 22:
+        ranges.append(('ssh', ssh_port, ssh_port))
+    if nat_start and nat_end and nat_start > 0 and nat_end > 0:
+        ranges.append(('nat', nat_start, nat_end))
+    return ranges
+
+
+class PortRangeIndex:
+    """
+    已占用端口的有序不相交区间
+
+    区间按起点排序存放在两个列表中, 与 [start, end] 重叠的只可能是
+    起点不大于end的最后一个区间, 因此冲突检测是一次二分查找。
+    """
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect_right(self._starts, end) - 1
+        return i >= 0 and self._ends[i] >= start
+
+    def add(self, start: int, end: int):
+        """加入区间, 与已有区间重叠时合并 (旧数据中可能存在重叠)"""
+        lo = bisect_left(self._ends, start)
+        hi = bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def find_free(self, size: int, low: int, high: int) -> Optional[int]:
+        """[low, high] 内第一段长度为size的空闲端口的起点"""
+        candidate = low
+        i = bisect_right(self._starts, low) - 1
+        if i >= 0 and self._ends[i] >= candidate:
+            candidate = self._ends[i] + 1
+        i += 1
+        while candidate + size - 1 <= high:
+            if i >= len(self._starts) or self._starts[i] > candidate + size - 1:
+                return candidate
+            candidate = max(candidate, self._ends[i] + 1)
+            i += 1
+        return None
+
+
+class PortAllocator:
+    """
+    容器端口分配
+
+    port_allocations 表是持久化的占用记录, 每个进程在内存中维护其有序区间索引;
+    每次写入都在同一事务中递增 port_allocation_version, 计数变化时(其他进程分配或释放过)才重新加载。
+    (不能用行数和最大id判断: 删除最大id的行后再插入, SQLite会复用该id, 两者都不变)
+    分配在文件锁内"检查+写入", 多个API进程不会分配出重叠的端口。
+    """
+
+    def __init__(self):
+        self._index = PortRangeIndex()
+        self._owners: Dict[str, List[Tuple[str, int, int]]] = {}
+        self._version: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    # ---------- 内部 ----------
+
+    async def _file_lock(self) -> LeaderLock:
+        lock = LeaderLock(settings.PORT_ALLOCATION_LOCK_FILE)
+        while not lock.try_acquire():
+            await asyncio.sleep(0.05)
+        return lock
+
+    @staticmethod
+    async def _read_version(session) -> int:
+        result = await session.execute(
+            select(port_allocation_version.c.version).where(port_allocation_version.c.id == 1)
+        )
+        return result.scalar_one_or_none() or 0
+
+    async def _sync(self, session):
+        """表有变化时重新加载索引"""
+        version = await self._read_version(session)
+        if version == self._version:
+            return
+        result = await session.execute(select(PortAllocation))
+        owners: Dict[str, List[Tuple[str, int, int]]] = {}
+        for row in result.scalars():
+            owners.setdefault(row.container_name, []).append((row.kind, row.start_port, row.end_port))
+        self._set_owners(owners)
+        self._version = version
+
+    def _set_owners(self, owners: Dict[str, List[Tuple[str, int, int]]]):
+        index = PortRangeIndex()
+        for ranges in owners.values():
+            for _, start, end in ranges:
+                index.add(start, end)
+        self._owners = owners
+        self._index = index
+
+    async def _bump_version(self, session) -> int:
+        """递增写入计数 (在写入分配记录的事务中调用, 提交后才对其他进程可见)"""
+        stmt = insert(port_allocation_version).values(id=1, version=1)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={'version': port_allocation_version.c.version + 1}
+        ))
+        return await self._read_version(session)
+
+    def _owner_of(self, start: int, end: int) -> Optional[str]:
+        """与端口段重叠的容器 (仅在发生冲突时用于提示)"""
+        for name, ranges in self._owners.items():
+            for _, s, e in ranges:
+                if s <= end and e >= start:
+                    return name
+        return None
+
+    # ---------- 分配 ----------
+
+    async def reserve(
+        self,
+        container_name: str,
+        ssh_port: Optional[int] = None,
+        nat_start: Optional[int] = None,
+        nat_end: Optional[int] = None
+    ) -> List[Tuple[str, int, int]]:
+        """为容器分配端口, 与其他容器重叠时抛出 PortConflict"""
+        ranges = requested_ranges(ssh_port, nat_start, nat_end)
+        for kind, start, end in ranges:
+            if not 1 <= start <= end <= 65535:
+                raise PortConflict(f"端口范围无效: {start}-{end}")
+        if len(ranges) == 2 and ranges[1][1] <= ranges[0][1] <= ranges[1][2]:
+            raise PortConflict(f"SSH端口 {ssh_port} 位于NAT端口范围内")
+        if not ranges:
+            return []
+
+        async with self._lock:
+            lock = await self._file_lock()
+            try:
+                async with AsyncSessionLocal() as session:
+                    await self._sync(session)
+                    for kind, start, end in ranges:
+                        if self._index.overlaps(start, end):
+                            owner = self._owner_of(start, end)
+                            label = str(start) if start == end else f"{start}-{end}"
+                            raise PortConflict(f"端口 {label} 与容器 {owner} 已分配的端口冲突")
+                    await self._insert(session, {container_name: ranges})
+            finally:
+                lock.release()
+        return ranges
+
+    async def allocate_many(
+        self,
+        names: List[str],
+        nat_size: int = 0,
+        ssh_low: Optional[int] = None,
+        ssh_high: Optional[int] = None,
+        nat_low: Optional[int] = None,
+        nat_high: Optional[int] = None,
+        ssh: bool = True
+    ) -> Dict[str, Dict[str, Optional[int]]]:
+        """
+        为一批容器自动分配空闲的SSH端口(ssh为False时不分配)和长度为nat_size的NAT端口段
+        整批在同一把锁内分配并一次提交, 空闲端口不足时整批失败(抛出 PortConflict)
+        """
+        low = settings.PORT_ALLOCATION_MIN
+        high = settings.PORT_ALLOCATION_MAX
+        async with self._lock:
+            lock = await self._file_lock()
+            try:
+                async with AsyncSessionLocal() as session:
+                    await self._sync(session)
+                    allocated: Dict[str, List[Tuple[str, int, int]]] = {}
+                    ports = {}
+                    try:
+                        for name in names:
+                            if name in self._owners:
+                                raise PortConflict(f"容器 {name} 已分配端口")
+                        for name in names:
+                            ranges = []
+                            ssh_port = nat_start = nat_end = None
+                            if ssh:
+                                ssh_port = self._index.find_free(1, ssh_low or low, ssh_high or high)
+                                if ssh_port is None:
+                                    raise PortConflict("没有空闲的SSH端口")
+                                self._index.add(ssh_port, ssh_port)
+                                ranges.append(('ssh', ssh_port, ssh_port))
+                            if nat_size > 0:
+                                nat_start = self._index.find_free(nat_size, nat_low or low, nat_high or high)
+                                if nat_start is None:
+                                    raise PortConflict(f"没有长度为 {nat_size} 的空闲NAT端口段")
+                                nat_end = nat_start + nat_size - 1
+                                self._index.add(nat_start, nat_end)
+                                ranges.append(('nat', nat_start, nat_end))
+                            if ranges:
+                                allocated[name] = ranges
+                            ports[name] = {'ssh_port': ssh_port, 'nat_start': nat_start, 'nat_end': nat_end}
+                        await self._insert(session, allocated)
+                    except Exception:
+                        # 撤销本批在索引中的临时占用
+                        self._set_owners(self._owners)
+                        raise
+            finally:
+                lock.release()
+        return ports
+
+    async def _insert(self, session, allocated: Dict[str, List[Tuple[str, int, int]]]):
+        """写入已通过冲突检查的分配并更新索引"""
+        for name in allocated:
+            if name in self._owners:
+                raise PortConflict(f"容器 {name} 已分配端口")
+        session.add_all([
+            PortAllocation(container_name=name, kind=kind, start_port=start, end_port=end)
+            for name, ranges in allocated.items()
+            for kind, start, end in ranges
+        ])
+        version = await self._bump_version(session)
+        await session.commit()
+        for ranges in allocated.values():
+            for kind, start, end in ranges:
+                self._index.add(start, end)
+        self._owners.update(allocated)
+        self._version = version
+
+    async def release(self, container_name: str) -> int:
+        """释放容器占用的全部端口"""
+        async with self._lock:
+            lock = await self._file_lock()
+            try:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        delete(PortAllocation).where(PortAllocation.container_name == container_name)
+                    )
+                    await self._bump_version(session)
+                    await session.commit()
+                    await self._sync(session)
+                    return result.rowcount
+            finally:
+                lock.release()
+
+    async def suggest(self, size: int, low: Optional[int] = None, high: Optional[int] = None) -> Optional[int]:
+        """下一段长度为size的空闲端口的起点, 没有时返回None"""
+        low = low or settings.PORT_ALLOCATION_MIN
+        high = high or settings.PORT_ALLOCATION_MAX
+        async with self._lock:
+            async with AsyncSessionLocal() as session:
+                await self._sync(session)
+            return self._index.find_free(size, low, high)
+
+    async def allocations(self) -> Dict[str, List[Dict]]:
+        async with self._lock:
+            async with AsyncSessionLocal() as session:
+                await self._sync(session)
+            return {
+                name: [{'kind': kind, 'start': start, 'end': end} for kind, start, end in ranges]
+                for name, ranges in self._owners.items()
+            }
+
+    # ---------- 重建 ----------
+
+    async def rebuild(self, containers: Iterable[Dict]) -> int:
+        """
+        启动时以LXD中的容器为准重建分配表
+        LXD中不存在、也没有未完成的创建任务的容器, 其分配记录被删除
+        """
+        owners: Dict[str, List[Tuple[str, int, int]]] = {}
+        for container in containers:
+            ranges = requested_ranges(
+                container.get('ssh_port'), container.get('nat_start'), container.get('nat_end')
+            )
+            if ranges:
+                owners[container['name']] = ranges
+
+        async with self._lock:
+            lock = await self._file_lock()
+            try:
+                async with AsyncSessionLocal() as session:
+                    result = await session.execute(
+                        select(Job.kind, Job.params).where(
+                            Job.kind.in_(('create_container', 'bulk_create')),
+                            Job.status.in_(('pending', 'running'))
+                        )
+                    )
+                    creating = set()
+                    for kind, params in result.all():
+                        params = json.loads(params or '{}')
+                        if kind == 'bulk_create':
+                            creating.update(item['name'] for item in params.get('items', []))
+                        else:
+                            creating.add(params.get('name'))
+                    result = await session.execute(
+                        select(PortAllocation).where(
+                            PortAllocation.container_name.in_(creating - set(owners))
+                        )
+                    )
+                    for row in result.scalars():
+                        owners.setdefault(row.container_name, []).append(
+                            (row.kind, row.start_port, row.end_port)
+                        )
+
+                    await session.execute(delete(PortAllocation))
+                    session.add_all([
+                        PortAllocation(container_name=name, kind=kind, start_port=start, end_port=end)
+                        for name, ranges in owners.items()
+                        for kind, start, end in ranges
+                    ])
+                    version = await self._bump_version(session)
+                    await session.commit()
+                    self._set_owners(owners)
+                    self._version = version
+            finally:
+                lock.release()
+        return len(owners)
+
+
+# 全局端口分配器
+port_allocator = PortAllocator()
@@ -0,0 +1,252 @@
+"""
+端口转发管理 - 用 iptables-restore 批量维护容器的DNAT规则
+
+nat表中的结构:
+  PREROUTING -j LXD-PANEL                    (一条跳转, 首次应用时插入)
+  LXD-PANEL  -p tcp -m multiport --dports <该容器的全部主机端口> -j LXDP_<hash>
+  LXDP_<hash> 每个端口或端口范围一条DNAT规则, 带 "lxd-panel:<容器名>" 注释
+
+每次变更先用 iptables-save 读取当前规则重建索引, 再生成完整的规则集,
+由一次 iptables-restore --noflush 原子地应用: 声明链会清空该链,
+因此容器链和父链都是整体重写, 不会残留或重复规则。
+"""
+import hashlib
+import shlex
+import subprocess
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from services.executor import AsyncFacade, lxd_executor
+from services.leader import LeaderLock
+
+CHAIN_PREFIX = "LXDP_"
+COMMENT_PREFIX = "lxd-panel:"
+# multiport 每条规则最多15个端口, 端口范围占2个
+MULTIPORT_LIMIT = 15
+
+
+def chain_name(container_name: str) -> str:
+    """容器专用链名 (iptables链名最长28字符, 容器名可能更长, 因此取哈希)"""
+    return CHAIN_PREFIX + hashlib.sha1(container_name.encode()).hexdigest()[:12]
+
+
+def port_spec(start: int, end: int) -> str:
+    return str(start) if start == end else f"{start}:{end}"
+
+
+class ContainerForwards:
+    """一个容器的全部转发规则: (协议, 起始端口, 结束端口, 容器端口或None表示端口不变)"""
+
+    def __init__(self, name: str, ip: str):
+        self.name = name
+        self.ip = ip
+        self.rules: List[Tuple[str, int, int, Optional[int]]] = []
+
+    @property
+    def chain(self) -> str:
+        return chain_name(self.name)
+
+    def host_ports(self) -> List[Tuple[int, int]]:
+        return [(start, end) for _, start, end, _ in self.rules]
+
+    def render(self) -> List[str]:
+        """容器链中的规则行"""
+        lines = []
+        # iptables-restore 只识别双引号 (LXD容器名不含空格和引号)
+        comment = f'"{COMMENT_PREFIX}{self.name}"'
+        for proto, start, end, to_port in self.rules:
+            destination = self.ip if to_port is None else f"{self.ip}:{to_port}"
+            lines.append(
+                f"-A {self.chain} -p {proto} -m {proto} --dport {port_spec(start, end)} "
+                f"-m comment --comment {comment} -j DNAT --to-destination {destination}"
+            )
+        return lines
+
+    def to_dict(self) -> Dict:
+        return {
+            'ip': self.ip,
+            'rules': [
+                {'proto': proto, 'host_ports': port_spec(start, end), 'container_port': to_port}
+                for proto, start, end, to_port in self.rules
+            ]
+        }
+
+
+class PortForwardManager:
+    """维护容器端口转发规则及 主机端口 -> 容器 的索引"""
+
+    def __init__(self, parent_chain: str, lock_path: str):
+        self.parent_chain = parent_chain
+        self.lock_path = lock_path
+        self._forwards: Dict[str, ContainerForwards] = {}
+        self._lock = threading.Lock()
+
+    # ---------- 读取 ----------
+
+    def _save(self) -> List[str]:
+        result = subprocess.run(
+            [settings.IPTABLES_SAVE, '-t', 'nat'],
+            capture_output=True, text=True, check=True
+        )
+        return result.stdout.splitlines()
+
+    def _parse(self, lines: List[str]) -> Tuple[Dict[str, ContainerForwards], Dict]:
+        """从 iptables-save 输出重建索引, 同时找出父链跳转和旧版逐端口规则"""
+        forwards: Dict[str, ContainerForwards] = {}
+        state = {'jump': False, 'legacy': []}
+        for line in lines:
+            if not line.startswith('-A '):
+                continue
+            args = shlex.split(line)
+            chain = args[1]
+            if chain == 'PREROUTING':
+                if args[-2:] == ['-j', self.parent_chain]:
+                    state['jump'] = True
+                elif '--to-destination' in args and 'DNAT' in args:
+                    state['legacy'].append(line)
+                continue
+            if not chain.startswith(CHAIN_PREFIX):
+                continue
+            options = self._options(args)
+            comment = options.get('--comment', '')
+            if not comment.startswith(COMMENT_PREFIX) or '--dport' not in options:
+                continue
+            name = comment[len(COMMENT_PREFIX):]
+            ip, _, to_port = options.get('--to-destination', '').partition(':')
+            start, _, end = options['--dport'].partition(':')
+            entry = forwards.setdefault(name, ContainerForwards(name, ip))
+            entry.rules.append((
+                options.get('-p', 'tcp'), int(start), int(end or start),
+                int(to_port) if to_port else None
+            ))
+        return forwards, state
+
+    @staticmethod
+    def _options(args: List[str]) -> Dict[str, str]:
+        options = {}
+        for i, arg in enumerate(args[:-1]):
+            if arg.startswith('-'):
+                options[arg] = args[i + 1]
+        return options
+
+    def load(self) -> int:
+        """启动时从当前iptables规则重建索引, 返回已配置转发的容器数"""
+        try:
+            with self._lock:
+                self._forwards, _ = self._parse(self._save())
+            return len(self._forwards)
+        except Exception as e:
+            print(f"读取端口转发规则失败: {str(e)}")
+            return 0
+
+    # ---------- 应用 ----------
+
+    def _render_parent(self, forwards: Dict[str, ContainerForwards]) -> List[str]:
+        """父链: 每个容器按主机端口跳转到其专用链"""
+        lines = []
+        for entry in forwards.values():
+            by_proto: Dict[str, List[str]] = {}
+            for proto, start, end, _ in entry.rules:
+                by_proto.setdefault(proto, []).append(port_spec(start, end))
+            for proto, specs in by_proto.items():
+                chunk, weight = [], 0
+                for spec in specs + [None]:
+                    cost = 0 if spec is None else (2 if ':' in spec else 1)
+                    if chunk and (spec is None or weight + cost > MULTIPORT_LIMIT):
+                        lines.append(
+                            f"-A {self.parent_chain} -p {proto} -m multiport "
+                            f"--dports {','.join(chunk)} -j {entry.chain}"
+                        )
+                        chunk, weight = [], 0
+                    if spec is not None:
+                        chunk.append(spec)
+                        weight += cost
+        return lines
+
+    def _restore(self, lines: List[str]):
+        payload = '\n'.join(['*nat'] + lines + ['COMMIT', ''])
+        subprocess.run(
+            [settings.IPTABLES_RESTORE, '--noflush'],
+            input=payload, capture_output=True, text=True, check=True
+        )
+
+    def _change(self, changes: Dict[str, Optional[ContainerForwards]], legacy_ips: List[str]) -> Dict[str, ContainerForwards]:
+        """
+        在一次 iptables-restore 中替换(值不为None)或删除若干容器的规则, 返回被替换或删除的原规则
+        旧版逐端口写在PREROUTING中、指向这些容器IP (legacy_ips 及原规则中的IP) 的DNAT规则一并删除
+        """
+        with self._lock, LeaderLock(self.lock_path):
+            forwards, state = self._parse(self._save())
+            old = {}
+            for name, entry in changes.items():
+                previous = forwards.pop(name, None)
+                if previous is not None:
+                    old[name] = previous
+                    legacy_ips = legacy_ips + [previous.ip]
+                if entry is not None:
+                    forwards[name] = entry
+            touched = [name for name, entry in changes.items() if entry is not None or name in old]
+
+            lines = [f":{self.parent_chain} - [0:0]"]
+            lines += [f":{chain_name(name)} - [0:0]" for name in touched]
+            if not state['jump']:
+                lines.append(f"-I PREROUTING 1 -j {self.parent_chain}")
+            for line in state['legacy']:
+                if any(f"--to-destination {ip}:" in line or line.endswith(f"--to-destination {ip}")
+                       for ip in legacy_ips if ip):
+                    lines.append('-D' + line[2:])
+            lines += self._render_parent(forwards)
+            for name in touched:
+                entry = changes[name]
+                if entry is not None:
+                    lines += entry.render()
+                else:
+                    lines.append(f"-X {chain_name(name)}")
+            if touched:
+                self._restore(lines)
+            self._forwards = forwards
+            return old
+
+    def apply(self, name: str, ip: str, ssh_port: int = 0, nat_start: int = 0, nat_end: int = 0):
+        """设置容器的SSH端口和NAT端口范围转发, 替换该容器原有的全部规则"""
+        entry = ContainerForwards(name, ip)
+        if ssh_port and ssh_port != 22:
+            entry.rules.append(('tcp', ssh_port, ssh_port, 22))
+        if nat_start > 0 and nat_end > 0:
+            entry.rules.append(('tcp', nat_start, nat_end, None))
+        if not entry.rules:
+            return
+        self._change({name: entry}, [ip])
+        print(f"端口转发已应用: {name} -> {ip} ({', '.join(port_spec(s, e) for s, e in entry.host_ports())})")
+
+    def remove(self, name: str) -> bool:
+        """删除容器的全部转发规则"""
+        return bool(self.remove_many([name]))
+
+    def remove_many(self, names: List[str]) -> List[str]:
+        """在一次 iptables-restore 中删除多个容器的转发规则, 返回原来有规则的容器"""
+        old = self._change({name: None for name in names}, [])
+        for name in old:
+            print(f"已删除容器 {name} 的端口转发")
+        return list(old)
+
+    # ---------- 查询 ----------
+
+    def owner(self, port: int, proto: str = 'tcp') -> Optional[str]:
+        """主机端口当前转发到的容器"""
+        with self._lock:
+            for entry in self._forwards.values():
+                for rule_proto, start, end, _ in entry.rules:
+                    if rule_proto == proto and start <= port <= end:
+                        return entry.name
+        return None
+
+    def forwards(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: entry.to_dict() for name, entry in self._forwards.items()}
+
+
+# 全局端口转发管理器
+port_forwards = PortForwardManager(settings.PORT_FORWARD_CHAIN, settings.PORT_FORWARD_LOCK_FILE)
+async_port_forwards = AsyncFacade(port_forwards, lxd_executor)
@@ -0,0 +1,201 @@
+"""容器监控探针 - 负载/磁盘/压力等容器内部指标的采集后端"""
+import os
+from typing import Awaitable, Callable, Dict, Optional
+
+from config import settings
+from services.executor import command_runner
+
+GB = 1024 ** 3
+
+
+def _empty_disk() -> Dict:
+    return {'total': 0, 'used': 0, 'percent': 0}
+
+
+class ExecProbe:
+    """通过 lxc exec 进入容器读取 /proc/loadavg 和 df (每个容器两个子进程)"""
+
+    name = "exec"
+
+    async def probe(self, container_name: str, stats: Dict) -> Dict:
+        return {
+            'load_average': await self._get_container_load(container_name),
+            'disk': await self._get_container_disk(container_name)
+        }
+
+    async def _get_container_load(self, container_name: str) -> float:
+        """获取容器负载"""
+        try:
+            result = await command_runner.run(
+                ['lxc', 'exec', container_name, '--', 'cat', '/proc/loadavg'],
+                timeout=5
+            )
+            if result.returncode == 0:
+                load_str = result.stdout.strip().split()[0]
+                return float(load_str)
+        except Exception:
+            pass
+        return 0.0
+
+    async def _get_container_disk(self, container_name: str) -> Dict:
+        """获取容器磁盘使用"""
+        try:
+            result = await command_runner.run(
+                ['lxc', 'exec', container_name, '--', 'df', '-BG', '/'],
+                timeout=5
+            )
+            if result.returncode == 0:
+                lines = result.stdout.strip().split('\n')
+                if len(lines) > 1:
+                    parts = lines[1].split()
+                    total = float(parts[1].replace('G', ''))
+                    used = float(parts[2].replace('G', ''))
+                    percent = float(parts[4].replace('%', ''))
+                    return {'total': total, 'used': used, 'percent': percent}
+        except Exception:
+            pass
+        return _empty_disk()
+
+
+class CgroupProbe:
+    """
+    从宿主机读取容器的cgroup v2文件获取CPU/内存/PSI压力/IO,
+    磁盘用量取自实例state或LXD存储卷state API, 不创建任何子进程
+
+    sysfs文件位于内存中, 读取不会阻塞, 因此直接在事件循环中读取。
+    """
+
+    name = "cgroup"
+
+    def __init__(
+        self,
+        root: str,
+        path_template: str,
+        volume_usage: Optional[Callable[[str, str], Awaitable[Dict]]] = None
+    ):
+        self.root = root
+        self.path_template = path_template
+        self._volume_usage = volume_usage
+
+    def cgroup_path(self, container_name: str) -> str:
+        return os.path.join(self.root, self.path_template.format(name=container_name))
+
+    async def probe(self, container_name: str, stats: Dict) -> Dict:
+        result = self.read_cgroup(container_name)
+        result['load_average'] = None  # cgroup中没有loadavg, 以PSI压力代替
+        result['disk'] = await self._get_disk(container_name, stats)
+        return result
+
+    def read_cgroup(self, container_name: str) -> Dict:
+        """读取单个容器的cgroup指标"""
+        path = self.cgroup_path(container_name)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"cgroup目录不存在: {path}")
+
+        result = {}
+        cpu_stat = self._read_keyed(os.path.join(path, 'cpu.stat'))
+        if 'usage_usec' in cpu_stat:
+            result['cpu_usage'] = cpu_stat['usage_usec'] / 1000000  # 转换为秒
+
+        memory_current = self._read_int(os.path.join(path, 'memory.current'))
+        if memory_current is not None:
+            result['memory_usage'] = memory_current / (1024 * 1024)  # 转换为MB
+            memory_max = self._read_int(os.path.join(path, 'memory.max'))
+            if memory_max:
+                result['memory_total'] = memory_max / (1024 * 1024)
+
+        for resource in ('cpu', 'memory', 'io'):
+            pressure = self._read_pressure(os.path.join(path, f'{resource}.pressure'))
+            if pressure is not None:
+                result[f'{resource}_pressure'] = pressure
+
+        io_read, io_write = self._read_io_stat(os.path.join(path, 'io.stat'))
+        result['io_read_bytes'] = io_read
+        result['io_write_bytes'] = io_write
+        return result
+
+    async def _get_disk(self, container_name: str, stats: Dict) -> Dict:
+        """优先使用批量state中的根磁盘用量, 缺少配额信息时查询存储卷state"""
+        used = stats.get('disk_used')
+        total = stats.get('disk_total')
+        if not total and self._volume_usage and stats.get('pool'):
+            try:
+                usage = await self._volume_usage(container_name, stats['pool'])
+                used, total = usage.get('used'), usage.get('total')
+            except Exception:
+                pass
+        if not used:
+            return _empty_disk()
+        total = total if total and total > 0 else 0
+        return {
+            'total': round(total / GB, 2),
+            'used': round(used / GB, 2),
+            'percent': round(used / total * 100, 1) if total else 0
+        }
+
+    @staticmethod
+    def _read_text(path: str) -> Optional[str]:
+        try:
+            with open(path) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _read_int(self, path: str) -> Optional[int]:
+        """读取单值文件, 'max' 视为无限制返回0"""
+        text = self._read_text(path)
+        if text is None:
+            return None
+        text = text.strip()
+        if text == 'max':
+            return 0
+        try:
+            return int(text)
+        except ValueError:
+            return None
+
+    def _read_keyed(self, path: str) -> Dict[str, int]:
+        """读取 'key value' 格式的文件, 如 cpu.stat"""
+        text = self._read_text(path) or ''
+        values = {}
+        for line in text.splitlines():
+            parts = line.split()
+            if len(parts) == 2 and parts[1].isdigit():
+                values[parts[0]] = int(parts[1])
+        return values
+
+    def _read_pressure(self, path: str) -> Optional[float]:
+        """读取PSI文件中 some 行的 avg10 (最近10秒受阻时间百分比)"""
+        text = self._read_text(path)
+        if text is None:
+            return None
+        for line in text.splitlines():
+            if line.startswith('some '):
+                for field in line.split()[1:]:
+                    key, _, value = field.partition('=')
+                    if key == 'avg10':
+                        return float(value)
+        return None
+
+    def _read_io_stat(self, path: str):
+        """汇总io.stat中所有设备的读写字节数"""
+        text = self._read_text(path) or ''
+        read_bytes = 0
+        write_bytes = 0
+        for line in text.splitlines():
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key == 'rbytes':
+                    read_bytes += int(value)
+                elif key == 'wbytes':
+                    write_bytes += int(value)
+        return read_bytes, write_bytes
+
+
+def create_probe(volume_usage: Optional[Callable[[str, str], Awaitable[Dict]]] = None):
+    """根据配置创建探针, 宿主机不是cgroup v2时回退到lxc exec"""
+    if settings.MONITOR_PROBE_BACKEND == "cgroup":
+        if os.path.exists(os.path.join(settings.CGROUP_ROOT, 'cgroup.controllers')):
+            return CgroupProbe(settings.CGROUP_ROOT, settings.CGROUP_PATH_TEMPLATE, volume_usage)
+        print(f"{settings.CGROUP_ROOT} 不是cgroup v2层级, 监控探针回退到lxc exec")
+    return ExecProbe()
@@ -0,0 +1,51 @@
+"""监控样本批量写入"""
+import time
+from typing import Dict, List
+
+from database.db import AsyncSessionLocal
+from database.monitoring_store import monitoring_store
+from config import settings
+
+
+class SampleWriter:
+    """
+    缓冲监控样本, 按日分区以 INSERT ... executemany 批量写入
+
+    采集器每轮结束调用 flush(); 缓冲超过 MONITOR_WRITE_BATCH 行时提前写入,
+    避免单次事务过大。
+    """
+
+    def __init__(self):
+        self._buffer: List[Dict] = []
+        self.rows_written = 0
+        self.last_flush_rows = 0
+        self.last_flush_seconds = 0.0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def add_many(self, rows: List[Dict]):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= settings.MONITOR_WRITE_BATCH:
+            await self.flush()
+
+    async def flush(self):
+        """将缓冲的样本在一个事务中写入"""
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as session:
+            await monitoring_store.insert_rows(session, rows)
+            await session.commit()
+        self.last_flush_rows = len(rows)
+        self.last_flush_seconds = round(time.perf_counter() - started, 4)
+        self.rows_written += len(rows)
+
+    def stats(self) -> Dict:
+        return {
+            'buffered': len(self._buffer),
+            'rows_written': self.rows_written,
+            'last_flush_rows': self.last_flush_rows,
+            'last_flush_seconds': self.last_flush_seconds
+        }
@@ -0,0 +1,167 @@
+"""
+黄金模板 - 每个系统预先制作一个装好软件、配置好sshd的模板容器
+
+新容器从模板的快照复制 (ZFS/btrfs存储池上是写时复制, 几乎不占时间和空间),
+cloud-init 只需设置root密码, 不再在每个容器首次启动时安装软件包。
+模板制作完成前执行 cloud-init clean, 复制出的容器首次启动时会重新生成SSH主机密钥。
+"""
+import re
+import time
+from typing import Dict, List, Optional
+
+import pylxd
+
+from config import settings
+from services.executor import AsyncFacade, lxd_executor
+from services.image_cache import image_cache
+
+TEMPLATE_PREFIX = 'tpl-'
+TEMPLATE_SNAPSHOT = 'golden'
+TEMPLATE_OS_KEY = 'user.panel.template'  # 模板容器上记录其系统, 值为 os_type/os_version
+
+# 模板中预装的软件包与sshd配置
+TEMPLATE_USER_DATA = """#cloud-config
+packages:
+  - openssh-server
+  - curl
+  - wget
+  - vim
+
+runcmd:
+  - sed -i 's/#PermitRootLogin prohibit-password/PermitRootLogin yes/g' /etc/ssh/sshd_config
+  - sed -i 's/PasswordAuthentication no/PasswordAuthentication yes/g' /etc/ssh/sshd_config
+  - systemctl enable ssh || systemctl enable sshd
+"""
+
+
+def template_name(os_type: str, os_version: str) -> str:
+    """模板容器名, 如 tpl-ubuntu-22-04"""
+    return TEMPLATE_PREFIX + re.sub(r'[^a-z0-9]+', '-', f'{os_type}-{os_version}'.lower()).strip('-')
+
+
+def is_template(name: str) -> bool:
+    return name.startswith(TEMPLATE_PREFIX)
+
+
+class TemplateService:
+    def __init__(self):
+        try:
+            self.client = pylxd.Client()
+        except:
+            self.client = None
+
+    def snapshot_source(self, os_type: str, os_version: str) -> Optional[str]:
+        """模板快照已制作好时返回复制来源 "<模板>/<快照>", 否则返回None"""
+        name = template_name(os_type, os_version)
+        try:
+            self.client.api.containers[name].snapshots[TEMPLATE_SNAPSHOT].get()
+        except pylxd.exceptions.NotFound:
+            return None
+        return f'{name}/{TEMPLATE_SNAPSHOT}'
+
+    def list_templates(self) -> List[Dict]:
+        templates = []
+        for container in self.client.containers.all():
+            if not is_template(container.name):
+                continue
+            snapshots = {s.name: s for s in container.snapshots.all()}
+            golden = snapshots.get(TEMPLATE_SNAPSHOT)
+            templates.append({
+                'name': container.name,
+                'os': container.config.get(TEMPLATE_OS_KEY),
+                'status': container.status,
+                'ready': golden is not None,
+                'baked_at': golden.created_at if golden else None
+            })
+        return templates
+
+    # ---------- 制作 ----------
+
+    def create_template(self, os_type: str, os_version: str):
+        """阶段1: 从(缓存的)镜像创建模板容器, 已存在的旧模板先删除"""
+        name = template_name(os_type, os_version)
+        self.delete_template(name)
+        if settings.IMAGE_CACHE_ENABLED:
+            image_cache.ensure(f'{os_type}/{os_version}')
+        config = {
+            'name': name,
+            'source': image_cache.source(os_type, os_version),
+            'config': {
+                'user.user-data': TEMPLATE_USER_DATA,
+                TEMPLATE_OS_KEY: f'{os_type}/{os_version}'
+            },
+            'devices': {
+                'root': {'path': '/', 'pool': settings.STORAGE_POOL, 'type': 'disk'},
+                'eth0': {'name': 'eth0', 'nictype': 'bridged', 'parent': 'lxdbr0', 'type': 'nic'}
+            }
+        }
+        print(f"正在创建模板 {name}...")
+        self.client.containers.create(config, wait=True)
+        return name
+
+    def provision(self, name: str):
+        """阶段2: 启动并等待cloud-init装完软件, 然后清理cloud-init状态并停止"""
+        container = self.client.containers.get(name)
+        if container.status != 'Running':
+            container.start(wait=True)
+        deadline = time.monotonic() + settings.TEMPLATE_BAKE_TIMEOUT
+        while True:
+            # 刚启动时cloud-init可能还未就绪, 命令失败则稍后重试
+            result = container.execute(['cloud-init', 'status', '--wait'])
+            if result.exit_code in (0, 2):  # 2: 完成但有可恢复的警告
+                break
+            if time.monotonic() >= deadline:
+                raise Exception(f"模板 {name} 初始化超时: {result.stdout or result.stderr}")
+            time.sleep(5)
+        container.execute(['cloud-init', 'clean', '--logs'])
+        container.stop(wait=True)
+
+    def snapshot(self, name: str):
+        """阶段3: 制作黄金快照"""
+        container = self.client.containers.get(name)
+        if TEMPLATE_SNAPSHOT not in [s.name for s in container.snapshots.all()]:
+            container.snapshots.create(TEMPLATE_SNAPSHOT, stateful=False, wait=True)
+
+    def delete_template(self, name: str) -> bool:
+        if not is_template(name):
+            raise ValueError(f"{name} 不是模板容器")
+        try:
+            container = self.client.containers.get(name)
+        except pylxd.exceptions.NotFound:
+            return False
+        if container.status == 'Running':
+            container.stop(wait=True)
+        container.delete(wait=True)
+        return True
+
+
+# 全局模板服务
+template_service = TemplateService()
+async_template_service = AsyncFacade(template_service, lxd_executor)
+
+
+async def bake_template_job(job) -> Dict:
+    """模板制作任务: create -> provision -> snapshot"""
+    if not template_service.client:
+        raise Exception('LXD客户端初始化失败，请确保LXD已安装并运行')
+
+    os_type = job.params['os_type']
+    os_version = job.params['os_version']
+    name = template_name(os_type, os_version)
+
+    if not job.stage_done('create'):
+        await job.update('create', 10, f'正在创建模板 {name}')
+        await async_template_service.create_template(os_type, os_version)
+        await job.complete_stage('create')
+
+    if not job.stage_done('provision'):
+        await job.update('provision', 30, '正在安装软件包并配置sshd')
+        await async_template_service.provision(name)
+        await job.complete_stage('provision')
+
+    if not job.stage_done('snapshot'):
+        await job.update('snapshot', 90, '正在制作快照')
+        await async_template_service.snapshot(name)
+        await job.complete_stage('snapshot')
+
+    return {'name': name, 'source': f'{name}/{TEMPLATE_SNAPSHOT}'}
@@ -0,0 +1,235 @@
+"""
+VNC代理 - 在浏览器WebSocket和容器VNC端口之间双向转发
+
+容器一侧不用 StreamReader (每次read都分配新的bytes并在内部缓冲区间拷贝),
+而是 BufferedProtocol: 内核数据直接写入每个会话预分配的缓冲区,
+两次发送之间到达的数据合并为一个WebSocket消息发出。
+
+流控:
+  容器 -> 浏览器: 浏览器接收慢时缓冲区被写满, 暂停读取容器socket, 由TCP窗口让VNC服务器减速
+  浏览器 -> 容器: 容器一侧发送缓冲超过高水位时暂停接收WebSocket消息, 直到缓冲排空
+"""
+import asyncio
+import itertools
+import secrets
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import WebSocketDisconnect
+from sqlalchemy import delete, select
+
+from config import settings
+from database.db import AsyncSessionLocal
+from database.models import VNCToken
+
+
+class VNCTokenStore:
+    """一次性、会过期的VNC令牌"""
+
+    async def issue(self, container_name: str, username: str) -> Dict:
+        now = datetime.utcnow()
+        token = secrets.token_urlsafe(32)
+        async with AsyncSessionLocal() as session:
+            # 顺便清理过期令牌
+            await session.execute(delete(VNCToken).where(VNCToken.expires_at <= now))
+            session.add(VNCToken(
+                token=token,
+                container_name=container_name,
+                username=username,
+                expires_at=now + timedelta(seconds=settings.VNC_TOKEN_TTL)
+            ))
+            await session.commit()
+        return {'token': token, 'expires_in': settings.VNC_TOKEN_TTL}
+
+    async def consume(self, token: str, container_name: str) -> Optional[str]:
+        """校验并作废令牌, 返回签发给的用户名; 无效、过期或已被使用时返回None"""
+        async with AsyncSessionLocal() as session:
+            row = (await session.execute(select(VNCToken).where(VNCToken.token == token))).scalar_one_or_none()
+            if row is None:
+                return None
+            # 以DELETE影响的行数判断, 多个进程同时使用同一令牌时只有一个成功
+            result = await session.execute(delete(VNCToken).where(VNCToken.token == token))
+            await session.commit()
+        if result.rowcount != 1 or row.container_name != container_name or row.expires_at <= datetime.utcnow():
+            return None
+        return row.username
+
+
+class UpstreamProtocol(asyncio.BufferedProtocol):
+    """容器VNC端口一侧的连接, 接收到的数据直接写入预分配的缓冲区"""
+
+    def __init__(self, buffer_size: int):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.transport: Optional[asyncio.Transport] = None
+        self.closed = False
+        self.read_paused = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    # ---------- 事件回调 ----------
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=len(self.buffer))
+
+    def get_buffer(self, sizehint: int):
+        return self.view[self.filled:]
+
+    def buffer_updated(self, nbytes: int):
+        self.filled += nbytes
+        self._readable.set()
+        if self.filled == len(self.buffer):
+            # 缓冲区已满: 浏览器一侧取走数据之前不再读取
+            self.transport.pause_reading()
+            self.read_paused = True
+
+    def eof_received(self):
+        self.closed = True
+        self._readable.set()
+        return False
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._readable.set()
+        self._writable.set()
+
+    def pause_writing(self):
+        self._writable.clear()
+
+    def resume_writing(self):
+        self._writable.set()
+
+    # ---------- 供转发循环使用 ----------
+
+    async def read(self) -> Optional[bytes]:
+        """取出缓冲区中已到达的全部数据; 连接关闭且无剩余数据时返回None"""
+        while not self.filled:
+            if self.closed:
+                return None
+            self._readable.clear()
+            await self._readable.wait()
+        data = bytes(self.view[:self.filled])
+        self.filled = 0
+        if self.read_paused and not self.closed:
+            self.read_paused = False
+            self.transport.resume_reading()
+        return data
+
+    async def write(self, data: bytes):
+        """写入容器一侧, 发送缓冲超过高水位时等待排空"""
+        if self.closed:
+            raise ConnectionResetError("VNC服务器已断开")
+        self.transport.write(data)
+        await self._writable.wait()
+
+    def close(self):
+        if self.transport and not self.transport.is_closing():
+            self.transport.close()
+
+
+class VNCProxy:
+    """管理本进程中的全部VNC转发会话"""
+
+    def __init__(self):
+        self.sessions: Dict[int, Dict] = {}
+        self._ids = itertools.count(1)
+        self._total = 0
+        self._rejected = 0
+        self._reserved = 0  # 已占用的名额, 含尚在握手中的连接
+        self._bytes_up = 0
+        self._bytes_down = 0
+
+    def reserve(self) -> bool:
+        """
+        握手开始时占用一个会话名额, 已达上限时返回False;
+        检查与占用之间没有await, 并发的握手不会同时通过检查。调用方必须在结束时 release()
+        """
+        if self._reserved >= settings.VNC_MAX_SESSIONS:
+            self._rejected += 1
+            return False
+        self._reserved += 1
+        return True
+
+    def release(self):
+        self._reserved -= 1
+
+    async def connect(self, host: str, port: int) -> UpstreamProtocol:
+        loop = asyncio.get_running_loop()
+        _, protocol = await asyncio.wait_for(
+            loop.create_connection(lambda: UpstreamProtocol(settings.VNC_BUFFER_SIZE), host, port),
+            settings.VNC_CONNECT_TIMEOUT
+        )
+        return protocol
+
+    async def relay(self, websocket, upstream: UpstreamProtocol, container_name: str, username: str) -> Dict:
+        """
+        双向转发直到任一方断开, 返回本会话的字节数
+        websocket 只需提供 receive() 和 send_bytes() (Starlette WebSocket)
+        """
+        session_id = next(self._ids)
+        session = {
+            'container': container_name,
+            'username': username,
+            'started_at': time.time(),
+            'bytes_up': 0,  # 浏览器 -> 容器
+            'bytes_down': 0  # 容器 -> 浏览器
+        }
+        self.sessions[session_id] = session
+        self._total += 1
+
+        async def upstream_to_client():
+            while True:
+                data = await upstream.read()
+                if data is None:
+                    return
+                await websocket.send_bytes(data)
+                session['bytes_down'] += len(data)
+
+        async def client_to_upstream():
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                data = message.get('bytes')
+                if data is None and message.get('text'):
+                    data = message['text'].encode()
+                if data:
+                    await upstream.write(data)
+                    session['bytes_up'] += len(data)
+
+        tasks = [asyncio.create_task(upstream_to_client()), asyncio.create_task(client_to_upstream())]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error and not isinstance(error, (ConnectionError, WebSocketDisconnect)):
+                    print(f"VNC转发错误 ({container_name}): {str(error)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            upstream.close()
+            self.sessions.pop(session_id, None)
+            self._bytes_up += session['bytes_up']
+            self._bytes_down += session['bytes_down']
+        return {'bytes_up': session['bytes_up'], 'bytes_down': session['bytes_down']}
+
+    def stats(self) -> Dict:
+        return {
+            'active': len(self.sessions),
+            'reserved': self._reserved,
+            'max_sessions': settings.VNC_MAX_SESSIONS,
+            'total': self._total,
+            'rejected': self._rejected,
+            'bytes_up': self._bytes_up + sum(s['bytes_up'] for s in self.sessions.values()),
+            'bytes_down': self._bytes_down + sum(s['bytes_down'] for s in self.sessions.values())
+        }
+
+
+# 全局实例
+vnc_tokens = VNCTokenStore()
+vnc_proxy = VNCProxy()
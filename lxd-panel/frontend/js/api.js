@@ -45,6 +45,9 @@ class APIClient {
                 throw new Error(error.detail || '请求失败');
             }
 
+            if (options.binary) {
+                return await response.arrayBuffer();
+            }
             return await response.json();
         } catch (error) {
             console.error('API请求错误:', error);
@@ -114,6 +117,14 @@ class APIClient {
         return this.post('/containers', config);
     }
 
+    async bulkCreateContainers(spec) {
+        return this.post('/containers/bulk', spec);
+    }
+
+    async bulkContainerAction(spec) {
+        return this.post('/containers/bulk/actions', spec);
+    }
+
     async startContainer(name) {
         return this.post(`/containers/${name}/start`);
     }
@@ -137,13 +148,45 @@ class APIClient {
         return this.delete(`/containers/${name}`);
     }
 
+    async suggestPorts(size, start = null, end = null) {
+        let query = `size=${size}`;
+        if (start) query += `&start=${start}`;
+        if (end) query += `&end=${end}`;
+        return this.get(`/containers/ports/free?${query}`);
+    }
+
+    async uploadFile(name, path, file, append = false) {
+        // 请求体直接使用File对象, 浏览器从磁盘流式读取
+        const query = new URLSearchParams({ path, append });
+        return this.request(`/containers/${name}/files?${query}`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/octet-stream' },
+            body: file
+        });
+    }
+
+    // 后台任务相关
+    async getJob(jobId) {
+        return this.get(`/jobs/${jobId}`);
+    }
+
     // 监控相关
     async getCurrentStats(name) {
         return this.get(`/monitoring/${name}/current`);
     }
 
-    async getHistoryStats(name, hours = 24) {
-        return this.get(`/monitoring/${name}/history?hours=${hours}`);
+    async getHistoryStats(name, hours = 24, maxPoints = null) {
+        const query = maxPoints ? `&max_points=${maxPoints}` : '';
+        return this.get(`/monitoring/${name}/history?hours=${hours}${query}`);
+    }
+
+    // 历史数据的float32二进制帧 (多个容器名用逗号分隔)
+    async getHistoryBinary(names, hours = 24, maxPoints = null) {
+        const query = maxPoints ? `&max_points=${maxPoints}` : '';
+        return this.request(
+            `/monitoring/history?names=${encodeURIComponent(names)}&hours=${hours}${query}&format=binary`,
+            { method: 'GET', binary: true }
+        );
     }
 
     // VNC相关
@@ -59,6 +59,9 @@ const Auth = {
         try {
             await api.logout();
         } finally {
+            if (window.Monitoring) {
+                Monitoring.disconnectStream();
+            }
             this.showLoginPage();
         }
     },
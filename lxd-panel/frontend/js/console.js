@@ -0,0 +1,92 @@
+// Web终端模块 (xterm.js, 经由 /api/containers/{name}/console 连接容器的shell)
+const WebConsole = {
+    term: null,
+    fitAddon: null,
+    websocket: null,
+    encoder: new TextEncoder(),
+
+    // 打开终端
+    open(name) {
+        this.close();
+        document.getElementById('console-title').textContent = `终端: ${name}`;
+        document.getElementById('console-modal').classList.add('active');
+
+        const screen = document.getElementById('console-screen');
+        screen.innerHTML = '';
+        this.term = new Terminal({ cursorBlink: true, fontSize: 14, scrollback: 5000 });
+        this.fitAddon = new FitAddon.FitAddon();
+        this.term.loadAddon(this.fitAddon);
+        this.term.open(screen);
+        this.fitAddon.fit();
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const url = `${protocol}//${window.location.host}/api/containers/${encodeURIComponent(name)}/console`
+            + `?token=${encodeURIComponent(api.token)}&cols=${this.term.cols}&rows=${this.term.rows}`;
+        const websocket = new WebSocket(url);
+        websocket.binaryType = 'arraybuffer';
+        this.websocket = websocket;
+
+        // 终端字节流走二进制帧, 调整窗口大小走文本帧
+        websocket.onmessage = (event) => {
+            if (event.data instanceof ArrayBuffer) {
+                this.term.write(new Uint8Array(event.data));
+            }
+        };
+        websocket.onclose = (event) => {
+            if (this.websocket !== websocket) return;
+            const reason = event.reason ? `: ${event.reason}` : '';
+            this.term.write(`\r\n\x1b[33m[连接已关闭${reason}]\x1b[0m\r\n`);
+        };
+        this.term.onData(data => {
+            if (websocket.readyState === WebSocket.OPEN) {
+                websocket.send(this.encoder.encode(data));
+            }
+        });
+        this.term.onResize(({ cols, rows }) => {
+            if (websocket.readyState === WebSocket.OPEN) {
+                websocket.send(JSON.stringify({ type: 'resize', cols, rows }));
+            }
+        });
+        window.addEventListener('resize', this.fit);
+        this.term.focus();
+    },
+
+    fit() {
+        if (WebConsole.fitAddon) {
+            WebConsole.fitAddon.fit();
+        }
+    },
+
+    // 关闭终端
+    close() {
+        window.removeEventListener('resize', this.fit);
+        if (this.websocket) {
+            const websocket = this.websocket;
+            this.websocket = null;
+            websocket.close();
+        }
+        if (this.term) {
+            this.term.dispose();
+            this.term = null;
+            this.fitAddon = null;
+        }
+    }
+};
+
+// 全局函数
+function closeConsoleModal() {
+    document.getElementById('console-modal').classList.remove('active');
+    WebConsole.close();
+}
+
+// 终端按钮点击事件
+document.addEventListener('DOMContentLoaded', () => {
+    const consoleBtn = document.getElementById('console-btn');
+    if (consoleBtn) {
+        consoleBtn.addEventListener('click', () => {
+            if (Containers.currentContainer) {
+                WebConsole.open(Containers.currentContainer);
+            }
+        });
+    }
+});
@@ -8,6 +8,12 @@ const Containers = {
             const containers = await api.listContainers();
             this.renderContainerList(containers);
             this.updateResourceSummary(containers);
+
+            // 卡片上的实时使用率由监控数据流推送
+            if (window.Monitoring) {
+                Object.entries(Monitoring.live).forEach(([name, stats]) => this.updateLiveStats(name, stats));
+                Monitoring.connectStream();
+            }
         } catch (error) {
             console.error('加载容器列表失败:', error);
             alert('加载容器列表失败: ' + error.message);
@@ -48,6 +54,10 @@ const Containers = {
                         <span class="label">SSH端口:</span>
                         <span>${container.ssh_port || '--'}</span>
                     </div>
+                    <div class="stat-row">
+                        <span class="label">使用率:</span>
+                        <span id="live-${container.name}">--</span>
+                    </div>
                 </div>
                 <div class="container-actions" onclick="event.stopPropagation()">
                     ${container.status === 'Running'
@@ -61,6 +71,19 @@ const Containers = {
         `).join('');
     },
 
+    // 更新卡片上的实时使用率
+    updateLiveStats(name, stats) {
+        const span = document.getElementById(`live-${name}`);
+        if (!span) return;
+        if (!stats) {
+            span.textContent = '--';
+            return;
+        }
+        const cpu = (stats.cpu_usage || 0).toFixed(1);
+        const memory = (stats.memory?.percent || 0).toFixed(1);
+        span.textContent = `CPU ${cpu}% · 内存 ${memory}%`;
+    },
+
     // 更新资源汇总
     updateResourceSummary(containers) {
         let totalCPU = 0;
@@ -152,13 +175,50 @@ const Containers = {
     // 创建容器
     async createContainer(config) {
         try {
-            await api.createContainer(config);
-            alert('容器创建成功!');
+            const { job_id } = await api.createContainer(config);
             closeCreateModal();
             this.loadContainers();
+
+            const job = await this.waitForJob(job_id);
+            if (job.status === 'succeeded') {
+                const data = job.result || {};
+                alert(`容器创建成功！\n\n连接信息：\nIP: ${data.ip || 'N/A'}\nSSH端口: ${data.ssh_port || '未转发 (使用面板终端)'}\nroot密码: ${data.password || 'N/A'}\n\n请妥善保管密码！`);
+            } else {
+                alert('创建失败: ' + (job.error || job.message));
+            }
+            this.loadContainers();
         } catch (error) {
             alert('创建失败: ' + error.message);
         }
+    },
+
+    // 为创建表单填入空闲的SSH端口和NAT端口段 (NAT未填写时默认20个端口)
+    async suggestPorts() {
+        try {
+            const natStart = parseInt(document.getElementById('create-nat-start').value) || 0;
+            const natEnd = parseInt(document.getElementById('create-nat-end').value) || 0;
+            const natSize = natStart > 0 && natEnd >= natStart ? natEnd - natStart + 1 : 20;
+
+            const ssh = await api.suggestPorts(1, 20001, 29999);
+            document.getElementById('create-ssh-port').value = ssh.start;
+
+            const nat = await api.suggestPorts(natSize, 30000);
+            document.getElementById('create-nat-start').value = nat.start;
+            document.getElementById('create-nat-end').value = nat.end;
+        } catch (error) {
+            alert('获取空闲端口失败: ' + error.message);
+        }
+    },
+
+    // 轮询后台任务直到结束
+    async waitForJob(jobId) {
+        while (true) {
+            const job = await api.getJob(jobId);
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
     }
 };
 
@@ -201,9 +261,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 disk: parseInt(document.getElementById('create-disk').value),
                 os_type: osType,
                 os_version: osVersion,
-                ssh_port: parseInt(document.getElementById('create-ssh-port').value),
-                nat_start: 0,
-                nat_end: 0,
+                ssh_port: parseInt(document.getElementById('create-ssh-port').value) || 0,
+                nat_start: parseInt(document.getElementById('create-nat-start').value) || 0,
+                nat_end: parseInt(document.getElementById('create-nat-end').value) || 0,
                 bandwidth: parseInt(document.getElementById('create-bandwidth').value)
             };
 
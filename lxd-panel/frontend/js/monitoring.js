@@ -2,20 +2,30 @@
 const Monitoring = {
     charts: {},
     websocket: null,
-    updateInterval: null,
+    reconnectTimer: null,
+    live: {},  // 容器名 -> 最新监控数据, 由数据流的快照与增量帧维护
+    realtimeName: null,  // 详情图表正在实时更新的容器
+    containerName: null,
+    hours: 24,
+    maxPoints: 500,  // 后端降采样后的最大点数, 约为图表宽度
 
-    // 加载图表
-    async loadCharts(containerName) {
+    // 加载图表 (超过24小时的范围由后端返回5分钟/1小时汇总数据)
+    async loadCharts(containerName, hours = this.hours) {
+        this.containerName = containerName;
+        this.hours = hours;
         try {
-            const history = await api.getHistoryStats(containerName, 24);
+            const buffer = await api.getHistoryBinary(containerName, hours, this.maxPoints);
+            const history = this.decodeHistoryFrames(buffer)[0];
+            if (!history) return;
 
-            // 准备数据
-            const labels = history.map(d => new Date(d.timestamp).toLocaleTimeString('zh-CN', { hour: '2-digit', minute: '2-digit' }));
-            const cpuData = history.map(d => d.cpu_usage || 0);
-            const memoryData = history.map(d => d.memory_percent || 0);
-            const networkRxData = history.map(d => d.network_rx_rate || 0);
-            const networkTxData = history.map(d => d.network_tx_rate || 0);
-            const diskData = history.map(d => d.disk_percent || 0);
+            // 准备数据 (NaN表示缺失值)
+            const series = name => Array.from(history.metrics[name] || [], v => Number.isNaN(v) ? 0 : v);
+            const labels = history.times.map(t => this.formatLabel(t));
+            const cpuData = series('cpu_usage');
+            const memoryData = series('memory_percent');
+            const networkRxData = series('network_rx_rate');
+            const networkTxData = series('network_tx_rate');
+            const diskData = series('disk_percent');
 
             // CPU图表
             this.createChart('cpu-chart', 'CPU使用率 (%)', labels, [{
@@ -67,6 +77,58 @@ const Monitoring = {
         }
     },
 
+    // 切换时间范围
+    changeRange(hours) {
+        if (this.containerName) {
+            this.loadCharts(this.containerName, parseInt(hours));
+        }
+    },
+
+    // 解析历史数据二进制帧 (格式见 backend/services/history_format.py)
+    decodeHistoryFrames(buffer) {
+        const view = new DataView(buffer);
+        const decoder = new TextDecoder();
+        const frames = [];
+        let offset = 0;
+        while (offset < buffer.byteLength) {
+            const metricCount = view.getUint16(offset + 6, true);
+            const count = view.getUint32(offset + 8, true);
+            const start = view.getFloat64(offset + 12, true);
+            const nameLength = view.getUint16(offset + 20, true);
+            const metricsLength = view.getUint16(offset + 22, true);
+            offset += 24;
+            const name = decoder.decode(new Uint8Array(buffer, offset, nameLength));
+            const metricNames = decoder.decode(new Uint8Array(buffer, offset + nameLength, metricsLength)).split(',');
+            offset += nameLength + metricsLength;
+            offset += (4 - offset % 4) % 4;
+
+            const readArray = () => {
+                const values = new Float32Array(count);
+                for (let i = 0; i < count; i++) {
+                    values[i] = view.getFloat32(offset + i * 4, true);
+                }
+                offset += count * 4;
+                return values;
+            };
+            const times = Array.from(readArray(), t => (start + t) * 1000);
+            const metrics = {};
+            for (let m = 0; m < metricCount; m++) {
+                metrics[metricNames[m]] = readArray();
+            }
+            frames.push({ name, times, metrics });
+        }
+        return frames;
+    },
+
+    // 时间轴标签: 多天范围显示日期
+    formatLabel(time) {
+        const date = new Date(time);
+        if (this.hours > 24) {
+            return date.toLocaleString('zh-CN', { month: '2-digit', day: '2-digit', hour: '2-digit', minute: '2-digit' });
+        }
+        return date.toLocaleTimeString('zh-CN', { hour: '2-digit', minute: '2-digit' });
+    },
+
     // 创建图表
     createChart(canvasId, label, labels, datasets) {
         const canvas = document.getElementById(canvasId);
@@ -121,38 +183,107 @@ const Monitoring = {
         });
     },
 
-    // 启动实时监控
-    startRealtime(containerName) {
-        this.stopRealtime();
-
-        // 使用轮询而不是WebSocket (更稳定)
-        this.updateInterval = setInterval(async () => {
-            try {
-                const stats = await api.getCurrentStats(containerName);
-                if (stats) {
-                    this.updateCharts(stats);
+    // 连接多容器实时数据流 (整个页面共用一个WebSocket, 订阅全部容器)
+    connectStream() {
+        if (this.websocket) return;
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const url = `${protocol}//${window.location.host}/api/monitoring/ws?token=${encodeURIComponent(api.token)}`;
+        const websocket = new WebSocket(url);
+
+        websocket.onopen = () => {
+            websocket.send(JSON.stringify({ action: 'subscribe', containers: 'all' }));
+            this.sendWatch();
+        };
+        websocket.onmessage = (event) => {
+            const frame = JSON.parse(event.data);
+            if (frame.type === 'snapshot') {
+                this.live = frame.containers;
+            } else if (frame.type === 'delta') {
+                for (const [name, delta] of Object.entries(frame.containers)) {
+                    this.live[name] = this.mergeDelta(this.live[name] || {}, delta);
                 }
-            } catch (error) {
-                console.error('更新监控数据失败:', error);
+                (frame.removed || []).forEach(name => delete this.live[name]);
+            } else {
+                return;
+            }
+            this.onLiveFrame(frame);
+        };
+        websocket.onclose = () => {
+            // 非主动关闭时稍后重连
+            if (this.websocket === websocket) {
+                this.websocket = null;
+                this.reconnectTimer = setTimeout(() => this.connectStream(), 5000);
+            }
+        };
+        this.websocket = websocket;
+    },
+
+    // 把增量帧中变化的字段合并到已有数据
+    mergeDelta(target, delta) {
+        for (const [key, value] of Object.entries(delta)) {
+            if (value && typeof value === 'object' && !Array.isArray(value)) {
+                target[key] = this.mergeDelta(target[key] || {}, value);
+            } else {
+                target[key] = value;
             }
-        }, 5000);  // 每5秒更新一次
+        }
+        return target;
+    },
+
+    // 收到新一帧后刷新容器卡片和正在查看的图表
+    onLiveFrame(frame) {
+        const names = frame.type === 'snapshot' ? Object.keys(this.live) : Object.keys(frame.containers);
+        names.forEach(name => {
+            if (window.Containers) {
+                Containers.updateLiveStats(name, this.live[name]);
+            }
+        });
+        if (frame.type === 'delta' && this.realtimeName && frame.containers[this.realtimeName]) {
+            this.updateCharts(this.live[this.realtimeName]);
+        }
+    },
+
+    // 告知后端正在查看详情的容器, 采集器会提高其采样频率
+    sendWatch() {
+        if (this.websocket && this.websocket.readyState === WebSocket.OPEN) {
+            const containers = this.realtimeName ? [this.realtimeName] : [];
+            this.websocket.send(JSON.stringify({ action: 'watch', containers }));
+        }
+    },
+
+    // 启动实时监控: 详情图表跟随数据流中该容器的新样本
+    startRealtime(containerName) {
+        this.realtimeName = containerName;
+        this.connectStream();
+        this.sendWatch();
     },
 
     // 停止实时监控
     stopRealtime() {
-        if (this.updateInterval) {
-            clearInterval(this.updateInterval);
-            this.updateInterval = null;
+        this.realtimeName = null;
+        this.sendWatch();
+    },
+
+    // 断开实时数据流
+    disconnectStream() {
+        if (this.reconnectTimer) {
+            clearTimeout(this.reconnectTimer);
+            this.reconnectTimer = null;
         }
 
         if (this.websocket) {
-            this.websocket.close();
+            const websocket = this.websocket;
             this.websocket = null;
+            websocket.close();
         }
     },
 
     // 更新图表数据
     updateCharts(stats) {
+        // 汇总数据的图表按时间桶展示, 不追加实时点
+        if (this.hours > 24) return;
+
         // 更新CPU图表
         if (this.charts['cpu-chart']) {
             this.addDataPoint(this.charts['cpu-chart'], stats.cpu_usage || 0);
@@ -3,6 +3,12 @@ const VNC = {
     token: null,
     websocket: null,
 
+    // 令牌对应的WebSocket地址 (转发到容器的VNC端口)
+    websocketUrl(path) {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        return `${protocol}//${window.location.host}${path}`;
+    },
+
     // 打开VNC控制台
     async openVNC(containerName) {
         try {
@@ -21,8 +27,9 @@ const VNC = {
                 <p class="vnc-notice">CentOS/RHEL: yum install tigervnc-server</p>
                 <p class="vnc-notice">然后启动VNC服务: x11vnc -display :0 -forever</p>
                 <br>
-                <p class="vnc-notice">Token: ${this.token}</p>
                 <p class="vnc-notice">容器: ${containerName}</p>
+                <p class="vnc-notice">noVNC连接地址 (${result.expires_in}秒内有效, 只能使用一次):</p>
+                <p class="vnc-notice">${this.websocketUrl(result.path)}</p>
             `;
         } catch (error) {
             alert('获取VNC令牌失败: ' + error.message);